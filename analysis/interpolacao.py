@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""Superfície de chuva em grade regular a partir dos acumulados por estação.
+
+Interpola rain_acc por IDW ou krigagem ordinária numa grade lat/lon de
+resolução configurável. As distâncias grade x estações são calculadas em
+blocos de linhas (MAX_CHUNK_BYTES), então uma grade 1000x1000 cabe em
+memória limitada. A superfície vira um PNG RGBA com world file (.pgw, para
+abrir georreferenciado em SIG) e isoietas em GeoJSON para o mapa.
+
+Uso:
+    python analysis/interpolacao.py --data-file output/chuva_24h_tratada.json --method kriging
+"""
+
+import argparse, json, math, os, struct, zlib
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_RESOLUTION_KM = 0.25
+# Margem em torno das estações na grade
+PADDING_KM = 2.0
+# Memória máxima de cada bloco de distâncias (grade x estações)
+MAX_CHUNK_BYTES = 32 * 1024 * 1024
+IDW_POWER = 2.0
+# Mesmo gradiente do HeatMap de mapa_chuva_24h.py
+GRADIENT = {0.0: "#0000ff", 0.2: "#0000ff", 0.4: "#00ffff", 0.6: "#00ff00", 0.8: "#ffff00", 1.0: "#ff0000"}
+# Abaixo disso (mm) o pixel fica transparente
+MIN_RAIN_MM = 0.1
+OVERLAY_ALPHA = 0.6
+
+
+class Surface:
+    """Grade interpolada: values[i, j] na latitude lats[i] (norte -> sul) e longitude lons[j]."""
+
+    def __init__(self, values, lats, lons, method):
+        self.values = values
+        self.lats = lats
+        self.lons = lons
+        self.method = method
+
+    @property
+    def bounds(self):
+        """[[sul, oeste], [norte, leste]] das bordas dos pixels, como no folium."""
+        dlat = abs(self.lats[1] - self.lats[0]) / 2 if len(self.lats) > 1 else 0
+        dlon = abs(self.lons[1] - self.lons[0]) / 2 if len(self.lons) > 1 else 0
+        return [[float(self.lats[-1] - dlat), float(self.lons[0] - dlon)],
+                [float(self.lats[0] + dlat), float(self.lons[-1] + dlon)]]
+
+
+class _Projection:
+    """Equiretangular em km em torno de (lat0, lon0): suficiente na escala da cidade."""
+
+    def __init__(self, lat0, lon0):
+        self.lat0, self.lon0 = lat0, lon0
+        self.ky = EARTH_RADIUS_KM * math.pi / 180
+        self.kx = self.ky * math.cos(math.radians(lat0))
+
+    def xy(self, lat, lon):
+        return (np.asarray(lon, dtype=np.float64) - self.lon0) * self.kx, \
+               (np.asarray(lat, dtype=np.float64) - self.lat0) * self.ky
+
+
+def make_grid(lat, lon, resolution_km=DEFAULT_RESOLUTION_KM, padding_km=PADDING_KM, bounds=None):
+    """(lats, lons) de uma grade regular cobrindo as estações (ou bounds [[s, o], [n, l]])."""
+    if bounds is None:
+        proj = _Projection(float(np.mean(lat)), float(np.mean(lon)))
+        pad_lat, pad_lon = padding_km / proj.ky, padding_km / proj.kx
+        bounds = [[np.min(lat) - pad_lat, np.min(lon) - pad_lon], [np.max(lat) + pad_lat, np.max(lon) + pad_lon]]
+    (south, west), (north, east) = bounds
+    proj = _Projection((south + north) / 2, (west + east) / 2)
+    ny = max(2, int(round((north - south) * proj.ky / resolution_km)) + 1)
+    nx = max(2, int(round((east - west) * proj.kx / resolution_km)) + 1)
+    return np.linspace(north, south, ny), np.linspace(west, east, nx)
+
+
+def _row_chunks(n_rows, row_cells, n_stations):
+    """Fatias de linhas da grade cujo bloco de distâncias cabe em MAX_CHUNK_BYTES."""
+    rows = max(1, MAX_CHUNK_BYTES // (8 * max(1, row_cells * n_stations)))
+    for r0 in range(0, n_rows, rows):
+        yield slice(r0, min(n_rows, r0 + rows))
+
+
+def _distances(gx, gy, sx, sy):
+    """Matriz (células x estações) de distâncias em km."""
+    return np.hypot(gx.reshape(-1, 1) - sx, gy.reshape(-1, 1) - sy)
+
+
+def idw(sx, sy, z, gx, gy, power=IDW_POWER):
+    """Inverso da distância ponderado para os pontos (gx, gy); exato nas estações."""
+    d = _distances(gx, gy, sx, sy)
+    with np.errstate(divide="ignore"):
+        w = d ** -power
+    exact = np.isinf(w)
+    hit = exact.any(axis=1)
+    w[hit] = exact[hit]
+    return (w @ z) / w.sum(axis=1)
+
+
+# Modelos de semivariograma: gamma(h) com pepita, patamar parcial e alcance
+def _spherical(h, nugget, sill, rng):
+    r = np.minimum(h / rng, 1.0)
+    return np.where(h > 0, nugget + sill * (1.5 * r - 0.5 * r ** 3), 0.0)
+
+
+def _exponential(h, nugget, sill, rng):
+    return np.where(h > 0, nugget + sill * (1 - np.exp(-3 * h / rng)), 0.0)
+
+
+VARIOGRAMS = {"spherical": _spherical, "exponential": _exponential}
+
+
+def fit_variogram(sx, sy, z, model="exponential", n_bins=8):
+    """Ajusta (pepita, patamar parcial, alcance) ao semivariograma empírico das estações.
+
+    Busca em grade de alcances com mínimos quadrados lineares (não negativos)
+    para pepita e patamar, ponderando cada classe de distância pelo nº de pares.
+    """
+    func = VARIOGRAMS[model]
+    d = _distances(sx, sy, sx, sy)
+    iu = np.triu_indices(len(z), k=1)
+    h = d[iu]
+    g = 0.5 * (z[iu[0]] - z[iu[1]]) ** 2
+    var = float(np.var(z))
+    if len(h) < 3 or var == 0:
+        return 0.0, max(var, 1e-9), max(float(h.max()) if len(h) else 1.0, 1e-3)
+
+    edges = np.linspace(0, h.max() * 0.7, n_bins + 1)
+    which = np.clip(np.digitize(h, edges) - 1, 0, n_bins - 1)
+    keep = h <= edges[-1]
+    counts = np.bincount(which[keep], minlength=n_bins)
+    lags = np.bincount(which[keep], weights=h[keep], minlength=n_bins)
+    gammas = np.bincount(which[keep], weights=g[keep], minlength=n_bins)
+    ok = counts > 0
+    lags, gammas, wts = lags[ok] / counts[ok], gammas[ok] / counts[ok], np.sqrt(counts[ok])
+
+    best = None
+    for rng in np.linspace(edges[1], h.max(), 40):
+        # gamma = pepita * 1 + patamar * forma(h)
+        shape = func(lags, 0.0, 1.0, rng)
+        A = np.column_stack([np.ones_like(lags), shape]) * wts[:, None]
+        coef, *_ = np.linalg.lstsq(A, gammas * wts, rcond=None)
+        nugget, sill = max(coef[0], 0.0), max(coef[1], 1e-9)
+        err = float(np.sum((wts * (nugget + sill * shape - gammas)) ** 2))
+        if best is None or err < best[0]:
+            best = (err, nugget, sill, float(rng))
+    return best[1], best[2], best[3]
+
+
+class OrdinaryKriging:
+    """Krigagem ordinária: o sistema (n+1)x(n+1) é invertido uma vez e reaplicado por bloco."""
+
+    def __init__(self, sx, sy, z, model="exponential"):
+        self.sx, self.sy, self.z = sx, sy, z
+        self.func = VARIOGRAMS[model]
+        self.params = fit_variogram(sx, sy, z, model)
+        n = len(z)
+        K = np.ones((n + 1, n + 1))
+        K[:n, :n] = self.func(_distances(sx, sy, sx, sy), *self.params)
+        K[n, n] = 0.0
+        self.K_inv = np.linalg.pinv(K)
+
+    def predict(self, gx, gy):
+        n = len(self.z)
+        rhs = np.ones((gx.size, n + 1))
+        rhs[:, :n] = self.func(_distances(gx, gy, self.sx, self.sy), *self.params)
+        weights = rhs @ self.K_inv.T
+        return weights[:, :n] @ self.z
+
+
+def interpolate(df, method="idw", resolution_km=DEFAULT_RESOLUTION_KM, bounds=None, skip_suspect=True,
+                power=IDW_POWER, model="exponential"):
+    """Superfície de rain_acc a partir do DataFrame por estação (lat, lon, rain_acc[, suspect])."""
+    if skip_suspect and "suspect" in df:
+        df = df[~df["suspect"].astype(bool)]
+    df = df.dropna(subset=["lat", "lon", "rain_acc"])
+    if df.empty:
+        raise ValueError("Sem estações para interpolar")
+    lat = df["lat"].to_numpy(np.float64)
+    lon = df["lon"].to_numpy(np.float64)
+    z = df["rain_acc"].to_numpy(np.float64)
+
+    lats, lons = make_grid(lat, lon, resolution_km, bounds=bounds)
+    proj = _Projection(float(lats.mean()), float(lons.mean()))
+    sx, sy = proj.xy(lat, lon)
+    gx_row, _ = proj.xy(lats[0], lons)
+    _, gy_col = proj.xy(lats, lons[0])
+
+    if method == "kriging" and len(z) >= 3:
+        predict = OrdinaryKriging(sx, sy, z, model).predict
+    elif method in ("idw", "kriging"):
+        predict = lambda gx, gy: idw(sx, sy, z, gx, gy, power)  # noqa: E731
+    else:
+        raise ValueError(f"Método desconhecido: {method}")
+
+    values = np.empty((len(lats), len(lons)))
+    for rows in _row_chunks(len(lats), len(lons), len(z)):
+        gx = np.broadcast_to(gx_row, (rows.stop - rows.start, len(lons)))
+        gy = np.broadcast_to(gy_col[rows, None], gx.shape)
+        values[rows] = predict(gx.ravel(), gy.ravel()).reshape(gx.shape)
+    # Krigagem pode extrapolar abaixo de zero entre estações secas
+    np.maximum(values, 0.0, out=values)
+    return Surface(values, lats, lons, method)
+
+
+def _hex_rgb(color):
+    return [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+
+
+def quantize(values, vmax, min_value=MIN_RAIN_MM):
+    """Índice de cor (1-255) por valor; 0 = transparente (abaixo de min_value ou NaN)."""
+    q = np.clip(np.nan_to_num(values, nan=0.0) / (vmax or 1.0), 0.0, 1.0) * 254 + 1
+    q[~(values >= min_value)] = 0
+    return q.astype(np.uint8)
+
+
+def color_table(alpha=OVERLAY_ALPHA, gradient=GRADIENT):
+    """Paleta RGBA (256 x 4) dos índices de quantize, com o gradiente do mapa."""
+    stops = sorted(gradient)
+    rgb = np.array([_hex_rgb(gradient[s]) for s in stops], dtype=np.float64)
+    t = (np.arange(256) - 1) / 254
+    table = np.empty((256, 4), dtype=np.uint8)
+    for c in range(3):
+        table[:, c] = np.interp(t, stops, rgb[:, c]).round().astype(np.uint8)
+    table[:, 3] = int(alpha * 255)
+    table[0] = 0
+    return table
+
+
+def colorize(values, vmax, alpha=OVERLAY_ALPHA, gradient=GRADIENT, min_value=MIN_RAIN_MM):
+    """Valores -> RGBA uint8 (altura x largura x 4) com o gradiente do mapa."""
+    return color_table(alpha, gradient)[quantize(values, vmax, min_value)]
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def _png(header, rows, extra=b"", level=6):
+    """Monta o PNG: rows é (altura x bytes por linha), sem o byte de filtro."""
+    raw = np.zeros((rows.shape[0], rows.shape[1] + 1), dtype=np.uint8)  # filtro 0 por linha
+    raw[:, 1:] = rows
+    return (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", header) + extra
+            + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), level)) + _png_chunk(b"IEND", b""))
+
+
+def encode_png(rgba):
+    """PNG RGBA 8 bits a partir de um array (altura x largura x 4), só com zlib."""
+    h, w, _ = rgba.shape
+    return _png(struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0), rgba.reshape(h, w * 4))
+
+
+def encode_png_indexed(indices, table, level=6):
+    """PNG com paleta (1 byte por pixel): bem menor e mais rápido que RGBA para tiles."""
+    h, w = indices.shape
+    extra = _png_chunk(b"PLTE", table[:, :3].tobytes()) + _png_chunk(b"tRNS", table[:, 3].tobytes())
+    return _png(struct.pack(">IIBBBBB", w, h, 8, 3, 0, 0, 0), indices, extra, level)
+
+
+def save_raster(surface, png_file, vmax=None):
+    """Grava o PNG e o world file (.pgw) ao lado; retorna os bounds para o overlay."""
+    vmax = vmax if vmax is not None else float(surface.values.max())
+    # Troca atômica: o servidor pode estar servindo o PNG anterior
+    tmp = png_file + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(encode_png(colorize(surface.values, vmax)))
+    os.replace(tmp, png_file)
+    (south, west), (north, east) = surface.bounds
+    px = (east - west) / len(surface.lons)
+    py = (north - south) / len(surface.lats)
+    # World file: tamanho do pixel, rotações e centro do pixel superior esquerdo
+    with open(os.path.splitext(png_file)[0] + ".pgw", "w") as f:
+        f.write(f"{px:.10f}\n0\n0\n{-py:.10f}\n{west + px / 2:.10f}\n{north - py / 2:.10f}\n")
+    return surface.bounds
+
+
+# Marching squares: caso (bits dos cantos sup.esq, sup.dir, inf.dir, inf.esq acima
+# do nível) -> pares de arestas (0 = topo, 1 = direita, 2 = base, 3 = esquerda)
+_CASES = {
+    1: [(3, 2)], 2: [(2, 1)], 3: [(3, 1)], 4: [(0, 1)], 5: [(3, 0), (2, 1)], 6: [(0, 2)], 7: [(3, 0)],
+    8: [(3, 0)], 9: [(0, 2)], 10: [(3, 2), (0, 1)], 11: [(0, 1)], 12: [(3, 1)], 13: [(2, 1)], 14: [(3, 2)],
+}
+
+
+def _contour_segments(values, level):
+    """Segmentos ((linha, coluna), (linha, coluna)) em coordenadas fracionárias da grade."""
+    tl, tr = values[:-1, :-1], values[:-1, 1:]
+    bl, br = values[1:, :-1], values[1:, 1:]
+    case = ((tl > level) * 8 + (tr > level) * 4 + (br > level) * 2 + (bl > level) * 1).astype(np.int8)
+
+    def frac(a, b):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f = (level - a) / (b - a)
+        return np.nan_to_num(np.clip(f, 0, 1), nan=0.5)
+
+    rows, cols = np.indices(case.shape, dtype=np.float64)
+    # Ponto de cruzamento em cada aresta da célula
+    edge = {
+        0: (rows, cols + frac(tl, tr)),
+        1: (rows + frac(tr, br), cols + 1),
+        2: (rows + 1, cols + frac(bl, br)),
+        3: (rows + frac(tl, bl), cols),
+    }
+    segments = []
+    for c, pairs in _CASES.items():
+        hit = case == c
+        if not hit.any():
+            continue
+        for a, b in pairs:
+            p = np.stack([edge[a][0][hit], edge[a][1][hit], edge[b][0][hit], edge[b][1][hit]], axis=1)
+            segments.append(p)
+    return np.concatenate(segments) if segments else np.empty((0, 4))
+
+
+def isohyets(surface, levels=None, n_levels=6):
+    """Isoietas como GeoJSON (FeatureCollection de MultiLineString, uma por nível em mm)."""
+    vmax = float(surface.values.max())
+    if levels is None:
+        levels = nice_levels(vmax, n_levels)
+    nlat, nlon = len(surface.lats), len(surface.lons)
+    features = []
+    for level in levels:
+        seg = _contour_segments(surface.values, level)
+        if not len(seg):
+            continue
+        lat = np.interp(seg[:, [0, 2]], np.arange(nlat), surface.lats)
+        lon = np.interp(seg[:, [1, 3]], np.arange(nlon), surface.lons)
+        coords = np.stack([lon, lat], axis=2).round(6).tolist()
+        features.append({
+            "type": "Feature",
+            "properties": {"level_mm": float(level)},
+            "geometry": {"type": "MultiLineString", "coordinates": coords},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def nice_levels(vmax, n=6):
+    """Níveis 'redondos' (1, 2, 2.5, 5 x 10^k mm) entre 0 e vmax."""
+    if vmax <= 0:
+        return []
+    raw = vmax / n
+    base = 10 ** math.floor(math.log10(raw))
+    step = next(m * base for m in (1, 2, 2.5, 5, 10) if m * base >= raw)
+    return [round(step * i, 6) for i in range(1, int(vmax / step) + 1) if step * i < vmax]
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Interpola os acumulados por estação numa grade regular")
+    parser.add_argument("--data-file", default=os.path.join(os.path.dirname(__file__), "..", "output",
+                                                            "chuva_24h_tratada.json"),
+                        help="JSON por estação (saída de mapa_chuva_24h.py)")
+    parser.add_argument("--method", choices=["idw", "kriging"], default="idw")
+    parser.add_argument("--resolution-km", type=float, default=DEFAULT_RESOLUTION_KM)
+    parser.add_argument("--keep-suspect", action="store_true", help="Usar também as estações suspeitas")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(__file__), "..", "output", "chuva_grade"),
+                        help="Prefixo de saída (.png, .pgw, _isoietas.geojson)")
+    args = parser.parse_args()
+
+    import time
+    with open(args.data_file, encoding="utf-8") as f:
+        df = pd.DataFrame(json.load(f))
+    t0 = time.perf_counter()
+    surface = interpolate(df, args.method, args.resolution_km, skip_suspect=not args.keep_suspect)
+    elapsed = time.perf_counter() - t0
+    save_raster(surface, args.output + ".png")
+    with open(args.output + "_isoietas.geojson", "w", encoding="utf-8") as f:
+        json.dump(isohyets(surface), f)
+    print(f"Grade {surface.values.shape[0]}x{surface.values.shape[1]} ({args.method}) em {elapsed:.2f}s, "
+          f"máx {surface.values.max():.1f} mm -> {args.output}.png")
+
+
+if __name__ == "__main__":
+    main()
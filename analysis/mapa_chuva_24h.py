@@ -4,7 +4,7 @@ Mapa de calor da chuva acumulada nas últimas 24h em São Carlos/SP.
 Usa dados da API HexaCloud com tratamento de outliers.
 """
 
-import sys, os, json, time
+import sys, os, json, time, gzip
 import requests
 import pandas as pd
 import numpy as np
@@ -13,59 +13,38 @@ from folium.plugins import HeatMap
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
 from auth import get_access_token, API_BASE
+import columnar
+import stations
+import store
+from acumulados import RollingAccumulator, epoch_seconds, parse_windows
+import interpolacao
+import qc
+import mapa_tiles
 
-# Estações de São Carlos (do sessions_cache)
-STATIONS = [
-    {"session": "cdcc", "device_id": "E8:07:BD:2A:DA:03", "lat": -22.01914, "lon": -47.89281},
-    {"session": "defesacivilsc01", "device_id": "83:CC:2C:26:60:4A", "lat": -22.03028, "lon": -47.88289},
-    {"session": "julianoneto", "device_id": "24:1C:9F:19:91:5E", "lat": -22.01658, "lon": -47.87471},
-    {"session": "padariagenebra", "device_id": "D5:40:CB:B0:8A:92", "lat": -21.99390, "lon": -47.89734},
-    {"session": "id1-i2c-400", "device_id": "6C:7B:A8:1D:81:23", "lat": -21.99377, "lon": -47.89967},
-    {"session": "central", "device_id": "23:3E:C5:BD:A5:FA", "lat": -22.02472, "lon": -47.88990},
-    {"session": "aracedesantoantonio", "device_id": "33:D5:90:5A:AD:F3", "lat": -21.93067, "lon": -47.93563},
-    {"session": "interpav-backup", "device_id": "E0:3F:97:2F:47:4E", "lat": -21.96485, "lon": -47.92235},
-    {"session": "soufadoalexandre", "device_id": "08:EF:22:B0:8A:86", "lat": -21.92943, "lon": -47.87267},
-    {"session": "cruzeirodosul", "device_id": "C3:E9:2E:0C:66:55", "lat": -22.04922, "lon": -47.89262},
-    {"session": "estadio-luisao", "device_id": "C3:14:CB:C1:7C:56", "lat": -22.03059, "lon": -47.90162},
-    {"session": "id1-emeja-sc", "device_id": "4A:F0:A3:25:E8:FC", "lat": -22.01587, "lon": -47.89327},
-    {"session": "alvaroguiao", "device_id": "89:6D:FF:4A:A9:51", "lat": -22.01366, "lon": -47.89011},
-    {"session": "conegomanoeltobias", "device_id": "0B:E6:EC:D0:CE:71", "lat": -22.01516, "lon": -47.88099},
-    {"session": "douradinho", "device_id": "C6:EE:F7:C8:ED:FC", "lat": -22.01823, "lon": -47.84974},
-    {"session": "id1-eldorado", "device_id": "C3:2C:CF:87:16:83", "lat": -21.98069, "lon": -47.92736},
-    {"session": "jardim-beatriz", "device_id": "7D:0F:9A:31:49:C9", "lat": -22.03499, "lon": -47.90786},
-    {"session": "espraiado", "device_id": "D1:17:71:61:03:83", "lat": -21.98914, "lon": -47.87558},
-    {"session": "stevenson02", "device_id": "82:CF:9A:99:05:7F", "lat": -22.02464, "lon": -47.88940},
-    {"session": "recreiosaojudas", "device_id": "EC:7B:BC:56:4A:CA", "lat": -22.03483, "lon": -47.86581},
-    {"session": "atheneu", "device_id": "15:7F:22:57:B7:35", "lat": -22.00565, "lon": -47.91950},
-    {"session": "kartodromo", "device_id": "EE:11:CF:60:B6:24", "lat": -21.99690, "lon": -47.89948},
-    {"session": "synnus", "device_id": "4F:74:C3:78:83:C5", "lat": -22.00079, "lon": -47.90330},
-    {"session": "interpav01", "device_id": "58:73:5A:ED:65:F5", "lat": -21.96487, "lon": -47.92259},
-    {"session": "babilonia", "device_id": "9E:6F:67:58:DA:8F", "lat": -22.02711, "lon": -47.78021},
-    {"session": "centenario", "device_id": "21:A0:1D:A9:EE:00", "lat": -21.99934, "lon": -47.90682},
-    {"session": "parqtec", "device_id": "19:04:7D:89:A9:D7", "lat": -22.00751, "lon": -47.88130},
-    {"session": "tendtudo02", "device_id": "7D:FC:BB:4F:EF:FE", "lat": -22.02464, "lon": -47.88940},
-    {"session": "trabalhocomfraternidade", "device_id": "1D:CC:75:85:9A:BB", "lat": -22.02241, "lon": -47.91130},
-    {"session": "aracy01", "device_id": "9D:D7:75:9E:F4:71", "lat": -22.05587, "lon": -47.90264},
-    {"session": "stevenson01", "device_id": "3B:4A:C0:A5:6F:B4", "lat": -22.02464, "lon": -47.88940},
-    {"session": "ct-nicolas-santos", "device_id": "AB:17:FC:E0:0C:A1", "lat": -22.03713, "lon": -47.83046},
-    {"session": "janete-lia", "device_id": "29:B0:58:38:9E:FC", "lat": -22.04112, "lon": -47.89530},
-]
-
-STATION_MAP = {s["device_id"]: s for s in STATIONS}
-REFERENCE_SESSION = "defesacivilsc01"
-REFERENCE_DEVICE = "83:CC:2C:26:60:4A"
 QUERY_URL = API_BASE.rstrip("/") + "/query"
 
-# Sessões excluídas manualmente (dados não confiáveis)
-EXCLUDED_SESSIONS = {"interpav-backup", "conegomanoeltobias"}
 
-# São Carlos centro
-SC_LAT = -22.01
-SC_LON = -47.89
-RADIUS_KM = 20
+def _registry(registry=None):
+    """Cadastro passado na chamada ou o cadastro atual do processo (stations.get()).
+
+    Lido a cada chamada, e não na importação, para que estações novas ou
+    movidas pelo stations.refresh() do servidor entrem no próximo mapa.
+    """
+    return registry if registry is not None else stations.get()
+
+
+def station_codes(device_ids, registry=None):
+    """Códigos categóricos de device_id no cadastro (-1 para devices desconhecidos)."""
+    reg = _registry(registry)
+    if isinstance(device_ids.dtype, pd.CategoricalDtype):
+        # Já categórico: traduz só as categorias, não as linhas
+        cats = device_ids.cat.categories
+        lookup = np.array([reg.code.get(c, -1) for c in cats] + [-1], dtype=np.int64)
+        return lookup[device_ids.cat.codes.to_numpy(np.int64)]
+    return pd.Categorical(device_ids, categories=reg.devices).codes.astype(np.int64)
 
 
-def treat_outlier_readings(df):
+def treat_outlier_readings(df, qc_method=qc.DEFAULT_METHOD, registry=None):
     """
     Remove leituras individuais outliers de cada estação, mantendo a estação no resultado.
 
@@ -74,108 +53,370 @@ def treat_outlier_readings(df):
        máximo razoável por leitura individual.
     2. Leituras acima desse threshold são descartadas (sensor bugado).
     3. Estações com poucas leituras (< 10% da referência) são removidas.
-    4. Sessões na lista EXCLUDED_SESSIONS são removidas.
+    4. Sessões excluídas no cadastro (excluded_sessions) são removidas.
+
+    Com qc_method="spatial", o passo 2 vira o QC espacial de qc.py: cada
+    leitura é comparada com os k vizinhos no mesmo intervalo de tempo e só as
+    leituras SPIKE são zeradas; o threshold da referência vale apenas para as
+    leituras sem vizinhos suficientes (UNCHECKED). DRY só é marcada.
+
+    Trabalha sobre os códigos categóricos de device_id e arrays NumPy; devolve
+    um DataFrame enxuto (device_id/session categóricos, time, rain, qc) em que
+    a coluna qc traz o código de qc.FLAG_NAMES de cada leitura.
     """
     print("\n=== TRATAMENTO DE OUTLIERS (por leitura individual) ===")
+    reg = _registry(registry)
 
     # 1. Excluir sessões manuais
-    session_map_inv = {s["device_id"]: s["session"] for s in STATIONS}
-    df["session"] = df["device_id"].map(session_map_inv)
-    excluded = df[df["session"].isin(EXCLUDED_SESSIONS)]
-    if len(excluded) > 0:
-        excluded_sessions = excluded["session"].unique()
+    codes = station_codes(df["device_id"], reg)
+    excluded = np.zeros(len(codes), dtype=bool)
+    known = codes >= 0
+    excluded[known] = reg.excluded[codes[known]]
+    if excluded.any():
+        excluded_sessions = reg.session[np.unique(codes[excluded])]
         print(f"Sessoes excluidas manualmente: {list(excluded_sessions)}")
-    df = df[~df["session"].isin(EXCLUDED_SESSIONS)].copy()
+    keep = ~excluded
+    codes = codes[keep]
+    rain = df["rain"].to_numpy(np.float64)[keep]
 
-    # 2. Calcular threshold a partir da referência
-    ref = df[df["device_id"] == REFERENCE_DEVICE]
-    ref_rain = ref["rain"]
-    ref_nonzero = ref_rain[ref_rain > 0]
-    ref_count = len(ref)
+    # 2. Calcular threshold a partir da referência (-1 = fora do cadastro: vale o fallback,
+    # não as leituras dos devices desconhecidos, que também têm código -1)
+    ref_rain = rain[codes == reg.reference_code] if reg.reference_code >= 0 else rain[:0]
+    ref_count = len(ref_rain)
 
-    if len(ref_nonzero) > 0:
+    if (ref_rain > 0).any():
         ref_max = ref_rain.max()
         # Threshold: 2x o máximo da referência
         threshold = ref_max * 2
-        print(f"Referencia ({REFERENCE_SESSION}): max/leitura={ref_max:.2f}mm, {ref_count} leituras")
+        print(f"Referencia ({reg.reference_session}): max/leitura={ref_max:.2f}mm, {ref_count} leituras")
         print(f"Threshold por leitura: {threshold:.2f}mm (2x max da referencia)")
     else:
         # Fallback: usar percentil global
-        all_nonzero = df["rain"][df["rain"] > 0]
-        threshold = all_nonzero.quantile(0.99) * 2 if len(all_nonzero) > 0 else 10
-        print(f"Referencia sem dados de chuva. Threshold fallback: {threshold:.2f}mm")
+        all_nonzero = rain[rain > 0]
+        threshold = np.quantile(all_nonzero, 0.99) * 2 if len(all_nonzero) > 0 else 10
+        why = "sem dados de chuva" if reg.reference_code >= 0 else "fora do cadastro"
+        print(f"Referencia {why}. Threshold fallback: {threshold:.2f}mm")
 
     # 3. Contar e remover leituras outliers por estação
-    total_before = len(df)
-    outlier_mask = df["rain"] > threshold
-    n_outliers = outlier_mask.sum()
+    total_before = len(rain)
+    if qc_method == "spatial":
+        times = epoch_seconds(df["time"][keep]) if "time" in df else None
+        flags = qc.flag_readings(codes, times, rain, reg.neighbors(qc.K), len(reg.devices))
+        # Sem vizinhos suficientes (ou device desconhecido): vale o threshold absoluto
+        flags[(flags == qc.UNCHECKED) & (rain > threshold)] = qc.THRESHOLD
+        outlier_mask = (flags == qc.SPIKE) | (flags == qc.THRESHOLD)
+        qc_counts = {name: int(c) for name, c in zip(qc.FLAG_NAMES.values(),
+                                                      np.bincount(flags, minlength=len(qc.FLAG_NAMES)))}
+        print(f"QC espacial ({qc.K} vizinhos ate {qc.MAX_KM:g}km, intervalos de {qc.BIN_S // 60}min): "
+              f"{qc_counts['spike']} picos, {qc_counts['dry']} secas com vizinhos molhados, "
+              f"{qc_counts['unchecked'] + qc_counts['threshold']} sem vizinhos suficientes")
+        dry = flags == qc.DRY
+        if dry.any():
+            count = np.bincount(codes[dry], minlength=len(reg.devices))
+            print("Leituras secas com vizinhos molhados (mantidas):")
+            for c in reg.session_order[count[reg.session_order] > 0]:
+                print(f"  {reg.session[c]}: {count[c]} leituras")
+    else:
+        outlier_mask = rain > threshold
+        flags = np.where(outlier_mask, qc.THRESHOLD, qc.OK).astype(np.int8)
+        qc_counts = None
+    n_outliers = int(outlier_mask.sum())
 
     if n_outliers > 0:
-        outlier_by_session = df[outlier_mask].groupby("session")["rain"].agg(["count", "sum", "max"])
-        print(f"\nLeituras outliers removidas (>{threshold:.2f}mm):")
-        for session, row in outlier_by_session.iterrows():
-            print(f"  {session}: {int(row['count'])} leituras removidas (max={row['max']:.1f}mm, soma_removida={row['sum']:.1f}mm)")
+        out_codes = codes[outlier_mask & (codes >= 0)]
+        out_rain = rain[outlier_mask & (codes >= 0)]
+        n = len(reg.devices)
+        count = np.bincount(out_codes, minlength=n)
+        total = np.bincount(out_codes, weights=out_rain, minlength=n)
+        peak = np.zeros(n)
+        np.maximum.at(peak, out_codes, out_rain)
+        rule = "acima dos vizinhos ou " if qc_method == "spatial" else ""
+        print(f"\nLeituras outliers removidas ({rule}>{threshold:.2f}mm):")
+        for c in reg.session_order[count[reg.session_order] > 0]:
+            print(f"  {reg.session[c]}: {count[c]} leituras removidas (max={peak[c]:.1f}mm, soma_removida={total[c]:.1f}mm)")
 
     # Zerar leituras outliers (ao invés de remover a linha, zeramos o rain)
-    df.loc[outlier_mask, "rain"] = 0.0
-
-    print(f"\nTotal: {n_outliers} leituras zeradas de {total_before}")
-    return df, ref_count, threshold
-
+    rain[outlier_mask] = 0.0
 
-def compute_accumulated_rain(df, ref_count):
-    """Calcula chuva acumulada por estação após tratamento de outliers."""
+    out = pd.DataFrame({
+        "device_id": pd.Categorical.from_codes(codes, categories=reg.devices),
+        "session": pd.Categorical.from_codes(codes, categories=reg.session),
+        "rain": rain,
+        "qc": flags,
+    })
+    if "time" in df:
+        out.insert(1, "time", df["time"].array[keep])
 
-    # Acumular chuva por device_id
-    rain_by_device = df.groupby("device_id")["rain"].sum().reset_index()
-    rain_by_device.columns = ["device_id", "rain_acc"]
+    print(f"\nTotal: {n_outliers} leituras zeradas de {total_before}")
+    out.attrs["outliers_zeroed"] = n_outliers
+    out.attrs["qc"] = qc_method
+    out.attrs["qc_counts"] = qc_counts
+    return out, ref_count, threshold
 
-    # Contagem de leituras por device
-    counts = df.groupby("device_id")["rain"].count().reset_index()
-    counts.columns = ["device_id", "n_readings"]
-    rain_by_device = rain_by_device.merge(counts, on="device_id")
 
-    # Adicionar lat/lon e session das estações
-    rain_by_device["lat"] = rain_by_device["device_id"].map(lambda d: STATION_MAP.get(d, {}).get("lat"))
-    rain_by_device["lon"] = rain_by_device["device_id"].map(lambda d: STATION_MAP.get(d, {}).get("lon"))
-    rain_by_device["session"] = rain_by_device["device_id"].map(lambda d: STATION_MAP.get(d, {}).get("session", "desconhecida"))
+def compute_accumulated_rain(df, ref_count, qc_method=qc.DEFAULT_METHOD, registry=None):
+    """Calcula chuva acumulada por estação após tratamento de outliers.
 
-    # Remover devices sem coordenadas conhecidas
-    rain_by_device = rain_by_device.dropna(subset=["lat", "lon"])
+    Soma e contagem por estação num único np.bincount sobre os códigos de
+    device_id; lat/lon/session vêm dos arrays de atributos das estações.
+    """
+    reg = _registry(registry)
+    codes = station_codes(df["device_id"], reg)
+    rain = df["rain"].to_numpy(np.float64)
+
+    # Acumular chuva e contar leituras (não nulas) por estação; devices desconhecidos
+    # não têm coordenadas e ficam de fora
+    known = codes >= 0
+    codes, rain = codes[known], rain[known]
+    valid = ~np.isnan(rain)
+    n = len(reg.devices)
+    rain_acc = np.bincount(codes, weights=np.where(valid, rain, 0.0), minlength=n)
+    n_readings = np.bincount(codes, weights=valid, minlength=n).astype(np.int64)
+    present = np.bincount(codes, minlength=n) > 0
+    return station_table(rain_acc, n_readings, present, ref_count, qc_method=qc_method, registry=reg)
+
+
+def station_table(rain_acc, n_readings, present, ref_count, verbose=True, qc_method=qc.DEFAULT_METHOD, registry=None):
+    """Aplica as regras por estação (poucas leituras, chuva negativa, suspeitas) aos
+    arrays indexados por código e monta o DataFrame de saída.
+
+    Suspeita: acumulado > 4x o da referência ou, com qc_method="spatial", muito
+    acima do acumulado dos vizinhos (qc.suspect_totals).
+    """
+    reg = _registry(registry)
+    n = len(reg.devices)
 
-    # Remover estações com poucas leituras (< 10% da referência)
+    # Remover estações com poucas leituras (< 10% da referência; sem referência no
+    # cadastro, ref_count = 0 e a regra não se aplica)
     min_readings = max(int(ref_count * 0.10), 1)
-    low = rain_by_device[rain_by_device["n_readings"] < min_readings]
-    if len(low) > 0:
-        print(f"Removidas por poucas leituras (<{min_readings}): {list(low['session'])}")
-    rain_by_device = rain_by_device[rain_by_device["n_readings"] >= min_readings].copy()
+    low = present & (n_readings < min_readings)
+    if low.any() and verbose:
+        print(f"Removidas por poucas leituras (<{min_readings}): {list(reg.session[reg.device_order[low[reg.device_order]]])}")
 
     # Remover chuva negativa
-    rain_by_device = rain_by_device[rain_by_device["rain_acc"] >= 0].copy()
+    keep = present & ~low & (rain_acc >= 0)
 
     # Marcar estações suspeitas (acumulado > 4x a referência) mas manter no mapa
-    ref_row = rain_by_device[rain_by_device["session"] == REFERENCE_SESSION]
-    rain_by_device["suspect"] = False
-    if not ref_row.empty:
-        ref_acc = ref_row["rain_acc"].values[0]
+    suspect = np.zeros(n, dtype=bool)
+    if qc_method == "spatial":
+        suspect = qc.suspect_totals(rain_acc, keep, reg.neighbors(qc.K))
+        if suspect.any() and verbose:
+            print("Marcadas como suspeitas (muito acima dos vizinhos) - mantidas no mapa:")
+            for c in reg.device_order[suspect[reg.device_order]]:
+                print(f"  {reg.session[c]}: {rain_acc[c]:.1f}mm")
+    elif reg.reference_code >= 0 and keep[reg.reference_code]:
+        ref_acc = rain_acc[reg.reference_code]
         if ref_acc > 0:
-            suspect_mask = (
-                (rain_by_device["rain_acc"] > ref_acc * 4)
-                & (rain_by_device["session"] != REFERENCE_SESSION)
-            )
-            rain_by_device.loc[suspect_mask, "suspect"] = True
-            suspect = rain_by_device[suspect_mask]
-            if len(suspect) > 0:
+            suspect = keep & (rain_acc > ref_acc * 4)
+            suspect[reg.reference_code] = False
+            if suspect.any() and verbose:
                 print(f"Marcadas como suspeitas (>4x {ref_acc:.1f}mm) - mantidas no mapa:")
-                for _, r in suspect.iterrows():
-                    print(f"  {r['session']}: {r['rain_acc']:.1f}mm")
-
-    print(f"Estacoes finais: {len(rain_by_device)}")
+                for c in reg.device_order[suspect[reg.device_order]]:
+                    print(f"  {reg.session[c]}: {rain_acc[c]:.1f}mm")
+
+    # Uma linha por estação, em ordem de device_id
+    idx = reg.device_order[keep[reg.device_order]]
+    rain_by_device = pd.DataFrame({
+        "device_id": np.asarray(reg.devices, dtype=object)[idx],
+        "rain_acc": rain_acc[idx],
+        "n_readings": n_readings[idx],
+        "lat": reg.lat[idx],
+        "lon": reg.lon[idx],
+        "session": reg.session[idx],
+        "suspect": suspect[idx],
+    })
+
+    if verbose:
+        print(f"Estacoes finais: {len(rain_by_device)}")
     return rain_by_device
 
 
-def build_heatmap(df, output_file):
-    """Gera mapa de calor interativo com Folium."""
+def accumulate_windows(df, windows, end_ts=None, qc_method=qc.DEFAULT_METHOD, registry=None):
+    """Acumulados por estação em várias janelas a partir de uma única ingestão tratada.
+
+    Retorna {nome_janela: DataFrame no formato de compute_accumulated_rain}. O
+    mínimo de leituras de cada janela é relativo às leituras da referência nela.
+    end_ts: fim das janelas (epoch); por padrão, logo após a última leitura.
+    """
+    reg = _registry(registry)
+    acc = RollingAccumulator(station_codes(df["device_id"], reg), epoch_seconds(df["time"]),
+                             df["rain"].to_numpy(np.float64), len(reg.devices))
+    tables = {}
+    for name, (rain_acc, n_readings) in acc.windows(windows, end_ts).items():
+        tables[name] = station_table(rain_acc, n_readings, n_readings > 0,
+                                     n_readings[reg.reference_code] if reg.reference_code >= 0 else 0, verbose=False,
+                                     qc_method=qc_method, registry=reg)
+    return tables
+
+
+def station_color(row, reliable, reference_session=None):
+    """Cor do marcador: suspeita, referência ou faixa relativa às estações confiáveis."""
+    if row.get("suspect", False):
+        return "gray"
+    if reference_session is None:
+        reference_session = stations.get().reference_session
+    if row["session"] == reference_session:
+        return "darkblue"
+    if row["rain_acc"] < reliable["rain_acc"].median():
+        return "green"
+    if row["rain_acc"] > reliable["rain_acc"].quantile(0.75):
+        return "red"
+    return "orange"
+
+
+def marker_props(df, max_rain=None):
+    """Estilo e textos do marcador de cada estação: {session: {...}}.
+
+    É o que add_station_markers desenha e o que o servidor manda por SSE para
+    a página atualizar os marcadores sem recarregar.
+    """
+    reliable = df[~df.get("suspect", False)]
+    if max_rain is None:
+        max_rain = df["rain_acc"].max() if len(df) else 0
+    max_rain = max_rain or 1
+    reference_session = stations.get().reference_session
+
+    props = {}
+    for _, row in df.iterrows():
+        is_suspect = bool(row.get("suspect", False))
+        color = station_color(row, reliable, reference_session)
+        status = " (DADOS SUSPEITOS - sensor com calibracao irregular)" if is_suspect else ""
+        age = row.get("cache_age_s")
+        cached = age is not None and age == age  # NaN = dado do ciclo atual
+        props[row["session"]] = {
+            "lat": float(row["lat"]),
+            "lon": float(row["lon"]),
+            "rain_acc": round(float(row["rain_acc"]), 2),
+            "color": color,
+            "radius": round(8 + (row["rain_acc"] / max_rain) * 12, 2),
+            "fill_opacity": 0.7 if not is_suspect else 0.4,
+            "popup": (
+                f"<b>{row['session']}</b>{status}<br>"
+                f"Chuva acum.: <b>{row['rain_acc']:.1f} mm</b><br>"
+                f"Leituras: {row['n_readings']}<br>"
+                f"Device: {row['device_id']}"
+                + (f"<br><i>Sem resposta: dado de {int(age) // 60} min atras</i>" if cached else "")
+            ),
+            "tooltip": (f"{row['session']}: {row['rain_acc']:.1f}mm{'  [SUSPEITO]' if is_suspect else ''}"
+                        + (f"  [cache {int(age) // 60} min]" if cached else "")),
+        }
+    return props
+
+
+def add_station_markers(target, df, max_rain):
+    """Marcadores coloridos por estação (cores relativas às estações confiáveis de df).
+
+    Retorna {session: nome da variável JS do marcador}.
+    """
+    names = {}
+    for session, p in marker_props(df, max_rain).items():
+        marker = folium.CircleMarker(
+            location=[p["lat"], p["lon"]],
+            radius=p["radius"],
+            color=p["color"],
+            fill=True,
+            fill_color=p["color"],
+            fill_opacity=p["fill_opacity"],
+            popup=folium.Popup(p["popup"], max_width=300),
+            tooltip=p["tooltip"],
+        ).add_to(target)
+        names[session] = marker.get_name()
+    return names
+
+
+# Atualização ao vivo: a página escuta o canal SSE do servidor e aplica nos
+# marcadores os valores que mudaram (ver server.py, /events). Roda no
+# DOMContentLoaded porque o folium põe este script antes do que cria o mapa.
+LIVE_SCRIPT = """
+document.addEventListener("DOMContentLoaded", function () {
+  if (!window.EventSource || location.protocol.indexOf("http") !== 0 || location.pathname.indexOf("/v/") === 0) return;
+  var markers = {markers};
+  var layer = {layer};
+  var status = L.control({position: "topright"});
+  status.onAdd = function () {
+    this.div = L.DomUtil.create("div");
+    this.div.style.cssText = "background:white;padding:4px 8px;border:1px solid grey;border-radius:4px;font:12px sans-serif;";
+    return this.div;
+  };
+  status.addTo({map});
+  function patch(msg) {
+    var seen = {};
+    Object.keys(msg.stations).forEach(function (s) {
+      var p = msg.stations[s], mk = markers[s];
+      seen[s] = true;
+      if (!mk) {
+        mk = markers[s] = L.circleMarker([p.lat, p.lon], {fill: true}).bindPopup("").bindTooltip("").addTo(layer);
+      }
+      mk.setStyle({color: p.color, fillColor: p.color, fillOpacity: p.fill_opacity});
+      mk.setRadius(p.radius);
+      mk.setPopupContent(p.popup);
+      mk.setTooltipContent(p.tooltip);
+    });
+    Object.keys(markers).forEach(function (s) {
+      if ((msg.full && !seen[s]) || (msg.removed || []).indexOf(s) >= 0) { markers[s].remove(); delete markers[s]; }
+    });
+    status.div.innerHTML = "Ao vivo &middot; atualizado " + new Date(msg.version * 1000).toLocaleTimeString("pt-BR");
+  }
+  var es = new EventSource("{url}");
+  es.addEventListener("version", function (e) { patch(JSON.parse(e.data)); });
+  es.onerror = function () { status.div.innerHTML = "Reconectando..."; };
+  es.onopen = function () { if (!status.div.innerHTML || status.div.innerHTML === "Reconectando...") status.div.innerHTML = "Ao vivo"; };
+});
+"""
+
+
+def add_surface(m, surface, png_file):
+    """Sobrepõe a grade interpolada e as isoietas.
+
+    O PNG (com world file) fica gravado em png_file e também embutido no HTML.
+    """
+    bounds = interpolacao.save_raster(surface, png_file)
+    folium.raster_layers.ImageOverlay(
+        png_file, bounds=bounds, opacity=1.0, name=f"Chuva interpolada ({surface.method})",
+    ).add_to(m)
+    contours = interpolacao.isohyets(surface)
+    if contours["features"]:
+        folium.GeoJson(
+            contours,
+            name="Isoietas",
+            style_function=lambda f: {"color": "#333333", "weight": 1.2, "opacity": 0.8},
+            tooltip=folium.GeoJsonTooltip(fields=["level_mm"], aliases=["Isoieta (mm)"]),
+        ).add_to(m)
+
+
+def write_tiles(df, surface, tiles_dir, title="Chuva Acumulada 24h"):
+    """Atualiza a pirâmide de tiles, o JSON de marcadores e a página Leaflet estática
+    (mapa_tiles.html, na pasta acima de tiles_dir)."""
+    stats = mapa_tiles.render_tiles(surface, tiles_dir)
+    reliable = df[~df.get("suspect", False)]
+    markers = [{
+        "session": row["session"],
+        "lat": row["lat"],
+        "lon": row["lon"],
+        "rain_acc": round(float(row["rain_acc"]), 2),
+        "n_readings": int(row["n_readings"]),
+        "suspect": bool(row.get("suspect", False)),
+        "color": station_color(row, reliable),
+    } for _, row in df.iterrows()]
+    mapa_tiles.write_markers(markers, tiles_dir, stats["vmax"], title, surface.bounds, stats["versions"])
+    page = os.path.join(os.path.dirname(os.path.abspath(tiles_dir)), "mapa_tiles.html")
+    mapa_tiles.write_page(page, os.path.basename(os.path.abspath(tiles_dir)), (df["lat"].mean(), df["lon"].mean()))
+    print(f"Tiles: {stats['rendered']} regravados, {stats['unchanged']} inalterados, {stats['empty']} vazios "
+          f"de {stats['tiles']} ({stats['seconds']:.1f}s) -> {page}")
+    return stats
+
+
+def build_heatmap(df, output_file, layers=None, surface=None, raster_file=None, live_url=None):
+    """Gera mapa de calor interativo com Folium.
+
+    layers: {nome_janela: DataFrame} opcional; cada janela vira uma camada de
+    marcadores selecionável (a de df fica visível por padrão).
+    surface: interpolacao.Surface opcional; no lugar do HeatMap (que suaviza
+    pela densidade de pontos) entra a grade interpolada como imagem, gravada
+    em PNG (raster_file, por padrão ao lado do HTML), com as isoietas por cima.
+    live_url: URL do canal SSE; a página passa a atualizar os marcadores da
+    janela principal sozinha a cada nova versão.
+    """
     center_lat = df["lat"].mean()
     center_lon = df["lon"].mean()
 
@@ -186,57 +427,35 @@ def build_heatmap(df, output_file):
     if max_rain == 0:
         max_rain = 1  # evitar divisão por zero
 
-    heat_data = []
-    for _, row in df.iterrows():
-        heat_data.append([row["lat"], row["lon"], row["rain_acc"]])
-
-    # Adicionar HeatMap
-    HeatMap(
-        heat_data,
-        radius=30,
-        blur=25,
-        max_zoom=15,
-        min_opacity=0.4,
-        gradient={0.2: "blue", 0.4: "cyan", 0.6: "lime", 0.8: "yellow", 1.0: "red"},
-    ).add_to(m)
-
-    # Separar estações confiáveis e suspeitas para o heatmap
-    reliable = df[~df.get("suspect", False)]
-
-    # Adicionar marcadores com info de cada estação
-    for _, row in df.iterrows():
-        is_suspect = row.get("suspect", False)
-
-        if is_suspect:
-            color = "gray"
-        elif row["session"] == REFERENCE_SESSION:
-            color = "darkblue"
-        elif row["rain_acc"] < reliable["rain_acc"].median():
-            color = "green"
-        elif row["rain_acc"] > reliable["rain_acc"].quantile(0.75):
-            color = "red"
-        else:
-            color = "orange"
-
-        status = " (DADOS SUSPEITOS - sensor com calibracao irregular)" if is_suspect else ""
-        popup_text = (
-            f"<b>{row['session']}</b>{status}<br>"
-            f"Chuva acum.: <b>{row['rain_acc']:.1f} mm</b><br>"
-            f"Leituras: {row['n_readings']}<br>"
-            f"Device: {row['device_id']}"
-        )
-
-        folium.CircleMarker(
-            location=[row["lat"], row["lon"]],
-            radius=8 + (row["rain_acc"] / max_rain) * 12,
-            color=color,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.7 if not is_suspect else 0.4,
-            popup=folium.Popup(popup_text, max_width=300),
-            tooltip=f"{row['session']}: {row['rain_acc']:.1f}mm{'  [SUSPEITO]' if is_suspect else ''}",
+    if surface is not None:
+        add_surface(m, surface, raster_file or os.path.splitext(output_file)[0] + "_grade.png")
+    else:
+        heat_data = []
+        for _, row in df.iterrows():
+            heat_data.append([row["lat"], row["lon"], row["rain_acc"]])
+
+        # Adicionar HeatMap
+        HeatMap(
+            heat_data,
+            radius=30,
+            blur=25,
+            max_zoom=15,
+            min_opacity=0.4,
+            gradient={0.2: "blue", 0.4: "cyan", 0.6: "lime", 0.8: "yellow", 1.0: "red"},
         ).add_to(m)
 
+    if layers:
+        for name, layer_df in layers.items():
+            group = folium.FeatureGroup(name=f"Acumulado {name}", show=layer_df is df)
+            layer_max = layer_df["rain_acc"].max() if len(layer_df) else 0
+            names = add_station_markers(group, layer_df, layer_max or 1)
+            if layer_df is df:
+                live_layer, live_names = group, names
+            group.add_to(m)
+        folium.LayerControl(collapsed=False).add_to(m)
+    else:
+        live_layer, live_names = m, add_station_markers(m, df, max_rain)
+
     # Legenda
     legend_html = """
     <div style="position:fixed; bottom:50px; left:50px; z-index:1000;
@@ -253,6 +472,12 @@ def build_heatmap(df, output_file):
     """
     m.get_root().html.add_child(folium.Element(legend_html))
 
+    if live_url:
+        markers = "{" + ", ".join(f"{json.dumps(k)}: {v}" for k, v in live_names.items()) + "}"
+        script = (LIVE_SCRIPT.replace("{markers}", markers).replace("{layer}", live_layer.get_name())
+                  .replace("{map}", m.get_name()).replace("{url}", live_url))
+        m.get_root().script.add_child(folium.Element(script))
+
     m.save(output_file)
     print(f"\nMapa salvo em: {output_file}")
     return m
@@ -270,32 +495,171 @@ def print_summary(df):
 
     # Ranking
     ranked = df.sort_values("rain_acc", ascending=False)
+    reference_session = stations.get().reference_session
     print("Ranking de chuva acumulada:")
     for i, (_, row) in enumerate(ranked.iterrows(), 1):
-        marker = " [REF]" if row["session"] == REFERENCE_SESSION else ""
+        marker = " [REF]" if row["session"] == reference_session else ""
         print(f"  {i:2d}. {row['session']:<30s} {row['rain_acc']:6.1f} mm  ({row['n_readings']} leituras){marker}")
 
 
-def generate_map(records, output_file):
-    """Gera o mapa a partir de uma lista de registros (dicts). Retorna o DataFrame tratado."""
-    print(f"Processando {len(records)} registros...")
+def iter_records(path):
+    """Itera registros de um arquivo JSON (lista), NDJSON/JSONL ou NDJSON gzipado."""
+    opener = gzip.open if path.endswith(".gz") else open
+    name = path[:-3] if path.endswith(".gz") else path
+    with opener(path, "rt", encoding="utf-8") as f:
+        if name.endswith((".ndjson", ".jsonl")):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def load_records_frame(records, fields=("device_id", "time", "rain")):
+    """Monta o DataFrame a partir de um iterador de registros, guardando só os campos usados."""
+    cols = {k: [] for k in fields}
+    for rec in records:
+        for k in fields:
+            cols[k].append(rec.get(k))
+    df = pd.DataFrame(cols)
+    df["device_id"] = df["device_id"].astype("category")
+    return df
+
+
+def load_store_frame(start_ts, end_ts, device_ids=None):
+    """Lê leituras do armazenamento local (api/store.py) como DataFrame (device_id, time, rain)."""
+    data = store.read_range(start_ts, end_ts, device_ids=device_ids, fields=["rain"])
+    return pd.DataFrame({
+        "device_id": pd.Categorical(data["device_id"]),
+        "time": pd.to_datetime(data["time"], unit="s", utc=True),
+        "rain": data["rain"],
+    })
+
+
+def load_parquet_frame(path, start_ts=None, end_ts=None, sessions=None):
+    """Lê um dataset Parquet (api/columnar.py) como DataFrame (device_id, time, rain).
 
-    df = pd.DataFrame(records)
+    Só as três colunas e só as partições session=/date= do intervalo e das
+    sessões pedidas são lidas.
+    """
+    return columnar.read_frame(path, start_ts, end_ts, sessions=sessions)
+
+
+def save_windows(tables, output_file):
+    """Salva os acumulados de todas as janelas em JSON ({janela: [estações...]})."""
+    payload = {
+        "generated_at": int(time.time()),
+        "windows": {name: t.to_dict(orient="records") for name, t in tables.items()},
+    }
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False)
+    print(f"Acumulados por janela salvos em: {output_file}")
+
+
+def generate_map(records, output_file, hours=24, windows=None, windows_file=None, interp=None,
+                 resolution_km=interpolacao.DEFAULT_RESOLUTION_KM, tiles_dir=None, raster_file=None,
+                 windows_out=None, live_url=None, stale=None, metrics_out=None, qc_method=qc.DEFAULT_METHOD,
+                 registry=None):
+    """Gera o mapa a partir de uma lista de registros (dicts) ou DataFrame. Retorna o DataFrame tratado.
+
+    Com records=None, lê as últimas `hours` horas do armazenamento local.
+    Com windows ({nome: segundos}, ver acumulados.WINDOWS), calcula todas as
+    janelas numa passada: o mapa ganha uma camada por janela e, se
+    windows_file for dado, os acumulados são salvos em JSON; o dict
+    windows_out, se dado, recebe as tabelas {janela: DataFrame}.
+    live_url (canal SSE do servidor) liga a atualização ao vivo dos marcadores.
+    stale ({session: idade em s}) marca as estações que entraram com o último
+    dado bom em cache (coluna cache_age_s e aviso no marcador).
+    metrics_out, se dado, recebe a duração de cada etapa em "stages" ({etapa:
+    s}) e as contagens do ciclo (registros, leituras zeradas, suspeitas e,
+    no QC espacial, as flags por tipo em "qc").
+    qc_method: "reference" (threshold da estação de referência) ou "spatial"
+    (comparação com os vizinhos, ver treat_outlier_readings); padrão
+    qc.DEFAULT_METHOD, o mesmo da linha de comando e do servidor.
+    registry: cadastro de estações do ciclo; por padrão, stations.get() no
+    momento da chamada.
+    Com interp ("idw" ou "kriging"), o mapa mostra a superfície interpolada
+    (sem as estações suspeitas) em vez do HeatMap. Com tiles_dir, a
+    superfície (IDW se interp não for dado) também vira tiles z/x/y para a
+    página estática mapa_tiles.html.
+    """
+    stages = {}
+    clock = [time.perf_counter()]
+    registry = _registry(registry)
+
+    def lap(stage):
+        now = time.perf_counter()
+        stages[stage] = now - clock[0]
+        clock[0] = now
+
+    end_ts = None
+    if records is None:
+        end_ts = int(time.time())
+        span = max([hours * 3600] + list((windows or {}).values()))
+        records = load_store_frame(end_ts - span, end_ts)
+        lap("load")
+    n_records = len(records)
+    print(f"Processando {n_records} registros...")
+
+    df = records.copy() if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
     df["time"] = pd.to_datetime(df["time"])
     df["rain"] = pd.to_numeric(df["rain"], errors="coerce").fillna(0)
+    lap("frame")
 
     # Tratamento de outliers por leitura individual
-    df, ref_count, threshold = treat_outlier_readings(df)
+    df, ref_count, threshold = treat_outlier_readings(df, qc_method, registry)
+    outliers = df.attrs.get("outliers_zeroed", 0)
+    qc_counts = df.attrs.get("qc_counts")
+    lap("treat")
 
     # Acumular chuva por estacao
-    df = compute_accumulated_rain(df, ref_count)
+    tables = None
+    if windows:
+        windows = dict(windows)
+        primary = f"{hours}h"
+        windows.setdefault(primary, hours * 3600)
+        tables = accumulate_windows(df, windows, end_ts, qc_method, registry)
+        if windows_file:
+            save_windows(tables, windows_file)
+        if windows_out is not None:
+            windows_out.update(tables)
+        df = tables[primary]
+        print(f"Janelas calculadas: {', '.join(tables)}")
+    else:
+        df = compute_accumulated_rain(df, ref_count, qc_method, registry)
+
+    if stale:
+        for table in (tables.values() if tables else [df]):
+            table["cache_age_s"] = table["session"].map(stale)
+    lap("accumulate")
 
     print("\n--- Apos tratamento ---")
     print(df[["session", "rain_acc", "n_readings"]].sort_values("rain_acc", ascending=False).to_string(index=False))
 
     print_summary(df)
-    build_heatmap(df, output_file)
-
+    surface = None
+    if interp or tiles_dir:
+        surface = interpolacao.interpolate(df, interp or "idw", resolution_km)
+        print(f"Grade interpolada ({surface.method}): {surface.values.shape[0]}x{surface.values.shape[1]}")
+        lap("interpolate")
+    if tiles_dir:
+        write_tiles(df, surface, tiles_dir, title=f"Chuva Acumulada {hours}h")
+        lap("tiles")
+    build_heatmap(df, output_file, layers=tables, surface=surface if interp else None, raster_file=raster_file,
+                  live_url=live_url)
+    lap("render")
+
+    if metrics_out is not None:
+        metrics_out.update({
+            "stages": stages,
+            "records": n_records,
+            "outliers_zeroed": outliers,
+            "threshold_mm": float(threshold),
+            "stations": len(df),
+            "suspect": int(df["suspect"].sum()),
+            "qc": qc_counts,
+        })
     return df
 
 
@@ -304,26 +668,57 @@ def main():
     parser = argparse.ArgumentParser(description="Mapa de calor - Chuva 24h Sao Carlos")
     parser.add_argument("--code", help="Authorization code (se precisar renovar token)")
     parser.add_argument("--output", default=None, help="Arquivo HTML de saida")
-    parser.add_argument("--data-file", help="Usar dados de arquivo JSON ao inves da API")
+    parser.add_argument("--data-file",
+                        help="Usar dados de arquivo JSON, NDJSON, NDJSON.gz ou dataset Parquet ao inves da API")
+    parser.add_argument("--start", help="Com --data-file Parquet: primeiro dia lido (AAAA-MM-DD, UTC)")
+    parser.add_argument("--end", help="Com --data-file Parquet: dia final, exclusive (AAAA-MM-DD, UTC)")
+    parser.add_argument("--sessions", help="Com --data-file Parquet: sessoes lidas, separadas por virgula")
+    parser.add_argument("--from-store", action="store_true", help="Ler do armazenamento local (data/store)")
+    parser.add_argument("--hours", type=int, default=24, help="Janela lida do armazenamento local (horas)")
+    parser.add_argument("--windows", help="Janelas de acumulado numa passada, ex.: 1h,3h,6h,12h,24h,72h")
+    parser.add_argument("--windows-json", help="Salvar os acumulados das janelas neste JSON")
+    parser.add_argument("--interp", choices=["idw", "kriging"], help="Superficie interpolada no lugar do HeatMap")
+    parser.add_argument("--resolution-km", type=float, default=interpolacao.DEFAULT_RESOLUTION_KM,
+                        help="Resolucao da grade interpolada (km)")
+    parser.add_argument("--tiles", action="store_true",
+                        help="Gerar tiles z/x/y em output/tiles e a pagina output/mapa_tiles.html")
+    parser.add_argument("--format", choices=["json", "parquet"], default="json",
+                        help="Formato dos dados tratados (output/chuva_24h_tratada.json ou .parquet)")
+    parser.add_argument("--qc", choices=qc.METHODS, default=qc.DEFAULT_METHOD,
+                        help="Outliers por leitura: threshold da referencia ou comparacao com os vizinhos")
     args = parser.parse_args()
 
     output_dir = os.path.join(os.path.dirname(__file__), "..", "output")
     os.makedirs(output_dir, exist_ok=True)
     output_file = args.output or os.path.join(output_dir, "mapa_chuva_24h.html")
 
-    if args.data_file:
-        with open(args.data_file) as f:
-            records = json.load(f)
+    if args.data_file and (os.path.isdir(args.data_file) or args.data_file.endswith(".parquet")):
+        start_ts = store._day_start(args.start) if args.start else None
+        end_ts = store._day_start(args.end) if args.end else None
+        records = load_parquet_frame(args.data_file, start_ts, end_ts,
+                                     args.sessions.split(",") if args.sessions else None)
+        print(f"Carregados {len(records)} registros de {args.data_file}")
+    elif args.data_file:
+        records = load_records_frame(iter_records(args.data_file))
         print(f"Carregados {len(records)} registros de {args.data_file}")
+    elif args.from_store:
+        records = None
     else:
-        print("Erro: use --data-file para carregar dados coletados.")
+        print("Erro: use --data-file ou --from-store para carregar dados coletados.")
         sys.exit(1)
 
-    df = generate_map(records, output_file)
+    windows = parse_windows(args.windows) if args.windows else None
+    windows_file = args.windows_json or (os.path.join(output_dir, "chuva_janelas.json") if windows else None)
+    df = generate_map(records, output_file, hours=args.hours, windows=windows, windows_file=windows_file,
+                      interp=args.interp, resolution_km=args.resolution_km,
+                      tiles_dir=os.path.join(output_dir, "tiles") if args.tiles else None, qc_method=args.qc)
 
     # Salvar dados tratados
-    data_file = os.path.join(output_dir, "chuva_24h_tratada.json")
-    df.to_json(data_file, orient="records", indent=2, force_ascii=False)
+    data_file = os.path.join(output_dir, f"chuva_24h_tratada.{args.format}")
+    if args.format == "parquet":
+        df.to_parquet(data_file, index=False)
+    else:
+        df.to_json(data_file, orient="records", indent=2, force_ascii=False)
     print(f"Dados tratados salvos em: {data_file}")
 
 
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Pirâmide de tiles z/x/y (PNG 256x256) da superfície de chuva interpolada.
+
+Em vez de um HTML do Folium com tudo embutido, a superfície de
+interpolacao.py é rasterizada em tiles Web Mercator (zoom 10 a 16) servidos
+como arquivos estáticos, e uma página Leaflet fixa carrega os tiles e um
+JSON pequeno com os marcadores das estações.
+
+A cada ciclo só são regravados os tiles cujo conteúdo mudou. Cada tile tem
+duas assinaturas em tiles/manifest.json: a do trecho da grade que ele cobre
+(igual -> nem é rasterizado) e a dos pixels (índices da paleta) gerados
+(igual -> o PNG não é regravado). Tiles inalterados mantêm o arquivo (e o
+Last-Modified), então navegadores e proxies revalidam com 304. Tiles sem
+chuva não são gravados; a página usa um tile transparente no lugar.
+
+A página pede cada tile com ?v=<assinatura dos pixels> (em "tiles" no JSON
+dos marcadores), então um ciclo novo só muda a URL dos tiles que mudaram e
+os demais continuam no cache do navegador e dos proxies.
+"""
+
+import hashlib, json, math, os, time
+import numpy as np
+import interpolacao
+
+TILE_SIZE = 256
+MIN_ZOOM, MAX_ZOOM = 10, 16
+MANIFEST_FILE = "manifest.json"
+MARKERS_FILE = "estacoes.json"
+EMPTY_TILE = "vazio.png"
+# Caracteres da assinatura dos pixels usados como versão (?v=) na URL do tile
+VERSION_CHARS = 10
+# Escala de cores fixa (mm) para a cor de um tile não mudar só porque o máximo mudou
+SCALE_STEPS_MM = (10, 20, 50, 100, 200, 500, 1000)
+
+
+def scale_max(vmax):
+    """Topo da escala de cores: o primeiro degrau de SCALE_STEPS_MM >= vmax."""
+    return next((s for s in SCALE_STEPS_MM if s >= vmax), SCALE_STEPS_MM[-1])
+
+
+def tile_xy(lat, lon, z):
+    """Posição fracionária (x, y) do ponto na grade de tiles do zoom z."""
+    n = 2 ** z
+    lat = np.clip(lat, -85.05112878, 85.05112878)
+    x = (np.asarray(lon) + 180.0) / 360.0 * n
+    y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_lat(y, z):
+    """Latitude da coordenada y (fracionária) de tile no zoom z."""
+    return np.degrees(np.arctan(np.sinh(math.pi * (1 - 2 * np.asarray(y, dtype=np.float64) / 2 ** z))))
+
+
+def tile_range(bounds, z):
+    """Faixas de x e y dos tiles que cobrem bounds [[sul, oeste], [norte, leste]]."""
+    (south, west), (north, east) = bounds
+    x0, y0 = tile_xy(north, west, z)
+    x1, y1 = tile_xy(south, east, z)
+    return range(int(x0), int(x1) + 1), range(int(y0), int(y1) + 1)
+
+
+def _grid_pos(coords, axis):
+    """Índice fracionário de coords no eixo (crescente ou decrescente) da grade; NaN fora dela."""
+    idx = np.arange(len(axis), dtype=np.float64)
+    if axis[0] > axis[-1]:
+        axis, idx = axis[::-1], idx[::-1]
+    pos = np.interp(coords, axis, idx)
+    pos[(coords < axis[0]) | (coords > axis[-1])] = np.nan
+    return pos
+
+
+def _weights(pos, n):
+    """Matriz (pontos x células) de pesos lineares para as posições fracionárias pos."""
+    i0 = np.minimum(pos.astype(np.int64), n - 2)
+    lo = i0.min()
+    w = np.zeros((len(pos), i0.max() - lo + 2))
+    k = np.arange(len(pos))
+    w[k, i0 - lo] = 1 - (pos - i0)
+    w[k, i0 - lo + 1] = pos - i0
+    return w, lo
+
+
+def sample(surface, lats, lons):
+    """Interpolação bilinear da superfície nas linhas lats x colunas lons (NaN fora da grade).
+
+    A bilinear é separável: Wy @ bloco @ Wx.T, só com o bloco da grade sob o tile.
+    """
+    fy, fx = _grid_pos(lats, surface.lats), _grid_pos(lons, surface.lons)
+    out = np.full((len(lats), len(lons)), np.nan)
+    rows, cols = np.flatnonzero(~np.isnan(fy)), np.flatnonzero(~np.isnan(fx))
+    if not len(rows) or not len(cols):
+        return out
+    wy, r0 = _weights(fy[rows], len(surface.lats))
+    wx, c0 = _weights(fx[cols], len(surface.lons))
+    block = surface.values[r0:r0 + wy.shape[1], c0:c0 + wx.shape[1]]
+    # Linhas/colunas válidas são contíguas (eixos monotônicos)
+    out[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1] = wy @ block @ wx.T
+    return out
+
+
+def tile_pixels(z, x, y):
+    """Latitudes (linhas) e longitudes (colunas) dos centros dos pixels do tile."""
+    frac = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lats = tile_lat(y + frac, z)
+    lons = (x + frac) / 2 ** z * 360.0 - 180.0
+    return lats, lons
+
+
+def tile_signature(surface, z, x, y, vmax, salt):
+    """Assinatura do trecho da grade que o tile cobre (com 1 célula de margem para a bilinear)."""
+    lat_n, lat_s = tile_lat(y, z), tile_lat(y + 1, z)
+    lon_w, lon_e = x / 2 ** z * 360.0 - 180.0, (x + 1) / 2 ** z * 360.0 - 180.0
+    r = np.flatnonzero((surface.lats <= lat_n) & (surface.lats >= lat_s))
+    c = np.flatnonzero((surface.lons >= lon_w) & (surface.lons <= lon_e))
+    nlat, nlon = len(surface.lats), len(surface.lons)
+    # Tile menor que uma célula: a grade ao redor define o tile todo
+    r0 = max(0, (r[0] if len(r) else int(np.searchsorted(-surface.lats, -lat_n))) - 1)
+    r1 = min(nlat, (r[-1] if len(r) else r0) + 2)
+    c0 = max(0, (c[0] if len(c) else int(np.searchsorted(surface.lons, lon_w))) - 1)
+    c1 = min(nlon, (c[-1] if len(c) else c0) + 2)
+    return _digest(salt, _pack_ints(r0, r1, c0, c1), np.ascontiguousarray(surface.values[r0:r1, c0:c1]))
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=12)
+    for p in parts:
+        h.update(p)
+    return h.hexdigest()
+
+
+def _pack_ints(*ints):
+    return np.array(ints, dtype=np.int64).tobytes()
+
+
+def render_tile(surface, z, x, y, vmax):
+    """Índices de cor (256x256, ver interpolacao.quantize) do tile, ou None se não há chuva nele."""
+    lats, lons = tile_pixels(z, x, y)
+    q = interpolacao.quantize(sample(surface, lats, lons), vmax)
+    return q if q.any() else None
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def render_tiles(surface, tiles_dir, zooms=range(MIN_ZOOM, MAX_ZOOM + 1), vmax=None):
+    """Atualiza a pirâmide em tiles_dir/z/x/y.png regravando só os tiles que mudaram.
+
+    Retorna estatísticas {tiles, rendered, unchanged, empty, removed, seconds, vmax}
+    e, em "versions", a versão de cada tile não vazio ({"z/x/y": assinatura}).
+    """
+    t0 = time.time()
+    vmax = vmax or scale_max(float(np.nanmax(surface.values)))
+    os.makedirs(tiles_dir, exist_ok=True)
+    manifest_path = os.path.join(tiles_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path) as f:
+            old = json.load(f).get("tiles", {})
+    except (OSError, ValueError):
+        old = {}
+
+    # Grade diferente (área ou resolução) ou outra escala: nenhuma assinatura antiga vale
+    salt = _pack_ints(len(surface.lats), len(surface.lons), vmax) + \
+        np.array([surface.lats[0], surface.lats[-1], surface.lons[0], surface.lons[-1]]).tobytes()
+    table = interpolacao.color_table()
+    new = {}
+    stats = {"tiles": 0, "rendered": 0, "unchanged": 0, "empty": 0, "removed": 0}
+    for z in zooms:
+        xs, ys = tile_range(surface.bounds, z)
+        for x in xs:
+            for y in ys:
+                name = f"{z}/{x}/{y}"
+                path = os.path.join(tiles_dir, str(z), str(x), f"{y}.png")
+                sig = tile_signature(surface, z, x, y, vmax, salt)
+                stats["tiles"] += 1
+                prev = old.get(name)
+                if prev and prev["sig"] == sig and (prev["empty"] or os.path.exists(path)):
+                    new[name] = prev
+                    stats["unchanged"] += 1
+                    stats["empty"] += int(prev["empty"])
+                    continue
+                tile = render_tile(surface, z, x, y, vmax)
+                out = _digest(tile) if tile is not None else None
+                if tile is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    stats["empty"] += 1
+                elif prev and prev.get("out") == out and os.path.exists(path):
+                    # A grade mudou, mas não o suficiente para mudar algum pixel
+                    stats["unchanged"] += 1
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    _write_atomic(path, interpolacao.encode_png_indexed(tile, table))
+                    stats["rendered"] += 1
+                new[name] = {"sig": sig, "out": out, "empty": tile is None}
+
+    # Tiles que saíram da área coberta
+    for name in set(old) - set(new):
+        path = os.path.join(tiles_dir, *name.split("/")) + ".png"
+        if os.path.exists(path):
+            os.remove(path)
+            stats["removed"] += 1
+
+    empty_path = os.path.join(tiles_dir, EMPTY_TILE)
+    if not os.path.exists(empty_path):
+        _write_atomic(empty_path, interpolacao.encode_png_indexed(np.zeros((TILE_SIZE, TILE_SIZE), np.uint8), table))
+    payload = {"generated_at": int(time.time()), "vmax": vmax, "bounds": surface.bounds,
+               "zooms": [min(zooms), max(zooms)], "tiles": new}
+    _write_atomic(manifest_path, json.dumps(payload, separators=(",", ":")).encode())
+    stats["seconds"] = round(time.time() - t0, 2)
+    stats["vmax"] = vmax
+    stats["versions"] = {name: t["out"][:VERSION_CHARS] for name, t in new.items() if not t["empty"]}
+    return stats
+
+
+def write_markers(stations, tiles_dir, vmax, title, bounds, versions=None):
+    """JSON dos marcadores: [{session, lat, lon, rain_acc, n_readings, suspect, color}, ...].
+
+    versions ({"z/x/y": versão}, de render_tiles) vai em "tiles" para a página
+    montar a URL versionada de cada tile.
+    """
+    payload = {
+        "generated_at": int(time.time()),
+        "title": title,
+        "vmax": vmax,
+        "bounds": bounds,
+        "stations": stations,
+        "tiles": versions or {},
+    }
+    _write_atomic(os.path.join(tiles_dir, MARKERS_FILE), json.dumps(payload, ensure_ascii=False).encode())
+
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Chuva - Sao Carlos</title>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"/>
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"></script>
+<style>
+  html, body, #map {{ height: 100%; margin: 0; }}
+  .legenda {{ background: white; padding: 8px 10px; border: 2px solid grey; border-radius: 5px; font: 13px sans-serif; }}
+  .escala {{ width: 160px; height: 12px; background: linear-gradient(to right, {gradient}); }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var TILES = "{tiles}";
+var map = L.map("map").setView([{lat}, {lon}], 13);
+L.tileLayer("https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png", {{
+  maxZoom: 18, attribution: "&copy; OpenStreetMap"
+}}).addTo(map);
+// Cada tile com a sua versao: um ciclo novo so muda a URL dos tiles que mudaram
+var versoes = null, gerado = null;
+var TilesVersionados = L.TileLayer.extend({{
+  getTileUrl: function (c) {{
+    var nome = this._getZoomForUrl() + "/" + c.x + "/" + c.y;
+    var v = versoes && versoes[nome];
+    return v ? TILES + "/" + nome + ".png?v=" + v : TILES + "/{empty}";
+  }}
+}});
+var chuva = new TilesVersionados(TILES + "/{{z}}/{{x}}/{{y}}.png", {{
+  minZoom: {min_zoom}, maxNativeZoom: {max_zoom}, maxZoom: 18, opacity: 1.0,
+  errorTileUrl: TILES + "/{empty}"
+}});
+var estacoes = L.layerGroup().addTo(map);
+var legenda = L.control({{position: "bottomleft"}});
+legenda.onAdd = function () {{ this.div = L.DomUtil.create("div", "legenda"); return this.div; }};
+legenda.addTo(map);
+
+function atualizar() {{
+  fetch(TILES + "/{markers}?t=" + Date.now()).then(function (r) {{ return r.json(); }}).then(function (d) {{
+    estacoes.clearLayers();
+    var max = Math.max.apply(null, d.stations.map(function (s) {{ return s.rain_acc; }}).concat([1]));
+    d.stations.forEach(function (s) {{
+      L.circleMarker([s.lat, s.lon], {{
+        radius: 8 + (s.rain_acc / max) * 12, color: s.color, fillColor: s.color,
+        fillOpacity: s.suspect ? 0.4 : 0.7
+      }}).bindTooltip(s.session + ": " + s.rain_acc.toFixed(1) + "mm" + (s.suspect ? "  [SUSPEITO]" : ""))
+        .bindPopup("<b>" + s.session + "</b><br>Chuva acum.: <b>" + s.rain_acc.toFixed(1) +
+                   " mm</b><br>Leituras: " + s.n_readings)
+        .addTo(estacoes);
+    }});
+    legenda.div.innerHTML = "<b>" + d.title + "</b><br><div class='escala'></div>0 mm" +
+      "<span style='float:right'>" + d.vmax + " mm</span><br><small>Atualizado: " +
+      new Date(d.generated_at * 1000).toLocaleString("pt-BR") + "</small>";
+    if (d.generated_at !== gerado) {{
+      gerado = d.generated_at;
+      versoes = d.tiles || {{}};
+      if (map.hasLayer(chuva)) chuva.redraw(); else chuva.addTo(map);
+    }}
+  }});
+}}
+atualizar();
+setInterval(atualizar, 5 * 60 * 1000);
+// Servida pelo server.py: nova versao chega por SSE, sem esperar o intervalo
+if (window.EventSource && location.protocol.indexOf("http") === 0) {{
+  new EventSource("/events").addEventListener("version", atualizar);
+}}
+</script>
+</body>
+</html>
+"""
+
+
+def write_page(page_file, tiles_url, center):
+    """Página Leaflet estática; só é regravada se o conteúdo mudar."""
+    stops = sorted(interpolacao.GRADIENT)
+    html = PAGE_TEMPLATE.format(
+        tiles=tiles_url, lat=center[0], lon=center[1], min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM,
+        empty=EMPTY_TILE, markers=MARKERS_FILE,
+        gradient=", ".join(f"{interpolacao.GRADIENT[s]} {s * 100:.0f}%" for s in stops),
+    )
+    if os.path.exists(page_file):
+        with open(page_file, encoding="utf-8") as f:
+            if f.read() == html:
+                return
+    _write_atomic(page_file, html.encode("utf-8"))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Controle de qualidade espacial: cada estação contra os k vizinhos mais próximos.
+
+As leituras viram uma matriz estação x intervalo de tempo (soma da chuva em
+cada intervalo de BIN_S segundos, NaN onde a estação não reportou). Para cada
+célula, a mediana e o MAD dos vizinhos (até MAX_KM de distância) saem de uma
+ordenação vetorizada do bloco vizinhos x tempo, sem laço por estação ou por
+intervalo; o tempo é processado em blocos (até BLOCK_CELLS células
+estação x vizinho x intervalo por bloco) para limitar a memória. Uma célula é:
+- SPIKE: acima de mediana + max(Z_MAX * 1.4826 * MAD, MIN_EXCESS_MM) e de
+  MAX_FACTOR x o maior vizinho (são descartadas as leituras da célula acima
+  da sua parte do permitido, permitido / leituras na célula);
+- DRY: zero com a mediana dos vizinhos >= WET_MM (só marcada: entupimento ou
+  chuva muito localizada);
+- UNCHECKED: menos de MIN_NEIGHBORS vizinhos com dados (fica para o limite
+  absoluto do tratamento).
+Cada leitura herda o código da sua célula (flags por leitura), em vez de um
+único limite para a rede toda.
+"""
+
+import numpy as np
+
+# Tratamento de outliers padrão do mapa_chuva_24h (funções, CLI --qc e HEXA_QC do servidor):
+# "spatial" (este módulo) ou "reference" (threshold da estação de referência)
+METHODS = ("reference", "spatial")
+DEFAULT_METHOD = "spatial"
+
+K = 8
+MAX_KM = 15.0
+BIN_S = 600
+MIN_NEIGHBORS = 3
+Z_MAX = 5.0
+MIN_EXCESS_MM = 10.0
+MAX_FACTOR = 2.0
+WET_MM = 1.0
+# Acumulado da estação (janela inteira) acima disso em relação aos vizinhos: suspeita
+SUSPECT_Z = 5.0
+SUSPECT_FACTOR = 4.0
+BLOCK_CELLS = 4_000_000
+
+OK, SPIKE, DRY, UNCHECKED, THRESHOLD = 0, 1, 2, 3, 4
+FLAG_NAMES = {OK: "ok", SPIKE: "spike", DRY: "dry", UNCHECKED: "unchecked", THRESHOLD: "threshold"}
+
+
+def neighbor_table(neighbors, max_km=MAX_KM):
+    """(códigos n x k) dos vizinhos de registry.neighbors(k), com -1 além de max_km."""
+    codes, dists = neighbors
+    return np.where(np.isfinite(dists) & (dists <= max_km), codes, -1)
+
+
+def bin_matrix(codes, times, rain, n_stations, bin_s=BIN_S):
+    """Matriz (n_stations x n_bins) com a soma da chuva por intervalo (NaN sem leitura).
+
+    Retorna (matriz, índice do intervalo de cada leitura, leituras por célula, t0).
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    known = codes >= 0
+    if times is None or not len(codes):
+        bins = np.zeros(len(codes), dtype=np.int64)
+        t0 = 0
+    else:
+        times = np.asarray(times, dtype=np.int64)
+        t0 = int(times[known].min()) if known.any() else 0
+        bins = (times - t0) // bin_s
+    n_bins = int(bins[known].max()) + 1 if known.any() else 1
+    flat = codes[known] * n_bins + bins[known]
+    values = np.nan_to_num(np.asarray(rain, dtype=np.float64)[known])
+    total = np.bincount(flat, weights=values, minlength=n_stations * n_bins)
+    count = np.bincount(flat, minlength=n_stations * n_bins)
+    matrix = np.where(count > 0, total, np.nan).reshape(n_stations, n_bins)
+    return matrix, bins, count.reshape(n_stations, n_bins), t0
+
+
+def _median_sorted(values, n_valid):
+    """Mediana ao longo do eixo 1 de um array já ordenado com os NaN no fim."""
+    n = np.maximum(n_valid, 1)
+    lo = np.take_along_axis(values, ((n - 1) // 2)[:, None, :], axis=1)[:, 0, :]
+    hi = np.take_along_axis(values, (n // 2)[:, None, :], axis=1)[:, 0, :]
+    return np.where(n_valid > 0, (lo + hi) / 2, np.nan)
+
+
+def neighbor_stats(matrix, table):
+    """Mediana, MAD, máximo e número de vizinhos com dados para cada célula da matriz."""
+    n, k = table.shape
+    padded = np.vstack([matrix, np.full((1, matrix.shape[1]), np.nan)])
+    nb = padded[np.where(table >= 0, table, n)]          # n x k x T (linha NaN para "sem vizinho")
+    nb.sort(axis=1)                                      # NaN vão para o fim
+    n_valid = (~np.isnan(nb)).sum(axis=1)
+    median = _median_sorted(nb, n_valid)
+    dev = np.abs(nb - median[:, None, :])
+    dev.sort(axis=1)
+    mad = _median_sorted(dev, n_valid)
+    top = np.take_along_axis(nb, np.maximum(n_valid - 1, 0)[:, None, :], axis=1)[:, 0, :]
+    return median, mad, np.where(n_valid > 0, top, np.nan), n_valid
+
+
+def flag_matrix(matrix, table, block=None):
+    """Códigos (OK/SPIKE/DRY/UNCHECKED) e chuva permitida de cada célula estação x intervalo."""
+    flags = np.full(matrix.shape, OK, dtype=np.int8)
+    limit = np.full(matrix.shape, np.inf)
+    block = block or max(1, BLOCK_CELLS // max(table.size, 1))
+    for start in range(0, matrix.shape[1], block):
+        part = matrix[:, start:start + block]
+        median, mad, top, n_valid = neighbor_stats(part, table)
+        allowed = np.maximum(median + np.maximum(Z_MAX * 1.4826 * mad, MIN_EXCESS_MM), MAX_FACTOR * top)
+        enough = n_valid >= MIN_NEIGHBORS
+        has = ~np.isnan(part)
+        out = flags[:, start:start + block]
+        limit[:, start:start + block] = np.where(enough, allowed, np.inf)
+        out[has & ~enough] = UNCHECKED
+        with np.errstate(invalid="ignore"):
+            out[has & enough & (part > allowed)] = SPIKE
+            out[has & enough & (part == 0) & (median >= WET_MM)] = DRY
+    return flags, limit
+
+
+def flag_readings(codes, times, rain, neighbors, n_stations, bin_s=BIN_S):
+    """Flags por leitura (int8, ver FLAG_NAMES) a partir do QC por célula.
+
+    Em células SPIKE só recebem SPIKE as leituras acima da parte delas no
+    permitido (permitido / leituras na célula), para não descartar os minutos
+    normais ao redor do pico; leituras de devices desconhecidos ficam UNCHECKED.
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    rain = np.asarray(rain, dtype=np.float64)
+    matrix, bins, count, _ = bin_matrix(codes, times, rain, n_stations, bin_s)
+    cells, limit = flag_matrix(matrix, neighbor_table(neighbors))
+    flags = np.full(len(codes), UNCHECKED, dtype=np.int8)
+    known = codes >= 0
+    cell = (codes[known], bins[known])
+    flags[known] = cells[cell]
+    share = limit[cell] / count[cell]
+    with np.errstate(invalid="ignore"):
+        normal = (flags[known] == SPIKE) & ~(rain[known] > share)
+    flags[np.flatnonzero(known)[normal]] = OK
+    return flags
+
+
+def suspect_totals(rain_acc, valid, neighbors):
+    """Estações cujo acumulado destoa dos vizinhos (mediana/MAD dos acumulados).
+
+    valid: estações que entram na comparação (as demais não contam como vizinhas).
+    """
+    totals = np.where(valid, rain_acc, np.nan)[:, None]
+    median, mad, top, n_valid = neighbor_stats(totals, neighbor_table(neighbors))
+    median, mad, n_valid = median[:, 0], mad[:, 0], n_valid[:, 0]
+    allowed = np.maximum(median + np.maximum(SUSPECT_Z * 1.4826 * mad, MIN_EXCESS_MM), SUSPECT_FACTOR * median)
+    with np.errstate(invalid="ignore"):
+        return valid & (n_valid >= MIN_NEIGHBORS) & (rain_acc > allowed)
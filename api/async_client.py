@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Coletor asyncio para a API HexaCloud, alternativa aos ThreadPoolExecutor.
+
+Expõe fetch_range (mesma semântica de query.fetch_range) e fetch_session_day
+(mesma semântica de server.fetch_session_day) sobre uma única sessão aiohttp,
+com concorrência limitada por semáforo. Retries, backoff e contadores são os
+mesmos do client.py, e cada tentativa passa pelo agendador de cota.
+
+Requer aiohttp (opcional, fora do requirements.txt):
+    pip install aiohttp
+"""
+
+import asyncio, json, time
+import client
+import scheduler
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - dependência opcional
+    aiohttp = None
+
+API_BASE = "https://m73akbtcad.execute-api.us-east-2.amazonaws.com/v1/"
+QUERY_URL = API_BASE + "query"
+DEFAULT_CONCURRENCY = 30
+# Fatia da espera pelo token em cada thread: limita quanto uma coleta cancelada
+# ainda prende uma thread do executor padrão
+ACQUIRE_SLICE = 1.0
+
+
+def require_aiohttp():
+    if aiohttp is None:
+        raise RuntimeError("Coletor async requer aiohttp: pip install aiohttp")
+
+
+def _release_if_taken(task):
+    if not task.cancelled() and task.exception() is None and task.result() is not None:
+        scheduler.release()
+
+
+async def acquire(priority=scheduler.BACKFILL):
+    """Espera o token da cota sem bloquear o event loop e pode ser cancelada.
+
+    Cada thread espera no máximo ACQUIRE_SLICE s (scheduler.acquire com
+    timeout); se a coleta for cancelada no meio de uma fatia, a thread termina
+    a fatia e o token que ela ainda pegar volta para a cota (scheduler.release).
+    """
+    while True:
+        task = asyncio.ensure_future(asyncio.to_thread(scheduler.acquire, priority, ACQUIRE_SLICE))
+        try:
+            waited = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            task.add_done_callback(_release_if_taken)
+            raise
+        if waited is not None:
+            return waited
+
+
+class AsyncCollector:
+    """Sessão aiohttp compartilhada com no máximo `concurrency` requisições em voo."""
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=None, max_retries=None, url=QUERY_URL):
+        require_aiohttp()
+        connect, read = timeout or client.DEFAULT_TIMEOUT
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        self.max_retries = client.MAX_RETRIES if max_retries is None else max_retries
+        self.concurrency = concurrency
+        self.url = url
+        self.session = None
+        self.sem = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        self.sem = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def get(self, params, headers, priority=scheduler.BACKFILL):
+        """GET com retries; retorna (status, corpo em bytes). Relança o erro de rede final."""
+        for attempt in range(self.max_retries + 1):
+            await acquire(priority)
+            t0 = time.time()
+            try:
+                async with self.sem:
+                    async with self.session.get(self.url, params=params, headers=headers) as resp:
+                        body = await resp.read()
+                        status, retry_after = resp.status, resp.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                client.record_request(time.time() - t0, error=True)
+                if attempt == self.max_retries:
+                    raise
+                client.count_retry()
+                await asyncio.sleep(client.backoff(attempt))
+                continue
+
+            client.record_request(time.time() - t0, nbytes=len(body), error=status >= 400)
+            text = body.decode("utf-8", errors="replace") if status != 200 else ""
+            if attempt < self.max_retries and client.should_retry(status, text):
+                client.count_retry()
+                await asyncio.sleep(client.backoff(attempt, retry_after))
+                continue
+            return status, body
+
+    async def fetch_range(self, start_ts, end_ts, headers, device_id=None, session=None, lat=None, lon=None,
+                          radius_km=None, priority=scheduler.BACKFILL):
+        """Equivalente async de query.fetch_range."""
+        params = {"start_ts": start_ts, "end_ts": end_ts}
+        if device_id:
+            params["device_id"] = device_id
+        if session:
+            params["session"] = session
+        if lat and lon and radius_km:
+            params["lat"] = lat
+            params["lon"] = lon
+            params["radius_km"] = radius_km
+
+        t0 = time.time()
+        rng = (start_ts, end_ts)
+        try:
+            status, body = await self.get(params, headers, priority)
+        except (aiohttp.ClientError, asyncio.TimeoutError, scheduler.QuotaExceeded) as ex:
+            print(f"[FALHA] {start_ts}-{end_ts}: {ex}")
+            return {"duration": time.time() - t0, "count": 0, "data": [], "failed": True, "range": rng}
+        duration = time.time() - t0
+
+        if status == 200:
+            data = json.loads(body)
+            records = data.get("data", [])
+            return {"duration": duration, "count": data.get("count", len(records)), "data": records, "range": rng}
+        print(f"[ERRO] {status}: {body[:200]!r}")
+        return {"duration": duration, "count": 0, "data": [], "failed": True, "range": rng}
+
+    async def fetch_session_day(self, session, start_ts, end_ts, headers, user_id=None):
+        """Equivalente async de server.fetch_session_day: (registros, bytes); None se falhou."""
+        params = {"session": session, "start_ts": start_ts, "end_ts": end_ts}
+        if user_id:
+            params["user_id"] = user_id
+        try:
+            status, body = await self.get(params, headers, scheduler.LIVE)
+            if status == 200:
+                return json.loads(body).get("data", []), len(body)
+            print(f"  [ERRO] {session}: {status}")
+        except scheduler.QuotaExceeded as ex:
+            print(f"  [COTA] {session}: {ex}")
+        except Exception as ex:
+            print(f"  [EXCEPT] {session}: {ex}")
+        return None, 0
+
+
+async def iter_adaptive(collector, chunks, fetch_args, max_pending):
+    """Versão async de query.iter_adaptive: gera os resultados aceitos conforme terminam."""
+    pending = set()
+    while True:
+        while len(pending) < max_pending:
+            rng = chunks.next_range()
+            if rng is None:
+                break
+            pending.add(asyncio.ensure_future(collector.fetch_range(rng[0], rng[1], *fetch_args)))
+        if not pending:
+            return
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            res = task.result()
+            if res.get("failed") or chunks.feed(res["range"], res["count"], len(res["data"]), res["duration"]):
+                yield res
+
+
+def fetch_sessions(jobs, headers, concurrency=DEFAULT_CONCURRENCY, user_id=None, url=QUERY_URL, deadline=None,
+                   timings=None):
+    """Busca várias sessões em paralelo. jobs = [(session, start_ts, end_ts), ...].
+
+    Retorna [(job, (registros, bytes)), ...] na ordem de conclusão. Com
+    deadline (s), o que não terminou até lá é cancelado e fica fora da lista.
+    O dict timings, se dado, recebe a duração (s) de cada sessão concluída.
+    """
+    async def run():
+        out = []
+        async with AsyncCollector(concurrency=concurrency, url=url) as col:
+            async def one(job):
+                t0 = time.perf_counter()
+                result = await col.fetch_session_day(*job, headers, user_id=user_id)
+                if timings is not None:
+                    timings[job[0]] = time.perf_counter() - t0
+                out.append((job, result))
+            tasks = [asyncio.ensure_future(one(job)) for job in jobs]
+            if tasks:
+                _, pending = await asyncio.wait(tasks, timeout=deadline)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        return out
+
+    return asyncio.run(run())
@@ -1,26 +1,63 @@
 #!/usr/bin/env python3
-"""Módulo de autenticação OAuth2 para a API HexaCloud via AWS Cognito."""
+"""Módulo de autenticação OAuth2 para a API HexaCloud via AWS Cognito.
 
-import argparse, requests, sys, json, time, os
+TokenManager é o único dono do token: guarda access/refresh token em memória
+e em token_cache.json (escrita atômica, renovação sob trava de arquivo, então
+o servidor e backfills do query.py podem rodar juntos sem renovar duas vezes),
+renova em segundo plano antes de expirar e mede quanto os chamadores
+esperaram por um token.
+"""
+
+import argparse, contextlib, sys, json, threading, time, os
+import client
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos, só a escrita atômica
+    fcntl = None
 
 TOKEN_URL = "https://us-east-2dq7vvrkkx.auth.us-east-2.amazoncognito.com/oauth2/token"
 CLIENT_ID = "bmqgtcosbo6i3irv3ojkfjjoj"
 API_BASE = "https://m73akbtcad.execute-api.us-east-2.amazonaws.com/v1/"
 REDIRECT_URI = "http://localhost:3000"
 CACHE_FILE = os.path.join(os.path.dirname(__file__), "..", "token_cache.json")
+# Renovação em segundo plano este tanto antes de expirar
+REFRESH_AHEAD = 5 * 60
+# Token a menos que isso de expirar já não é entregue
+EXPIRY_MARGIN = 60
+# Espera entre tentativas da renovação em segundo plano que falhou (dobra até o máximo)
+RETRY_MIN, RETRY_MAX = 15, 5 * 60
 
 
-def save_cache(tokens):
-    tokens["expires_at"] = int(time.time()) + tokens.get("expires_in", 3600)
-    with open(CACHE_FILE, "w") as f:
+def save_cache(tokens, path=CACHE_FILE):
+    """Grava o cache de tokens de forma atômica (arquivo temporário + os.replace)."""
+    if "expires_in" in tokens:
+        tokens["expires_at"] = int(time.time()) + tokens.pop("expires_in")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
         json.dump(tokens, f)
+    os.replace(tmp, path)
 
 
-def load_cache():
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE) as f:
+def load_cache(path=CACHE_FILE):
+    try:
+        with open(path) as f:
             return json.load(f)
-    return {}
+    except (OSError, ValueError):
+        return {}
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Trava exclusiva entre processos (flock num arquivo .lock ao lado do cache)."""
+    with open(path + ".lock", "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
 
 
 def exchange_code_for_tokens(code, token_url=TOKEN_URL, client_id=CLIENT_ID):
@@ -30,7 +67,9 @@ def exchange_code_for_tokens(code, token_url=TOKEN_URL, client_id=CLIENT_ID):
         "code": code,
         "redirect_uri": REDIRECT_URI,
     }
-    r = requests.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
+    # O code vale uma vez só: repetir a troca após um timeout receberia invalid_grant
+    r = client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"},
+                    max_retries=0)
     if r.status_code == 400 and "invalid_grant" in r.text:
         raise RuntimeError("Esse authorization code já foi usado ou expirou. Gere um novo código no login.")
     r.raise_for_status()
@@ -39,29 +78,174 @@ def exchange_code_for_tokens(code, token_url=TOKEN_URL, client_id=CLIENT_ID):
     return tokens
 
 
-def refresh_tokens(refresh_token, token_url=TOKEN_URL, client_id=CLIENT_ID):
+def _post_refresh(refresh_token, token_url=TOKEN_URL, client_id=CLIENT_ID):
     data = {
         "grant_type": "refresh_token",
         "client_id": client_id,
         "refresh_token": refresh_token,
     }
-    r = requests.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"})
+    r = client.post(token_url, data=data, headers={"Content-Type": "application/x-www-form-urlencoded"},
+                    timeout=15)
     r.raise_for_status()
     tokens = r.json()
     tokens["refresh_token"] = refresh_token
+    return tokens
+
+
+def refresh_tokens(refresh_token, token_url=TOKEN_URL, client_id=CLIENT_ID):
+    tokens = _post_refresh(refresh_token, token_url, client_id)
     save_cache(tokens)
     return tokens
 
 
+class TokenManager:
+    """Token compartilhado entre threads e processos, renovado antes de expirar.
+
+    get() só devolve o token da memória; com start() uma thread renova
+    REFRESH_AHEAD s antes da expiração, então a coleta nunca espera o Cognito.
+    Sem a thread (scripts), get() renova na hora quando precisa. A renovação
+    relê o cache sob trava de arquivo: se outro processo já renovou, o token
+    dele é adotado em vez de pedir outro.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, refresh_token=None, token_url=TOKEN_URL, client_id=CLIENT_ID):
+        self.cache_file = cache_file
+        self.token_url = token_url
+        self.client_id = client_id
+        self.tokens = {"access_token": None, "expires_at": 0, "refresh_token": refresh_token or None}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._live_headers = []
+        self._thread = None
+        self.counters = {"calls": 0, "waits": 0, "wait_s": 0.0, "max_wait_s": 0.0,
+                      "refreshes": 0, "adopted": 0, "failures": 0}
+        self._load()
+
+    def _load(self):
+        """Adota o cache do disco se for mais novo que o da memória."""
+        disk = load_cache(self.cache_file)
+        with self._lock:
+            if disk.get("access_token") and disk.get("expires_at", 0) > self.tokens["expires_at"]:
+                self.tokens["access_token"] = disk["access_token"]
+                self.tokens["expires_at"] = disk["expires_at"]
+                if disk.get("refresh_token"):
+                    self.tokens["refresh_token"] = disk["refresh_token"]
+                self._update_headers()
+                return True
+            if not self.tokens["refresh_token"] and disk.get("refresh_token"):
+                self.tokens["refresh_token"] = disk["refresh_token"]
+        return False
+
+    def _update_headers(self):
+        for headers in self._live_headers:
+            headers["Authorization"] = f"Bearer {self.tokens['access_token']}"
+
+    def expires_in(self):
+        return self.tokens["expires_at"] - time.time()
+
+    def set_tokens(self, tokens):
+        """Adota tokens recém-obtidos (login com --code) e grava o cache."""
+        save_cache(tokens, self.cache_file)
+        with self._lock:
+            self.tokens.update({k: tokens[k] for k in ("access_token", "expires_at", "refresh_token") if k in tokens})
+            self._update_headers()
+
+    def refresh(self, ahead=REFRESH_AHEAD):
+        """Renova se faltar menos de `ahead` s para expirar. Retorna True se há token válido."""
+        with self._refresh_lock, _file_lock(self.cache_file):
+            if self._load():
+                self.counters["adopted"] += 1
+            if self.expires_in() > ahead:
+                return True
+            if not self.tokens["refresh_token"]:
+                return False
+            print("Renovando access token...")
+            try:
+                tokens = _post_refresh(self.tokens["refresh_token"], self.token_url, self.client_id)
+            except Exception as ex:
+                self.counters["failures"] += 1
+                print(f"Erro ao renovar token: {ex}")
+                return self.expires_in() > EXPIRY_MARGIN
+            tokens["expires_at"] = int(time.time()) + tokens.pop("expires_in", 3600)
+            self.set_tokens(tokens)
+            self.counters["refreshes"] += 1
+            print("Token renovado com sucesso")
+            return True
+
+    def get(self):
+        """Access token válido, ou None se não há como obter um."""
+        t0 = time.monotonic()
+        self.counters["calls"] += 1
+        if self.expires_in() <= EXPIRY_MARGIN:
+            # Caminho lento: só sem a thread de renovação ou se ela vem falhando
+            self.refresh(ahead=EXPIRY_MARGIN)
+            waited = time.monotonic() - t0
+            self.counters["waits"] += 1
+            self.counters["wait_s"] += waited
+            self.counters["max_wait_s"] = max(self.counters["max_wait_s"], waited)
+        if self.expires_in() <= EXPIRY_MARGIN:
+            return None
+        return self.tokens["access_token"]
+
+    def headers(self):
+        """Dict de cabeçalhos com o Authorization sempre atualizado a cada renovação."""
+        headers = {}
+        with self._lock:
+            self._live_headers.append(headers)
+            if self.tokens["access_token"]:
+                headers["Authorization"] = f"Bearer {self.tokens['access_token']}"
+        return headers
+
+    def _run(self):
+        delay = RETRY_MIN
+        while True:
+            self._load()
+            wait = self.expires_in() - REFRESH_AHEAD
+            if wait > 0:
+                # Acorda de tempos em tempos: outro processo pode ter renovado antes
+                time.sleep(min(wait, RETRY_MAX))
+                continue
+            if self.refresh() and self.expires_in() > REFRESH_AHEAD:
+                delay = RETRY_MIN
+                continue
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX)
+
+    def start(self):
+        """Liga a renovação em segundo plano (thread daemon)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="token-refresh")
+            self._thread.start()
+        return self
+
+    def stats(self):
+        out = dict(self.counters)
+        out["wait_s"] = round(out["wait_s"], 3)
+        out["max_wait_s"] = round(out["max_wait_s"], 3)
+        out["expires_in_s"] = int(self.expires_in()) if self.tokens["access_token"] else None
+        out["background"] = self._thread is not None
+        return out
+
+
+_manager = None
+
+
+def manager():
+    """TokenManager padrão do processo (token_cache.json + HEXA_REFRESH_TOKEN)."""
+    global _manager
+    if _manager is None:
+        _manager = TokenManager(refresh_token=os.environ.get("HEXA_REFRESH_TOKEN") or None)
+    return _manager
+
+
 def get_access_token(code=None):
-    cache = load_cache()
     if code:
-        return exchange_code_for_tokens(code)["access_token"]
-    if cache:
-        if time.time() < cache.get("expires_at", 0):
-            return cache["access_token"]
-        elif "refresh_token" in cache:
-            return refresh_tokens(cache["refresh_token"])["access_token"]
+        tokens = exchange_code_for_tokens(code)
+        manager().set_tokens(tokens)
+        return tokens["access_token"]
+    token = manager().get()
+    if token:
+        return token
     print("Nenhum token válido. Rode com --code primeiro.")
     sys.exit(1)
 
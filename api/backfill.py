@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Backfill histórico retomável: estações x dias direto no armazenamento local.
+
+Cada unidade de trabalho é (sessão, dia UTC). As unidades concluídas vão para
+um manifesto NDJSON só de append (data/backfill_manifest.ndjson), uma linha
+por unidade, gravada depois que os registros estão no armazenamento; ao rodar
+de novo, o que já está no manifesto é pulado e o backfill continua exatamente
+de onde parou. Unidades que falham voltam para a fila até --retries vezes e,
+se ainda falharem, ficam de fora do manifesto para a próxima execução.
+
+As requisições passam pelo agendador de cota com prioridade BACKFILL (a
+atualização ao vivo do servidor continua na frente); esgotada a parte da
+cota diária disponível para backfill, a execução para e pode ser retomada
+no dia seguinte. Exemplo (últimos 2 anos, todas as estações ativas):
+    python api/backfill.py --days 730 --workers 8
+"""
+
+import argparse, collections, concurrent.futures, json, os, threading, time
+from datetime import datetime, timedelta, timezone
+
+import auth
+import chunker
+import client
+import scheduler
+import stations
+import store
+from query import API_BASE, fetch_range
+
+MANIFEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "backfill_manifest.ndjson")
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+RETRY_DELAY = 30
+PROGRESS_EVERY = 10
+
+
+class Manifest:
+    """Manifesto de unidades concluídas: append de uma linha JSON por unidade."""
+
+    def __init__(self, path=MANIFEST_FILE):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        continue  # linha truncada por uma queda no meio da escrita
+                    self.done.add((item["session"], item["day"]))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def mark(self, session, day, records, written):
+        line = json.dumps({"session": session, "day": day, "records": records, "written": written,
+                           "at": int(time.time())}, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.done.add((session, day))
+
+    def close(self):
+        self._file.close()
+
+
+def day_range(start_day, end_day):
+    """Dias 'AAAA-MM-DD' de start_day até end_day (exclusive), do mais novo ao mais antigo."""
+    day = datetime.strptime(end_day, "%Y-%m-%d")
+    first = datetime.strptime(start_day, "%Y-%m-%d")
+    out = []
+    while day > first:
+        day -= timedelta(days=1)
+        out.append(day.strftime("%Y-%m-%d"))
+    return out
+
+
+def fetch_unit(session, day, headers):
+    """Busca um dia de uma sessão (dividindo respostas truncadas). Retorna registros ou None se falhou."""
+    start_ts = store._day_start(day)
+    pending, records = [(start_ts, start_ts + 86400)], []
+    while pending:
+        lo, hi = pending.pop()
+        res = fetch_range(lo, hi, headers, session=session)
+        if res.get("failed"):
+            return None
+        truncated = res["count"] > len(res["data"]) or len(res["data"]) >= chunker.RESPONSE_LIMIT
+        if truncated and hi - lo > chunker.MIN_CHUNK:
+            mid = lo + (hi - lo) // 2
+            pending += [(mid, hi), (lo, mid)]
+            continue
+        records.extend(res["data"])
+    return records
+
+
+class Progress:
+    def __init__(self, total):
+        self.total = total
+        self.units = 0
+        self.records = 0
+        self.written = 0
+        self.failed = 0
+        self.t0 = time.time()
+        self.last = 0.0
+
+    def report(self, force=False):
+        now = time.time()
+        if not force and now - self.last < PROGRESS_EVERY:
+            return
+        self.last = now
+        elapsed = max(now - self.t0, 1e-6)
+        rate = self.units / elapsed
+        eta = (self.total - self.units) / rate if rate else float("inf")
+        eta_txt = str(timedelta(seconds=int(eta))) if eta != float("inf") else "?"
+        quota = scheduler.stats()
+        print(f"[{self.units}/{self.total} unidades] {self.records} registros, {self.records / elapsed:.0f} reg/s, "
+              f"{rate * 60:.1f} unid/min, ETA {eta_txt} | falhas {self.failed} | "
+              f"cota {quota['used_today']}/{quota['per_day']}")
+
+
+def run(units, headers, manifest, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, retry_delay=RETRY_DELAY):
+    """Executa as unidades (sessão, dia) em paralelo. Retorna (Progress, unidades pendentes)."""
+    queue = collections.deque((u, 0, 0.0) for u in units)  # (unidade, tentativas, não antes de)
+    progress = Progress(len(units))
+    gave_up = []
+    stop = False
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+    pending = {}
+    try:
+        while queue or pending:
+            now = time.time()
+            while not stop and queue and len(pending) < 2 * workers and queue[0][2] <= now:
+                unit, attempts, _ = queue.popleft()
+                pending[pool.submit(fetch_unit, *unit, headers)] = (unit, attempts)
+            if not pending:
+                if stop:
+                    break
+                time.sleep(max(min(q[2] for q in queue) - now, 0.1))
+                continue
+            done, _ = concurrent.futures.wait(pending, timeout=1, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                (session, day), attempts = pending.pop(f)
+                data = f.result()
+                if data is None:
+                    progress.failed += 1
+                    quota = scheduler.stats()  # contador da conta, somando os outros processos
+                    if quota["remaining_today"] <= quota["per_day"] * (1 - scheduler.BACKFILL_RESERVE):
+                        stop = True  # cota de backfill do dia acabou: o resto fica para a próxima execução
+                    if attempts + 1 < retries and not stop:
+                        queue.append(((session, day), attempts + 1, time.time() + retry_delay * (attempts + 1)))
+                    else:
+                        gave_up.append((session, day))
+                    continue
+                written = store.append_records(data)
+                manifest.mark(session, day, len(data), written)
+                progress.units += 1
+                progress.records += len(data)
+                progress.written += written
+            progress.report()
+    finally:
+        for f in pending:
+            f.cancel()
+        pool.shutdown(wait=True)
+        progress.report(force=True)
+    left = gave_up + [q[0] for q in queue] + [u for u, _ in pending.values()]
+    return progress, left
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill histórico retomável (estações x dias) no armazenamento local")
+    parser.add_argument("--days", type=int, default=730, help="Quantos dias completos para trás (default: 2 anos)")
+    parser.add_argument("--start", help="Primeiro dia (AAAA-MM-DD); substitui --days")
+    parser.add_argument("--end", help="Dia final, exclusive (AAAA-MM-DD; default: hoje, só dias completos)")
+    parser.add_argument("--sessions", help="Sessões separadas por vírgula (default: estações ativas do cadastro)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Requisições em paralelo")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES, help="Tentativas por unidade nesta execução")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="Manifesto de unidades concluídas")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout de leitura por requisição (s)")
+    parser.add_argument("--code", help="Authorization code (se precisar renovar token)")
+    args = parser.parse_args()
+
+    end_day = args.end or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    start_day = args.start or (datetime.strptime(end_day, "%Y-%m-%d") - timedelta(days=args.days)).strftime("%Y-%m-%d")
+    sessions = args.sessions.split(",") if args.sessions else [s["session"] for s in stations.get().active()]
+
+    client.configure(pool_size=args.workers, timeout=(5, args.timeout))
+    auth.get_access_token(args.code)
+    headers = auth.manager().start().headers()
+    scheduler.load_quota(API_BASE, headers)
+
+    manifest = Manifest(args.manifest)
+    days = day_range(start_day, end_day)
+    units = [(s, d) for d in days for s in sessions if (s, d) not in manifest.done]
+    total = len(days) * len(sessions)
+    print(f"Backfill {start_day} -> {end_day}: {len(sessions)} estações x {len(days)} dias = {total} unidades, "
+          f"{total - len(units)} já concluídas, {len(units)} a buscar ({args.workers} em paralelo)")
+    if not units:
+        return
+
+    try:
+        progress, left = run(units, headers, manifest, args.workers, args.retries)
+    finally:
+        manifest.close()
+    elapsed = time.time() - progress.t0
+    print(f"\nConcluídas {progress.units} unidades, {progress.records} registros "
+          f"({progress.written} novos no armazenamento) em {elapsed:.0f}s")
+    if left:
+        print(f"{len(left)} unidades pendentes (falha ou cota); rode de novo para retomar.")
+
+
+if __name__ == "__main__":
+    main()
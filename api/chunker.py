@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Divisão adaptativa de intervalos de tempo para consultas longas na API.
+
+Em vez de blocos fixos de 24h, o tamanho do bloco parte do aprendido nas
+execuções anteriores (ou, sem histórico, dos mesmos 24h) e se ajusta conforme
+as respostas:
+respostas truncadas são refeitas em duas metades, respostas grandes ou lentas
+reduzem o bloco seguinte e respostas vazias fazem os próximos blocos vizinhos
+serem mesclados. O tamanho aprendido e o histórico de divisões ficam em
+data/chunk_history.json para as próximas execuções da mesma consulta.
+"""
+
+import json, os, threading, time
+from collections import deque
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "chunk_history.json")
+
+MIN_CHUNK = 15 * 60
+MAX_CHUNK = 7 * 24 * 3600
+# Registros desejados por resposta
+TARGET_RECORDS = 5000
+# Acima disso a resposta é tratada como possivelmente truncada pela API
+RESPONSE_LIMIT = 10000
+SLOW_RESPONSE_S = 15.0
+# Bloco inicial sem histórico: o antigo bloco fixo; respostas truncadas o reduzem
+INITIAL_CHUNK = 24 * 3600
+# Estimativa inicial da taxa aprendida: estações reportam a cada minuto
+DEFAULT_SAMPLES_PER_HOUR = 60
+NETWORK_STATIONS = 31
+MAX_SPLITS_KEPT = 50
+
+_lock = threading.Lock()
+
+
+def load_history():
+    if os.path.exists(HISTORY_FILE):
+        with open(HISTORY_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def save_history(history):
+    os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
+    tmp = HISTORY_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(history, f, indent=1)
+    os.replace(tmp, HISTORY_FILE)
+
+
+def query_key(device_id=None, session=None, lat=None, lon=None, radius_km=None):
+    """Chave do histórico: a estação consultada ou a rede inteira (com filtro geográfico)."""
+    if session:
+        return f"session:{session}"
+    if device_id:
+        return f"device:{device_id}"
+    if lat and lon and radius_km:
+        return f"geo:{lat:.3f},{lon:.3f},{radius_km:g}"
+    return "rede"
+
+
+class AdaptiveChunker:
+    """Gera os intervalos de uma consulta e aprende o tamanho de bloco com as respostas."""
+
+    def __init__(self, key, start_ts, end_ts, history=None):
+        self.key = key
+        self.end_ts = end_ts
+        self.cursor = start_ts
+        self.history = history if history is not None else load_history()
+        entry = self.history.get(key, {})
+        default_rate = DEFAULT_SAMPLES_PER_HOUR * (NETWORK_STATIONS if key == "rede" or key.startswith("geo:") else 1)
+        self.samples_per_hour = entry.get("samples_per_hour", default_rate)
+        # A taxa padrão (rede inteira a cada minuto) daria blocos de ~2.7h e centenas
+        # de requisições numa consulta longa; só uma taxa aprendida define o bloco
+        self.chunk = entry.get("chunk_s") or (self._estimate_chunk() if "samples_per_hour" in entry else INITIAL_CHUNK)
+        self.splits = entry.get("splits", [])
+        self.retry = deque()
+        self.stats = {"requests": 0, "splits": 0, "merges": 0, "refetched": 0}
+
+    def _estimate_chunk(self):
+        hours = TARGET_RECORDS / max(self.samples_per_hour, 1e-3)
+        return int(min(max(hours * 3600, MIN_CHUNK), MAX_CHUNK))
+
+    def next_range(self):
+        """Próximo intervalo a buscar (refetch de metades primeiro) ou None se acabou."""
+        with _lock:
+            if self.retry:
+                return self.retry.popleft()
+            if self.cursor >= self.end_ts:
+                return None
+            rng = (self.cursor, min(self.cursor + int(self.chunk), self.end_ts))
+            self.cursor = rng[1]
+            return rng
+
+    def _record_split(self, rng, reason):
+        self.stats["splits"] += 1
+        self.splits.append([int(time.time()), rng[1] - rng[0], int(self.chunk), reason])
+        del self.splits[:-MAX_SPLITS_KEPT]
+
+    def feed(self, rng, count, n_records, duration):
+        """Ajusta o bloco com a resposta de rng. Retorna False se a resposta deve ser
+        descartada (truncada) porque o intervalo volta à fila em duas metades."""
+        span = rng[1] - rng[0]
+        with _lock:
+            self.stats["requests"] += 1
+            truncated = count > n_records or n_records >= RESPONSE_LIMIT
+            if truncated and span > MIN_CHUNK:
+                mid = rng[0] + span // 2
+                self.retry.extendleft([(mid, rng[1]), (rng[0], mid)])
+                self.chunk = max(MIN_CHUNK, min(self.chunk, span // 2))
+                self.stats["refetched"] += 1
+                self._record_split(rng, "truncada")
+                return False
+
+            if n_records:
+                rate = n_records / (span / 3600)
+                self.samples_per_hour = 0.7 * self.samples_per_hour + 0.3 * rate
+
+            if n_records > TARGET_RECORDS * 1.5 or duration > SLOW_RESPONSE_S:
+                self.chunk = max(MIN_CHUNK, self.chunk // 2)
+                self._record_split(rng, "lenta" if duration > SLOW_RESPONSE_S else "grande")
+            elif n_records == 0:
+                # Intervalo vazio: mescla os próximos vizinhos num bloco maior
+                self.chunk = min(MAX_CHUNK, self.chunk * 2)
+                self.stats["merges"] += 1
+            elif n_records < TARGET_RECORDS / 4:
+                self.chunk = min(MAX_CHUNK, int(self.chunk * 1.5))
+            return True
+
+    def save(self):
+        """Persiste o bloco aprendido para a próxima execução desta consulta."""
+        with _lock:
+            # O bloco final oscila com as últimas respostas; limita-o à faixa
+            # coerente com a taxa de amostras aprendida
+            est = self._estimate_chunk()
+            self.history[self.key] = {
+                "chunk_s": int(min(max(self.chunk, est // 2, MIN_CHUNK), est * 2)),
+                "samples_per_hour": round(self.samples_per_hour, 2),
+                "updated": int(time.time()),
+                "splits": self.splits,
+            }
+            save_history(self.history)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Cliente HTTP compartilhado para a API HexaCloud.
+
+Uma única requests.Session com pool de conexões (keep-alive) dimensionado para
+o número de workers, retries com backoff exponencial + jitter em 429/5xx e
+contadores de latência/retries por requisição. Requisições com prioridade
+passam pelo agendador de cota (scheduler.py) a cada tentativa.
+"""
+
+import random, threading, time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+import scheduler
+
+# (connect, read) em segundos
+DEFAULT_TIMEOUT = (5, 30)
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_session = None
+_pool_size = 10
+_config = {"timeout": DEFAULT_TIMEOUT, "max_retries": MAX_RETRIES}
+
+_stats = {
+    "requests": 0,
+    "retries": 0,
+    "errors": 0,
+    "bytes": 0,
+    "latencies": deque(maxlen=2000),
+}
+
+
+def configure(pool_size=None, timeout=None, max_retries=None):
+    """Ajusta o pool (normalmente = max_workers do executor), timeouts e número de retries.
+
+    Mudar o tamanho do pool recria a sessão na próxima requisição.
+    """
+    global _session, _pool_size
+    with _lock:
+        if pool_size and pool_size != _pool_size:
+            _pool_size = pool_size
+            if _session is not None:
+                _session.close()
+                _session = None
+        if timeout is not None:
+            _config["timeout"] = timeout
+        if max_retries is not None:
+            _config["max_retries"] = max_retries
+
+
+def get_session():
+    """Sessão compartilhada, criada sob demanda."""
+    global _session
+    with _lock:
+        if _session is None:
+            s = requests.Session()
+            # Retries ficam por nossa conta (backoff + contadores)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=_pool_size, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            _session = s
+        return _session
+
+
+def should_retry(status, text):
+    if status in RETRY_STATUS:
+        return True
+    return status != 200 and "Limite" in text
+
+
+def backoff(attempt, retry_after=None):
+    """Backoff exponencial com jitter completo; respeita Retry-After quando presente."""
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method, url, timeout=None, max_retries=None, priority=None, **kwargs):
+    """Faz a requisição com retries. Retorna a última Response; relança a exceção de rede
+    se todas as tentativas falharem.
+
+    Com priority (scheduler.LIVE/BACKFILL), cada tentativa consome um token da
+    cota da API; scheduler.QuotaExceeded é propagada para o chamador.
+    """
+    timeout = timeout or _config["timeout"]
+    max_retries = _config["max_retries"] if max_retries is None else max_retries
+    session = get_session()
+
+    for attempt in range(max_retries + 1):
+        if priority is not None:
+            scheduler.acquire(priority)
+        t0 = time.time()
+        try:
+            resp = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            record_request(time.time() - t0, error=True)
+            if attempt == max_retries:
+                raise
+            count_retry()
+            time.sleep(backoff(attempt))
+            continue
+
+        record_request(time.time() - t0, nbytes=len(resp.content), error=resp.status_code >= 400)
+        if attempt < max_retries and should_retry(resp.status_code, resp.text):
+            count_retry()
+            time.sleep(backoff(attempt, resp.headers.get("Retry-After")))
+            continue
+        return resp
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def record_request(latency, nbytes=0, error=False):
+    with _lock:
+        _stats["requests"] += 1
+        _stats["bytes"] += nbytes
+        _stats["errors"] += int(error)
+        _stats["latencies"].append(latency)
+
+
+def count_retry():
+    with _lock:
+        _stats["retries"] += 1
+
+
+def stats():
+    """Resumo dos contadores: requisições, retries, erros, bytes e latência (média/p50/p95)."""
+    with _lock:
+        lat = sorted(_stats["latencies"])
+        out = {k: _stats[k] for k in ("requests", "retries", "errors", "bytes")}
+    if lat:
+        out["latency_mean"] = sum(lat) / len(lat)
+        out["latency_p50"] = lat[len(lat) // 2]
+        out["latency_p95"] = lat[min(int(len(lat) * 0.95), len(lat) - 1)]
+    return out
+
+
+def format_stats():
+    s = stats()
+    text = f"{s['requests']} req, {s['retries']} retries, {s['errors']} erros, {s['bytes']/1024:.0f} KB"
+    if "latency_mean" in s:
+        text += (f" | latência média {s['latency_mean']:.2f}s, p50 {s['latency_p50']:.2f}s,"
+                 f" p95 {s['latency_p95']:.2f}s")
+    return text
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Exportação e leitura colunar (Parquet) das leituras brutas, particionada por estação e dia.
+
+Layout (partições no estilo Hive, legíveis por pyarrow, pandas, DuckDB, Spark):
+    <raiz>/session=<sessão>/date=<AAAA-MM-DD>/part-<lote>-<n>.parquet
+Cada lote gravado vira um arquivo novo por partição, então exportações em
+streaming ou repetidas só acrescentam arquivos, e a mesma leitura pode
+estar em mais de um deles. Em vez de regravar partições (uma exportação
+parcial de um dia substituiria a completa), read_table() descarta as
+linhas repetidas (mesmo device_id e time), mantendo uma. As colunas seguem o
+armazenamento local (store.COLUMNS): time (timestamp UTC, em segundos
+inteiros), rain em float64 e os demais sensores em float32; device_id é
+dicionário.
+
+read_frame() lê só as colunas pedidas e só as partições do intervalo e das
+estações pedidas (poda pelos diretórios session=/date=, sem abrir os outros
+arquivos), e ainda filtra o time dentro dos arquivos pelas estatísticas de
+cada row group. Requer pyarrow (pip install pyarrow).
+"""
+
+import argparse, os, time, uuid
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+import stations
+import store
+from store import COLUMNS, SENSOR_FIELDS, record_ts
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+except ImportError:  # opcional: só a exportação/leitura Parquet precisa
+    pa = None
+
+FLUSH_ROWS = 500_000
+ROW_GROUP_ROWS = 128 * 1024
+PARTITIONS = ["session", "date"]
+_TYPES = {"<i8": "int64", "<f8": "float64", "<f4": "float32"}
+
+
+def _require():
+    if pa is None:
+        raise RuntimeError("Formato parquet requer pyarrow (pip install pyarrow)")
+
+
+def schema(fields=SENSOR_FIELDS):
+    _require()
+    cols = [pa.field("device_id", pa.dictionary(pa.int32(), pa.string())),
+            pa.field("time", pa.timestamp("s", tz="UTC"))]
+    cols += [pa.field(f, getattr(pa, _TYPES[COLUMNS[f]])()) for f in fields]
+    return pa.schema(cols + [pa.field("session", pa.string()), pa.field("date", pa.string())])
+
+
+def _session(device_id, by_device):
+    return by_device.get(device_id, {}).get("session", "desconhecida")
+
+
+def _table(device_ids, times, values, sessions, fields):
+    times = pa.array(times, pa.int64())
+    cols = {
+        "device_id": pa.array(device_ids, pa.string()).dictionary_encode(),
+        "time": times.cast(pa.timestamp("s", tz="UTC")),
+    }
+    for f in fields:
+        cols[f] = pa.array(values[f], getattr(pa, _TYPES[COLUMNS[f]])())
+    cols["session"] = pa.array(sessions, pa.string())
+    # Dia UTC da partição (AAAA-MM-DD), como no armazenamento local
+    cols["date"] = pc.strftime(cols["time"], format="%Y-%m-%d")
+    return pa.table(cols, schema=schema(fields))
+
+
+def records_table(records, fields=SENSOR_FIELDS):
+    """Registros (dicts da API) -> pyarrow.Table com as colunas de schema().
+
+    A sessão vem do registro ou, se faltar, do cadastro de estações; registros
+    sem time válido são descartados.
+    """
+    _require()
+    by_device = stations.get().by_device
+    rows = [(ts, rec) for rec in records if (ts := record_ts(rec)) is not None]
+    values = {f: [store._to_float(rec.get(f)) for _, rec in rows] for f in fields}
+    sessions = [rec.get("session") or _session(rec.get("device_id"), by_device) for _, rec in rows]
+    return _table([rec.get("device_id") for _, rec in rows], [t for t, _ in rows], values, sessions, fields)
+
+
+def columns_table(device_id, cols, fields=SENSOR_FIELDS):
+    """Uma partição do armazenamento local (store.iter_range) -> pyarrow.Table."""
+    _require()
+    n = len(cols["time"])
+    session = _session(device_id, stations.get().by_device)
+    return _table([device_id] * n, cols["time"], {f: cols[f] for f in fields}, [session] * n, fields)
+
+
+class DatasetWriter:
+    """Grava registros (ou tabelas) no dataset particionado em lotes de até FLUSH_ROWS linhas."""
+
+    def __init__(self, root, fields=SENSOR_FIELDS, flush_rows=FLUSH_ROWS):
+        _require()
+        self.root = root
+        self.fields = fields
+        self.flush_rows = flush_rows
+        self.rows = 0
+        self.files = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, records):
+        self.write_table(records_table(records, self.fields))
+
+    def write_table(self, table):
+        self._buffer.append(table)
+        self._buffered += table.num_rows
+        if self._buffered >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        table = pa.concat_tables(self._buffer).unify_dictionaries()
+        self._buffer, self._buffered = [], 0
+        written = []
+        ds.write_dataset(table, self.root, format="parquet", partitioning=_partitioning(),
+                         basename_template=f"part-{uuid.uuid4().hex[:12]}-{{i}}.parquet",
+                         existing_data_behavior="overwrite_or_ignore", max_rows_per_group=ROW_GROUP_ROWS,
+                         file_visitor=written.append)
+        self.rows += table.num_rows
+        self.files += len(written)
+
+    def close(self):
+        self.flush()
+
+
+def write_records(records, root, fields=SENSOR_FIELDS):
+    """Exporta registros para o dataset em root. Retorna (linhas, arquivos) gravados."""
+    writer = DatasetWriter(root, fields)
+    writer.write(records)
+    writer.close()
+    return writer.rows, writer.files
+
+
+def _partitioning():
+    return ds.partitioning(pa.schema([(p, pa.string()) for p in PARTITIONS]), flavor="hive")
+
+
+def dataset(root):
+    _require()
+    return ds.dataset(root, format="parquet", partitioning=_partitioning())
+
+
+def _days(start_ts, end_ts):
+    day = datetime.fromtimestamp(start_ts, timezone.utc).date()
+    last = datetime.fromtimestamp(end_ts - 1, timezone.utc).date()
+    out = []
+    while day <= last:
+        out.append(day.isoformat())
+        day += timedelta(days=1)
+    return out
+
+
+def _dedup(table):
+    """Remove linhas repetidas (mesmo device_id e time) de exportações sobrepostas, mantendo a primeira."""
+    if table.num_rows < 2:
+        return table
+    table = table.unify_dictionaries()
+    device = pc.fill_null(table["device_id"].combine_chunks().indices, -1).to_numpy()
+    ts = table["time"].combine_chunks().cast(pa.int64()).to_numpy(zero_copy_only=False)
+    order = np.lexsort((ts, device))
+    dup = (device[order][1:] == device[order][:-1]) & (ts[order][1:] == ts[order][:-1])
+    if not dup.any():
+        return table
+    keep = np.ones(table.num_rows, dtype=bool)
+    keep[order[1:][dup]] = False
+    return table.filter(pa.array(keep))
+
+
+def read_table(root, start_ts=None, end_ts=None, sessions=None, device_ids=None,
+               columns=("device_id", "time", "rain")):
+    """Lê do dataset só as colunas e partições necessárias para [start_ts, end_ts) e as estações dadas.
+
+    sessions/device_ids: filtros opcionais. device_ids é conferido linha a
+    linha e, se todos estiverem no cadastro, também vira poda por sessão.
+    Leituras repetidas entre exportações saem uma vez só (ver _dedup).
+    """
+    data = dataset(root)
+    expr = None
+
+    def add(cond):
+        nonlocal expr
+        expr = cond if expr is None else expr & cond
+
+    if device_ids is not None:
+        by_device = stations.get().by_device
+        if all(d in by_device for d in device_ids):
+            known = {by_device[d]["session"] for d in device_ids}
+            sessions = known if sessions is None else set(sessions) & known
+        add(pc.field("device_id").isin(list(device_ids)))
+    if sessions is not None:
+        add(pc.field("session").isin(sorted(sessions)))
+    if start_ts is not None and end_ts is not None:
+        add(pc.field("date").isin(_days(start_ts, end_ts)))
+    if start_ts is not None:
+        add(pc.field("time") >= pa.scalar(int(start_ts), pa.timestamp("s", tz="UTC")))
+    if end_ts is not None:
+        add(pc.field("time") < pa.scalar(int(end_ts), pa.timestamp("s", tz="UTC")))
+    columns = list(columns)
+    keys = [c for c in ("device_id", "time") if c not in columns]
+    return _dedup(data.to_table(columns=columns + keys, filter=expr)).select(columns)
+
+
+def read_frame(root, start_ts=None, end_ts=None, sessions=None, device_ids=None,
+               columns=("device_id", "time", "rain")):
+    """read_table() como DataFrame do pandas (device_id categórico, time datetime UTC)."""
+    return read_table(root, start_ts, end_ts, sessions, device_ids, columns).to_pandas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta o armazenamento local para Parquet particionado")
+    parser.add_argument("output", help="Diretório do dataset (session=/date=)")
+    parser.add_argument("--days", type=int, default=30, help="Dias exportados (até agora)")
+    args = parser.parse_args()
+
+    end_ts = int(time.time())
+    writer = DatasetWriter(args.output)
+    for device_id, cols in store.iter_range(end_ts - args.days * 86400, end_ts):
+        writer.write_table(columns_table(device_id, cols))
+    writer.close()
+    print(f"{writer.rows} leituras em {writer.files} arquivos Parquet em {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
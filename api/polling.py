@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Agenda adaptativa de coleta por estação.
+
+Em vez de buscar todas as estações a cada 20 minutos, cada estação tem o seu
+intervalo:
+- chovendo (alguma leitura com rain > 0 nos últimos RAIN_LOOKBACK s):
+  WET_INTERVAL, para o mapa acompanhar a chuva de perto;
+- seca: começa em DRY_MIN e recua (x DRY_BACKOFF a cada coleta seca) até
+  DRY_MAX; enquanto chove em alguma estação, as secas ficam em DRY_MIN;
+- sem dados (resposta vazia ou falha): o intervalo dobra a cada vez, até
+  EMPTY_MAX.
+
+Os intervalos são esticados, se preciso, para caber no que resta da cota
+diária da conta (scheduler.stats(), que inclui o gasto de query.py e
+backfill.py), preservando primeiro as estações com chuva.
+stats() expõe intervalos, coletas, requisições e o atraso até o mapa.
+"""
+
+import threading, time
+
+import scheduler
+
+WET_INTERVAL = 90
+DRY_MIN = 30 * 60
+DRY_MAX = 60 * 60
+DRY_BACKOFF = 1.5
+EMPTY_MAX = 3 * 3600
+# Janela em que uma leitura com chuva marca a estação como "chovendo"
+RAIN_LOOKBACK = 15 * 60
+# Estações que vencem até BATCH_SLACK s depois da primeira entram na mesma coleta
+BATCH_SLACK = 30
+# Parte da cota restante que as estações com chuva podem ocupar sozinhas
+WET_SHARE = 0.8
+
+
+class PollPlanner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = {}  # session -> dict(interval, next, polls, empty, last_rain, wet)
+        self.stretch = 1.0
+        self.cycles = 0
+        self.polls = 0
+        self.lags = []  # atraso (s) entre a leitura mais nova e a publicação do mapa
+
+    def _station(self, session):
+        st = self.state.get(session)
+        if st is None:
+            st = self.state[session] = {"interval": DRY_MIN, "base": DRY_MIN, "next": 0.0, "polls": 0,
+                                        "empty": 0, "last_rain": None, "wet": False}
+        return st
+
+    def due(self, sessions, now=None):
+        """Estações a coletar agora (vencidas ou que vencem dentro de BATCH_SLACK)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return [s for s in sessions if self._station(s)["next"] <= now + BATCH_SLACK]
+
+    def next_at(self, sessions):
+        """Instante (epoch) em que a próxima estação vence."""
+        with self._lock:
+            return min((self._station(s)["next"] for s in sessions), default=time.time() + DRY_MIN)
+
+    def observe(self, session, readings, now=None):
+        """Registra o resultado da coleta: lista de (ts, rain), [] se vazia ou None se falhou."""
+        now = time.time() if now is None else now
+        with self._lock:
+            st = self._station(session)
+            st["polls"] += 1
+            self.polls += 1
+            if not readings:
+                st["empty"] += 1
+            else:
+                st["empty"] = 0
+                wet_ts = [ts for ts, rain in readings if rain and rain > 0]
+                if wet_ts:
+                    st["last_rain"] = max(wet_ts + [st["last_rain"] or 0])
+            st["wet"] = st["last_rain"] is not None and st["last_rain"] >= now - RAIN_LOOKBACK
+
+    def plan(self, polled, sessions, now=None):
+        """Depois de um ciclo: novo intervalo das estações coletadas (polled) e a
+        próxima coleta de cada uma, com a cota dividida entre todas (sessions)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self.cycles += 1
+            raining = any(self._station(s)["wet"] for s in sessions)
+            for s in polled:
+                st = self._station(s)
+                if st["wet"]:
+                    base = WET_INTERVAL
+                elif raining or st["base"] < DRY_MIN or st["polls"] <= 1:
+                    base = DRY_MIN
+                else:
+                    base = min(st["base"] * DRY_BACKOFF, DRY_MAX)
+                st["base"] = base
+                st["interval"] = min(base * 2 ** st["empty"], EMPTY_MAX) if st["empty"] else base
+            wet_factor, dry_factor = self._budget(sessions, now)
+            self.stretch = dry_factor
+            for s in polled:
+                st = self._station(s)
+                st["effective"] = st["interval"] * (wet_factor if st["wet"] else dry_factor)
+                st["next"] = now + st["effective"]
+
+    def _budget(self, sessions, now):
+        """Fatores (>= 1) que esticam os intervalos (com chuva, secas) para caber
+        no que resta da cota do dia; as estações com chuva ficam com até WET_SHARE."""
+        remaining = scheduler.stats()["remaining_today"]
+        if remaining <= 0:
+            return EMPTY_MAX / WET_INTERVAL, EMPTY_MAX / DRY_MIN
+        allowed = remaining / max(86400 - now % 86400, 60)  # req/s até a virada do dia (UTC)
+        wet = sum(1 / self.state[s]["interval"] for s in sessions if self.state[s]["wet"])
+        dry = sum(1 / self.state[s]["interval"] for s in sessions if not self.state[s]["wet"])
+        if wet + dry <= allowed:
+            return 1.0, 1.0
+        wet_budget = min(wet, allowed * WET_SHARE)
+        wet_factor = wet / wet_budget if wet else 1.0
+        return wet_factor, max(dry / (allowed - wet_budget), 1.0)
+
+    def interval(self, session):
+        """Intervalo efetivo (s) planejado para a estação, já esticado pela cota."""
+        with self._lock:
+            st = self._station(session)
+            return st.get("effective", st["interval"])
+
+    def published(self, newest_ts, now=None):
+        """Registra a publicação de um mapa cuja leitura mais nova é newest_ts."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self.lags.append(now - newest_ts)
+            del self.lags[:-100]
+
+    def stats(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            stations = {
+                s: {
+                    "interval_s": round(st.get("effective", st["interval"]), 1),
+                    "next_in_s": round(max(st["next"] - now, 0), 1),
+                    "wet": st["wet"],
+                    "empty_streak": st["empty"],
+                    "polls": st["polls"],
+                }
+                for s, st in sorted(self.state.items())
+            }
+            rate = sum(3600 / st.get("effective", st["interval"]) for st in self.state.values())
+            lags = sorted(self.lags)
+            return {
+                "cycles": self.cycles,
+                "polls": self.polls,
+                "polls_per_hour": round(rate, 1),
+                "wet_stations": sum(st["wet"] for st in self.state.values()),
+                "quota_stretch": round(self.stretch, 2),
+                "api_requests_today": scheduler.stats()["used_today"],
+                "fresh_lag_s": round(self.lags[-1], 1) if self.lags else None,
+                "fresh_lag_p50_s": round(lags[len(lags) // 2], 1) if lags else None,
+                "stations": stations,
+            }
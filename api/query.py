@@ -1,14 +1,24 @@
 #!/usr/bin/env python3
 """Consulta dados climáticos da API HexaCloud."""
 
-import argparse, requests, json, time, os, statistics
+import argparse, requests, json, time, os, statistics, gzip
 import concurrent.futures
+import auth
 from auth import get_access_token
+import chunker
+import client
+import scheduler
+import columnar
+import stations
+import store
 
-API_URL = "https://m73akbtcad.execute-api.us-east-2.amazonaws.com/v1/query"
+API_BASE = "https://m73akbtcad.execute-api.us-east-2.amazonaws.com/v1/"
+API_URL = API_BASE + "query"
+MAX_WORKERS = 30
 
 
-def fetch_range(start_ts, end_ts, headers, device_id=None, session=None, lat=None, lon=None, radius_km=None):
+def fetch_range(start_ts, end_ts, headers, device_id=None, session=None, lat=None, lon=None, radius_km=None,
+                priority=scheduler.BACKFILL):
     params = {"start_ts": start_ts, "end_ts": end_ts}
     if device_id:
         params["device_id"] = device_id
@@ -20,15 +30,57 @@ def fetch_range(start_ts, end_ts, headers, device_id=None, session=None, lat=Non
         params["radius_km"] = radius_km
 
     t0 = time.time()
-    resp = requests.get(API_URL, params=params, headers=headers)
+    rng = (start_ts, end_ts)
+    try:
+        resp = client.get(API_URL, params=params, headers=headers, priority=priority)
+    except (requests.RequestException, scheduler.QuotaExceeded) as ex:
+        print(f"[FALHA] {start_ts}-{end_ts}: {ex}")
+        return {"duration": time.time() - t0, "count": 0, "data": [], "failed": True, "range": rng}
     duration = time.time() - t0
 
     if resp.status_code == 200:
         data = resp.json()
-        return {"duration": duration, "count": data.get("count", 0), "data": data.get("data", [])}
+        records = data.get("data", [])
+        return {"duration": duration, "count": data.get("count", len(records)), "data": records, "range": rng}
     else:
         print(f"[ERRO] {resp.status_code}: {resp.text}")
-        return {"duration": duration, "count": 0, "data": []}
+        return {"duration": duration, "count": 0, "data": [], "failed": True, "range": rng}
+
+
+def open_output(path):
+    """Abre o arquivo de saída em modo texto; comprime com gzip se terminar em .gz."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def write_ndjson(f, records):
+    """Escreve registros como NDJSON (um objeto JSON por linha)."""
+    for rec in records:
+        f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")))
+        f.write("\n")
+
+
+def iter_adaptive(executor, chunker, fetch_args, max_pending):
+    """Busca os intervalos gerados pelo chunker com no máximo max_pending em voo.
+
+    Gera os resultados aceitos conforme terminam; respostas truncadas voltam ao
+    chunker, que as refaz em metades. Futures consumidos não ficam referenciados.
+    """
+    pending = set()
+    while True:
+        while len(pending) < max_pending:
+            rng = chunker.next_range()
+            if rng is None:
+                break
+            pending.add(executor.submit(fetch_range, rng[0], rng[1], *fetch_args))
+        if not pending:
+            return
+        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for f in done:
+            res = f.result()
+            if res.get("failed") or chunker.feed(res["range"], res["count"], len(res["data"]), res["duration"]):
+                yield res
 
 
 def main():
@@ -39,52 +91,143 @@ def main():
     parser.add_argument("--lat", type=float, help="Latitude para filtro geográfico")
     parser.add_argument("--lon", type=float, help="Longitude para filtro geográfico")
     parser.add_argument("--radius-km", type=float, help="Raio em km")
+    parser.add_argument("--geo-local", action="store_true",
+                        help="Resolver --lat/--lon/--radius-km no cadastro local e consultar cada estação")
     parser.add_argument("--code", help="Authorization code (se precisar renovar)")
     parser.add_argument("--output", default=None, help="Arquivo de saída (default: data/dados_Xdias.json)")
+    parser.add_argument("--format", choices=["json", "ndjson", "parquet"], default="json",
+                        help="json: lista única no final; ndjson: grava cada resposta assim que chega; "
+                             "parquet: dataset particionado por session=/date= (requer pyarrow)")
+    parser.add_argument("--stream", action="store_true", help="Atalho para --format ndjson")
+    parser.add_argument("--gzip", action="store_true", help="Comprimir a saída NDJSON (.ndjson.gz)")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout de leitura por requisição (s)")
+    parser.add_argument("--retries", type=int, default=client.MAX_RETRIES, help="Retries em 429/5xx")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Usar o coletor asyncio (aiohttp) em vez do pool de threads")
+    parser.add_argument("--no-store", action="store_true", help="Não gravar no armazenamento local (data/store)")
     args = parser.parse_args()
 
-    token = get_access_token(args.code)
-    headers = {"Authorization": f"Bearer {token}"}
+    client.configure(pool_size=MAX_WORKERS, timeout=(5, args.timeout), max_retries=args.retries)
+    get_access_token(args.code)
+    # Authorization renovado em segundo plano: backfills longos passam da 1h de validade do token
+    headers = auth.manager().start().headers()
+    scheduler.load_quota(API_BASE, headers)
 
     end_ts = int(time.time())
     start_ts = end_ts - (args.days * 24 * 3600)
-    interval = 24 * 3600
-    ranges = [(t, min(t + interval, end_ts)) for t in range(start_ts, end_ts, interval)]
 
+    # Com --geo-local o filtro geográfico vira uma consulta por sessão, com as
+    # estações do raio resolvidas no índice espacial do cadastro
+    if args.geo_local and args.lat is not None and args.lon is not None and args.radius_km:
+        found = stations.get().within(args.lat, args.lon, args.radius_km)
+        print(f"{len(found)} estações a até {args.radius_km:g} km: {', '.join(st['session'] for st, _ in found)}")
+        targets = [(headers, None, st["session"], None, None, None) for st, _ in found]
+        if not targets:
+            return
+    else:
+        targets = [(headers, args.device_id, args.session, args.lat, args.lon, args.radius_km)]
+
+    if args.stream:
+        args.format = "ndjson"
+    stream = args.format in ("ndjson", "parquet")
+
+    output_dir = os.path.join(os.path.dirname(__file__), "..", "data")
+    os.makedirs(output_dir, exist_ok=True)
+    ext = "ndjson.gz" if args.format == "ndjson" and args.gzip else args.format
+    output_file = args.output or os.path.join(output_dir, f"dados_{args.days}_dias.{ext}")
+
+    # No modo streaming cada resposta vai direto para o arquivo (ou, em
+    # parquet, para lotes do dataset) e para o armazenamento local; só as
+    # métricas ficam em memória.
     results, metrics = [], []
+    total_points, written = 0, 0
+    if args.format == "parquet":
+        out = columnar.DatasetWriter(output_file)
+    else:
+        out = open_output(output_file) if stream else None
     t_start = time.time()
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=30) as executor:
-        futures = [
-            executor.submit(fetch_range, s, e, headers, args.device_id, args.session, args.lat, args.lon, args.radius_km)
-            for s, e in ranges
-        ]
-        for f in concurrent.futures.as_completed(futures):
-            res = f.result()
-            results.extend(res["data"])
-            metrics.append(res)
+    def handle(res):
+        nonlocal total_points, written
+        data = res.pop("data")
+        total_points += len(data)
+        metrics.append(res)
+        if stream:
+            if args.format == "parquet":
+                out.write(data)
+            else:
+                write_ndjson(out, data)
+            if not args.no_store:
+                written += store.append_records(data)
+        else:
+            results.extend(data)
+
+    chunk_stats = {"requests": 0, "refetched": 0, "splits": 0, "merges": 0}
+    try:
+        for fetch_args in targets:
+            key = chunker.query_key(*fetch_args[1:])
+            chunks = chunker.AdaptiveChunker(key, start_ts, end_ts)
+            print(f"Blocos iniciais de {chunks.chunk / 3600:.1f}h ({key}, ~{chunks.samples_per_hour:.0f} amostras/h)")
+            try:
+                if args.use_async:
+                    import asyncio
+                    import async_client
+
+                    async def run_async():
+                        async with async_client.AsyncCollector(MAX_WORKERS, (5, args.timeout), args.retries) as col:
+                            async for res in async_client.iter_adaptive(col, chunks, fetch_args, 2 * MAX_WORKERS):
+                                handle(res)
+
+                    asyncio.run(run_async())
+                else:
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                        for res in iter_adaptive(executor, chunks, fetch_args, max_pending=2 * MAX_WORKERS):
+                            handle(res)
+            finally:
+                chunks.save()
+                for k in chunk_stats:
+                    chunk_stats[k] += chunks.stats[k]
+    finally:
+        if out:
+            out.close()
 
     total_duration = time.time() - t_start
 
-    # Salvar dados
-    output_dir = os.path.join(os.path.dirname(__file__), "..", "data")
-    os.makedirs(output_dir, exist_ok=True)
-    output_file = args.output or os.path.join(output_dir, f"dados_{args.days}_dias.json")
-    with open(output_file, "w") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    if not stream:
+        with open(output_file, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        if not args.no_store:
+            written = store.append_records(results)
+    if not args.no_store:
+        print(f"Armazenamento local: {written} leituras novas em {os.path.abspath(store.STORE_DIR)}")
 
     # Métricas
     durations = [m["duration"] for m in metrics]
     counts = [m["count"] for m in metrics]
     print(f"\n==== MÉTRICAS ====")
-    print(f"Total pontos: {len(results)}")
+    print(f"Total pontos: {total_points}")
     print(f"Tempo total: {total_duration:.2f}s")
     if durations:
         print(f"Médio/req: {statistics.mean(durations):.2f}s")
         print(f"Mais rápida: {min(durations):.2f}s | Mais lenta: {max(durations):.2f}s")
     if counts:
-        print(f"Média pontos/dia: {statistics.mean(counts):.1f}")
-    print(f"Arquivo salvo em: {output_file}")
+        print(f"Média pontos/requisição: {statistics.mean(counts):.1f}")
+    cs = chunk_stats
+    print(f"Blocos: {cs['requests']} respostas, {cs['refetched']} truncadas refeitas, "
+          f"{cs['splits']} reduções, {cs['merges']} mesclas | bloco final {chunks.chunk / 3600:.1f}h")
+    print(f"HTTP: {client.format_stats()}")
+    quota = scheduler.stats()
+    print(f"Cota: {quota['used_today']}/{quota['per_day']} req hoje (todos os processos), "
+          f"espera total {quota['waited_s']:.1f}s")
+    failed = [m["range"] for m in metrics if m.get("failed")]
+    if failed:
+        print(f"ATENÇÃO: {len(failed)} intervalos sem dados por falha/cota (não são dias vazios):")
+        for s, e in sorted(failed):
+            print(f"  {time.strftime('%Y-%m-%d %H:%M', time.gmtime(s))} -> {time.strftime('%Y-%m-%d %H:%M', time.gmtime(e))} UTC")
+    if args.format == "parquet":
+        print(f"Dataset Parquet salvo em: {output_file} ({out.rows} leituras, {out.files} arquivos)")
+    else:
+        print(f"Arquivo salvo em: {output_file}")
 
 
 if __name__ == "__main__":
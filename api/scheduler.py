@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""Agendador de requisições ciente da cota da conta HexaCloud.
+
+Toda busca na API passa por acquire(): um token bucket com a cota por minuto
+do usuário (quota_requests_minute) libera as requisições, uma fila de
+prioridade faz a atualização ao vivo passar na frente do backfill e um
+contador diário acompanha quota_requests_day. Perto do limite o agendador
+avisa no log; esgotada a cota, acquire() levanta QuotaExceeded em vez de
+deixar a requisição falhar e virar dado vazio.
+
+A cota diária é da conta, não do processo: o contador do dia fica em
+data/quota_usage.json (HEXA_QUOTA_FILE), incrementado sob trava de arquivo,
+então server.py, query.py e backfill.py rodando juntos (e reiniciados)
+descontam do mesmo total. O token bucket por minuto continua por processo.
+"""
+
+import base64, contextlib, heapq, itertools, json, os, threading, time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos, só a escrita atômica
+    fcntl = None
+
+LIVE = 0
+BACKFILL = 1
+
+# Cotas padrão do plano (docs/API.md), usadas até load_quota() ler as do usuário
+DEFAULT_PER_MINUTE = 60
+DEFAULT_PER_DAY = 1000
+# Fração da cota diária acima da qual só a atualização ao vivo é atendida
+BACKFILL_RESERVE = 0.9
+WARN_LEVELS = (0.5, 0.8, 0.9, 1.0)
+USAGE_FILE = os.environ.get(
+    "HEXA_QUOTA_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "quota_usage.json"))
+
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Trava exclusiva entre processos (flock num arquivo .lock ao lado do contador)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Scheduler:
+    def __init__(self, per_minute=DEFAULT_PER_MINUTE, per_day=DEFAULT_PER_DAY, usage_file=USAGE_FILE):
+        """usage_file: contador diário compartilhado entre processos (None = só em memória)."""
+        self.usage_file = usage_file
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self.day = _today()
+        self.used_today = 0
+        self.waited = 0.0
+        self.rejected = 0
+        self._warned = set()
+        self.quota_loaded = False
+        self.set_quota(per_minute, per_day)
+
+    def set_quota(self, per_minute, per_day):
+        with self._cond:
+            self.per_minute = max(int(per_minute), 1)
+            self.per_day = max(int(per_day), 1)
+            self.rate = self.per_minute / 60.0
+            self.capacity = float(self.per_minute)
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _read_usage(self):
+        """Atualiza day/used_today com o contador do arquivo (zerado na virada do dia UTC)."""
+        today = _today()
+        used = self.used_today if self.day == today else 0
+        if self.usage_file:
+            try:
+                with open(self.usage_file) as f:
+                    usage = json.load(f)
+                used = int(usage["used"]) if usage.get("day") == today else 0
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                pass
+        if today != self.day:
+            self._warned.clear()
+        self.day, self.used_today = today, used
+
+    def _write_usage(self):
+        if not self.usage_file:
+            return
+        tmp = f"{self.usage_file}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"day": self.day, "used": self.used_today}, f)
+        os.replace(tmp, self.usage_file)
+
+    @contextlib.contextmanager
+    def _usage(self):
+        """Contador do dia lido e gravado sob a trava de arquivo (ou só em memória)."""
+        if not self.usage_file:
+            self._read_usage()
+            yield
+            return
+        with _file_lock(self.usage_file):
+            self._read_usage()
+            yield
+
+    def _check_budget(self, priority):
+        if self.used_today >= self.per_day:
+            self.rejected += 1
+            raise QuotaExceeded(f"Cota diaria esgotada ({self.used_today}/{self.per_day} requisicoes)")
+        if priority > LIVE and self.used_today >= self.per_day * BACKFILL_RESERVE:
+            self.rejected += 1
+            raise QuotaExceeded(
+                f"Cota diaria em {self.used_today}/{self.per_day}: restante reservado para atualizacao ao vivo")
+
+    def _warn(self):
+        frac = self.used_today / self.per_day
+        for level in WARN_LEVELS:
+            if frac >= level and level not in self._warned:
+                self._warned.add(level)
+                print(f"[COTA] {self.used_today}/{self.per_day} requisicoes usadas hoje ({level:.0%} da cota diaria)")
+
+    def _consume(self, priority):
+        """Confere a cota diária de novo e desconta a requisição no contador compartilhado."""
+        with self._usage():
+            self._check_budget(priority)
+            self.used_today += 1
+            self._write_usage()
+        self._warn()
+
+    def acquire(self, priority=BACKFILL, timeout=None):
+        """Bloqueia até haver token para esta requisição, respeitando a prioridade.
+
+        Retorna o tempo de espera (s). Levanta QuotaExceeded se a cota diária
+        não comporta a requisição, conferida antes e de novo depois da espera
+        pelo token (outros processos podem ter gasto a cota nesse meio tempo).
+        Com timeout (s), desiste da fila se o token não vier nesse prazo e
+        retorna None.
+        """
+        t0 = time.monotonic()
+        deadline = None if timeout is None else t0 + timeout
+        with self._cond:
+            with self._usage():
+                self._check_budget(priority)
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = None
+                    if self._waiters[0] == entry:
+                        self._refill()
+                        if self.tokens >= 1:
+                            heapq.heappop(self._waiters)
+                            self._cond.notify_all()
+                            self._consume(priority)
+                            self.tokens -= 1
+                            break
+                        wait = (1 - self.tokens) / self.rate
+                    if deadline is not None:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            self._leave(entry)
+                            return None
+                        wait = left if wait is None else min(wait, left)
+                    self._cond.wait(wait)
+            except BaseException:
+                self._leave(entry)
+                raise
+            waited = time.monotonic() - t0
+            self.waited += waited
+            return waited
+
+    def _leave(self, entry):
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._cond.notify_all()
+
+    def release(self):
+        """Devolve o token de um acquire() que não virou requisição (ex.: coleta async cancelada)."""
+        with self._cond:
+            with self._usage():
+                self.used_today = max(self.used_today - 1, 0)
+                self._write_usage()
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + 1)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Contadores do agendador; used_today/remaining_today são os da conta (todos os processos)."""
+        with self._cond:
+            self._read_usage()
+            return {
+                "per_minute": self.per_minute,
+                "per_day": self.per_day,
+                "used_today": self.used_today,
+                "remaining_today": max(self.per_day - self.used_today, 0),
+                "queued": len(self._waiters),
+                "waited_s": round(self.waited, 2),
+                "rejected": self.rejected,
+            }
+
+
+_default = Scheduler()
+acquire = _default.acquire
+release = _default.release
+stats = _default.stats
+set_quota = _default.set_quota
+
+
+def quota_loaded():
+    return _default.quota_loaded
+
+
+def token_user_id(access_token):
+    """Extrai o user_id (claim sub) do access token JWT, sem validar a assinatura."""
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get("sub")
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+def load_quota(api_base, headers, user_id=None):
+    """Carrega quota_requests_minute/quota_requests_day do registro do usuário (GET /users/{id})."""
+    import client
+
+    user_id = user_id or token_user_id(headers.get("Authorization", "").replace("Bearer ", ""))
+    if not user_id:
+        return None
+    try:
+        resp = client.get(api_base.rstrip("/") + f"/users/{user_id}", headers=headers, priority=LIVE)
+    except QuotaExceeded as ex:
+        print(f"[COTA] {ex}")
+        return None
+    except Exception as ex:
+        print(f"[COTA] Nao foi possivel ler a cota do usuario: {ex}")
+        return None
+    if resp.status_code != 200:
+        print(f"[COTA] Nao foi possivel ler a cota do usuario: {resp.status_code}")
+        return None
+    user = resp.json()
+    if isinstance(user, dict) and isinstance(user.get("data"), dict):
+        user = user["data"]
+    per_minute = user.get("quota_requests_minute", DEFAULT_PER_MINUTE)
+    per_day = user.get("quota_requests_day", DEFAULT_PER_DAY)
+    set_quota(per_minute, per_day)
+    _default.quota_loaded = True
+    print(f"[COTA] {per_minute} req/min, {per_day} req/dia")
+    return user
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""Cadastro único das estações (sessão, device_id, coordenadas) com índice espacial.
+
+A lista vem de api/stations.json ou do endpoint /devices da API; a versão da
+API fica em cache em data/stations_cache.json por CACHE_TTL segundos. Sessões
+excluídas e a estação de referência são sempre as do stations.json.
+
+O índice é uma grade regular em km (projeção equiretangular em torno do
+centro da rede) e responde "estações a até R km" e "k vizinhos mais próximos"
+visitando só as células próximas; as distâncias finais são de haversine.
+
+Uso:
+    python api/stations.py --lat -22.01 --lon -47.89 --radius-km 3
+    python api/stations.py --lat -22.01 --lon -47.89 --k 5 --refresh
+"""
+
+import argparse, json, math, os, threading, time
+import numpy as np
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stations.json")
+CACHE_FILE = os.environ.get(
+    "HEXA_STATIONS_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "stations_cache.json"))
+CACHE_TTL = int(os.environ.get("HEXA_STATIONS_TTL", 24 * 3600))
+EARTH_RADIUS_KM = 6371.0088
+CELL_KM = 2.0
+# Espera até nova consulta ao /devices quando a anterior falhou
+REFRESH_RETRY = 15 * 60
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Distância em km (vetorizada com numpy)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """Grade de células de cell_km sobre os pontos (lat, lon) para buscas por raio e kNN."""
+
+    def __init__(self, lat, lon, cell_km=CELL_KM):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.cell = cell_km
+        self.lat0 = float(self.lat.mean()) if len(self.lat) else 0.0
+        self.lon0 = float(self.lon.mean()) if len(self.lon) else 0.0
+        self.kx = EARTH_RADIUS_KM * math.radians(1) * math.cos(math.radians(self.lat0))
+        self.ky = EARTH_RADIUS_KM * math.radians(1)
+        ix, iy = self._cell(self.lat, self.lon)
+        self.cells = {}
+        for i, key in enumerate(zip(ix.tolist(), iy.tolist())):
+            self.cells.setdefault(key, []).append(i)
+        self.cells = {k: np.array(v, dtype=np.int64) for k, v in self.cells.items()}
+        if self.cells:
+            keys = np.array(list(self.cells))
+            self.bounds = keys.min(axis=0), keys.max(axis=0)
+
+    def _cell(self, lat, lon):
+        x = (np.asarray(lon) - self.lon0) * self.kx
+        y = (np.asarray(lat) - self.lat0) * self.ky
+        return np.floor(x / self.cell).astype(np.int64), np.floor(y / self.cell).astype(np.int64)
+
+    def _candidates(self, cx, cy, r_lo, r_hi):
+        """Índices nas células do anel de raio r_lo..r_hi (em células) em torno de (cx, cy)."""
+        (x0, y0), (x1, y1) = self.bounds
+        out = []
+        # Só as células dentro da grade ocupada são visitadas
+        for x in range(max(cx - r_hi, x0), min(cx + r_hi, x1) + 1):
+            for y in range(max(cy - r_hi, y0), min(cy + r_hi, y1) + 1):
+                if max(abs(x - cx), abs(y - cy)) >= r_lo:
+                    idx = self.cells.get((x, y))
+                    if idx is not None:
+                        out.append(idx)
+        return np.concatenate(out) if out else np.empty(0, dtype=np.int64)
+
+    def within(self, lat, lon, radius_km):
+        """(índices, distâncias) dos pontos a até radius_km, do mais próximo ao mais distante."""
+        if not self.cells:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        cx, cy = (int(v) for v in self._cell(lat, lon))
+        # +1 célula cobre o erro da projeção; a distância final é de haversine
+        cand = self._candidates(cx, cy, 0, int(math.ceil(radius_km / self.cell)) + 1)
+        dist = haversine_km(lat, lon, self.lat[cand], self.lon[cand])
+        keep = dist <= radius_km
+        order = np.argsort(dist[keep], kind="stable")
+        return cand[keep][order], dist[keep][order]
+
+    def nearest(self, lat, lon, k):
+        """(índices, distâncias) dos k pontos mais próximos de (lat, lon)."""
+        if not self.cells or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        cx, cy = (int(v) for v in self._cell(lat, lon))
+        (x0, y0), (x1, y1) = self.bounds
+        max_ring = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+        # Ponto fora da grade: os anéis anteriores a este não têm células ocupadas
+        ring = max(0, max(x0 - cx, cx - x1, y0 - cy, cy - y1))
+        found = []
+        while True:
+            found.append(self._candidates(cx, cy, ring, ring))
+            n = sum(len(f) for f in found)
+            # Pontos ainda não visitados estão a pelo menos (ring - 1) células:
+            # para quando os k melhores já estão mais perto que isso
+            if n >= k or ring >= max_ring:
+                cand = np.concatenate(found)
+                dist = haversine_km(lat, lon, self.lat[cand], self.lon[cand])
+                order = np.argsort(dist, kind="stable")[:k]
+                if ring >= max_ring or dist[order[-1]] <= (ring - 1) * self.cell:
+                    return cand[order], dist[order]
+            ring += 1
+
+
+class StationRegistry:
+    """Estações indexadas por código (posição na lista), device_id e sessão."""
+
+    def __init__(self, stations, excluded_sessions=(), reference_session=None, center=None):
+        self.stations = [dict(s) for s in stations]
+        self.excluded_sessions = set(excluded_sessions)
+        self.reference_session = reference_session
+        self.center = center or {}
+
+        self.devices = [s["device_id"] for s in self.stations]
+        self.code = {d: i for i, d in enumerate(self.devices)}
+        self.by_session = {s["session"]: s for s in self.stations}
+        self.by_device = {s["device_id"]: s for s in self.stations}
+        self.session = np.array([s["session"] for s in self.stations], dtype=object)
+        self.lat = np.array([s.get("lat", np.nan) for s in self.stations], dtype=np.float64)
+        self.lon = np.array([s.get("lon", np.nan) for s in self.stations], dtype=np.float64)
+        self.excluded = np.array([s["session"] in self.excluded_sessions for s in self.stations], dtype=bool)
+        ref = self.by_session.get(reference_session)
+        self.reference_device = ref["device_id"] if ref else None
+        self.reference_code = self.code.get(self.reference_device, -1)
+        # Ordens de saída (por device_id e por session), como nos groupby do pandas
+        self.device_order = np.argsort(np.array(self.devices, dtype=object), kind="stable")
+        self.session_order = np.argsort(self.session, kind="stable")
+
+        # Só estações com coordenadas entram no índice
+        self._located = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        self.index = GridIndex(self.lat[self._located], self.lon[self._located])
+        self._neighbors = {}
+
+    def __len__(self):
+        return len(self.stations)
+
+    def active(self):
+        """Estações fora de EXCLUDED_SESSIONS, na ordem do cadastro."""
+        return [s for s, ex in zip(self.stations, self.excluded) if not ex]
+
+    def within(self, lat, lon, radius_km, include_excluded=False):
+        """[(estação, distância_km), ...] a até radius_km, da mais próxima à mais distante."""
+        idx, dist = self.index.within(lat, lon, radius_km)
+        return [(self.stations[c], d) for c, d in zip(self._located[idx], dist.tolist())
+                if include_excluded or not self.excluded[c]]
+
+    def nearest(self, lat, lon, k, include_excluded=False):
+        """[(estação, distância_km), ...] com as k estações mais próximas."""
+        extra = 0 if include_excluded else int(self.excluded.sum())
+        idx, dist = self.index.nearest(lat, lon, k + extra)
+        out = [(self.stations[c], d) for c, d in zip(self._located[idx], dist.tolist())
+               if include_excluded or not self.excluded[c]]
+        return out[:k]
+
+    def neighbors(self, k):
+        """(códigos, distâncias) (n x k) dos k vizinhos de cada estação, sem ela mesma.
+
+        Posições sem vizinho (rede pequena ou estação sem coordenadas) ficam
+        com código -1 e distância inf. O resultado é memorizado por k.
+        """
+        if k not in self._neighbors:
+            codes = np.full((len(self), k), -1, dtype=np.int64)
+            dists = np.full((len(self), k), np.inf)
+            for c in self._located:
+                idx, dist = self.index.nearest(self.lat[c], self.lon[c], k + 1)
+                nb = self._located[idx]
+                keep = nb != c
+                nb, dist = nb[keep][:k], dist[keep][:k]
+                codes[c, :len(nb)] = nb
+                dists[c, :len(nb)] = dist
+            self._neighbors[k] = codes, dists
+        return self._neighbors[k]
+
+    def to_dict(self):
+        return {
+            "center": self.center,
+            "reference_session": self.reference_session,
+            "excluded_sessions": sorted(self.excluded_sessions),
+            "stations": self.stations,
+        }
+
+
+def load_file(path=DATA_FILE):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _from_devices(payload):
+    """Normaliza a resposta de GET /devices em estações {session, device_id, lat, lon}."""
+    if isinstance(payload, dict):
+        payload = payload.get("data", payload.get("devices", payload.get("items", [])))
+    stations = []
+    for dev in payload:
+        if not dev.get("device_id") or not dev.get("session"):
+            continue
+        st = {"session": dev["session"], "device_id": dev["device_id"]}
+        if dev.get("lat") is not None and dev.get("lon") is not None:
+            st["lat"], st["lon"] = float(dev["lat"]), float(dev["lon"])
+        stations.append(st)
+    return stations
+
+
+def fetch_devices(api_base, headers, center=None, user_id=None):
+    """Lista as estações pelo GET /devices (filtrado pelo centro/raio da rede)."""
+    import client
+    import scheduler
+
+    params = {}
+    if center:
+        params.update({"lat": center["lat"], "lon": center["lon"], "radius_km": center["radius_km"]})
+    if user_id:
+        params["user_id"] = user_id
+    resp = client.get(api_base.rstrip("/") + "/devices", params=params, headers=headers, priority=scheduler.LIVE)
+    resp.raise_for_status()
+    return _from_devices(resp.json())
+
+
+def _save_cache(config):
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    tmp = CACHE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fetched_at": int(time.time()), "stations": config["stations"]}, f, ensure_ascii=False)
+    os.replace(tmp, CACHE_FILE)
+
+
+def _load_cache():
+    if not os.path.exists(CACHE_FILE):
+        return None
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load(api_base=None, headers=None, user_id=None, ttl=CACHE_TTL, refresh=False):
+    """Carrega o cadastro: cache do /devices se recente, senão a API (se houver
+    headers), senão o cache antigo e, por fim, api/stations.json.
+
+    Coordenadas ausentes na API são completadas com as do stations.json.
+    """
+    config = load_file()
+    cache = _load_cache()
+    fresh = cache and time.time() - cache.get("fetched_at", 0) < ttl
+    stations = None
+
+    if cache and fresh and not refresh:
+        stations = cache["stations"]
+    elif api_base and headers:
+        try:
+            stations = fetch_devices(api_base, headers, config.get("center"), user_id)
+        except Exception as ex:
+            print(f"AVISO: /devices indisponível ({ex}); usando cadastro local")
+        if stations:
+            known = {s["device_id"]: s for s in config["stations"]}
+            for st in stations:
+                if "lat" not in st and st["device_id"] in known:
+                    st["lat"], st["lon"] = known[st["device_id"]]["lat"], known[st["device_id"]]["lon"]
+            _save_cache({"stations": stations})
+    if not stations and cache:
+        stations = cache["stations"]
+    if stations:
+        config = dict(config, stations=stations)
+
+    return StationRegistry(config["stations"], config.get("excluded_sessions", ()),
+                           config.get("reference_session"), config.get("center"))
+
+
+_default = None
+# Próxima vez em que refresh() confere o cache/API (epoch); antes disso devolve _default
+_next_check = 0.0
+_refresh_lock = threading.Lock()
+
+
+def get():
+    """Cadastro padrão do processo (carregado sem rede na primeira chamada)."""
+    global _default
+    if _default is None:
+        _default = load()
+    return _default
+
+
+def refresh(api_base, headers, user_id=None, ttl=CACHE_TTL):
+    """Recarrega o cadastro padrão consultando /devices se o cache venceu.
+
+    Com o cache válido devolve o _default atual sem reler arquivos nem
+    reconstruir o índice e os vizinhos; o _default só é trocado quando o
+    cadastro lido de novo muda, então quem já tem a referência segue com um
+    cadastro consistente.
+    """
+    global _default, _next_check
+    with _refresh_lock:
+        now = time.time()
+        if _default is not None and now < _next_check:
+            return _default
+        registry = load(api_base, headers, user_id, ttl)
+        cache = _load_cache()
+        # /devices fora do ar deixa o cache vencido: nova tentativa em REFRESH_RETRY s
+        _next_check = max((cache or {}).get("fetched_at", 0) + ttl, now + REFRESH_RETRY)
+        if _default is None or registry.to_dict() != _default.to_dict():
+            _default = registry
+        return _default
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cadastro de estações e buscas espaciais")
+    parser.add_argument("--lat", type=float, help="Latitude do ponto")
+    parser.add_argument("--lon", type=float, help="Longitude do ponto")
+    parser.add_argument("--radius-km", type=float, help="Estações a até R km do ponto")
+    parser.add_argument("--k", type=int, default=5, help="Vizinhos mais próximos do ponto")
+    parser.add_argument("--refresh", action="store_true", help="Consultar /devices mesmo com cache válido")
+    args = parser.parse_args()
+
+    if args.refresh:
+        from auth import get_access_token, API_BASE
+        reg = load(API_BASE, {"Authorization": f"Bearer {get_access_token()}"}, refresh=True)
+    else:
+        reg = get()
+    print(f"{len(reg)} estações ({int(reg.excluded.sum())} excluídas), referência {reg.reference_session}")
+    if args.lat is None or args.lon is None:
+        return
+    lat, lon = args.lat, args.lon
+    t0 = time.perf_counter()
+    found = reg.within(lat, lon, args.radius_km) if args.radius_km else reg.nearest(lat, lon, args.k)
+    elapsed = (time.perf_counter() - t0) * 1000
+    for st, d in found:
+        print(f"  {st['session']:25s} {st['device_id']}  {d:6.2f} km")
+    print(f"{len(found)} estações em {elapsed:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
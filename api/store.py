@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""Armazenamento local colunar das leituras brutas das estações.
+
+Layout em disco: <STORE_DIR>/<estação>/<AAAA-MM-DD>/<campo>.bin (dia em UTC).
+Cada campo é uma coluna NumPy de largura fixa gravada só por append; a coluna
+``time`` é gravada por último e define quantas linhas da partição são válidas.
+Leituras fora de ordem (mais antigas que a última gravada) fazem a partição
+ser mesclada e regravada.
+A leitura usa np.memmap, então abrir um intervalo não copia os dados.
+
+Gravações numa partição (append e regravação) acontecem sob uma trava de
+arquivo (<dia>.lock), então o servidor e o backfill podem gravar juntos. A
+regravação monta a partição nova em <dia>.tmp e troca os diretórios via
+<dia>.old; uma troca interrompida é concluída ou desfeita no próximo append.
+open_partition() mapeia as colunas sob a mesma trava, compartilhada, e nunca
+vê a troca pela metade; os np.memmap já abertos continuam válidos depois
+que a regravação apaga o .old (o arquivo só some ao desmapear).
+"""
+
+import argparse, contextlib, os, shutil, time
+from datetime import datetime, timezone
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+STORE_DIR = os.environ.get(
+    "HEXA_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "store")
+)
+
+# Colunas de largura fixa (little-endian). Campos ausentes no registro viram NaN.
+COLUMNS = {
+    "time": "<i8",
+    "rain": "<f8",
+    "temperature": "<f4",
+    "humidity": "<f4",
+    "pressure": "<f4",
+    "wind_speed": "<f4",
+    "wind_direction": "<f4",
+}
+SENSOR_FIELDS = [c for c in COLUMNS if c != "time"]
+
+
+def record_ts(rec):
+    """Converte o campo time de um registro (ISO ou epoch) para epoch em segundos."""
+    value = rec.get("time")
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value / 1000) if value > 1e12 else int(value)
+    text = str(value).strip()
+    if text.replace(".", "", 1).isdigit():
+        return record_ts({"time": float(text)})
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def station_dir(device_id, root=STORE_DIR):
+    return os.path.join(root, device_id.replace(":", "-"))
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _day_start(day):
+    return int(datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def _rows(path):
+    """Número de linhas válidas de uma partição (tamanho da coluna time)."""
+    fname = os.path.join(path, "time.bin")
+    if not os.path.exists(fname):
+        return 0
+    return os.path.getsize(fname) // np.dtype(COLUMNS["time"]).itemsize
+
+
+def _last_time(path, n):
+    if n == 0:
+        return None
+    with open(os.path.join(path, "time.bin"), "rb") as f:
+        f.seek((n - 1) * 8)
+        return int(np.frombuffer(f.read(8), dtype=COLUMNS["time"])[0])
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _write_columns(path, cols, mode):
+    """Grava as colunas de uma partição; time por último."""
+    for field in SENSOR_FIELDS + ["time"]:
+        with open(os.path.join(path, f"{field}.bin"), mode) as f:
+            f.write(np.ascontiguousarray(cols[field], dtype=COLUMNS[field]).tobytes())
+
+
+def _rows_to_columns(rows):
+    cols = {"time": np.array([ts for ts, _ in rows], dtype=COLUMNS["time"])}
+    for field in SENSOR_FIELDS:
+        cols[field] = np.array([_to_float(rec.get(field)) for _, rec in rows], dtype=COLUMNS[field])
+    return cols
+
+
+def _rewrite_partition(path, n, rows):
+    """Mescla linhas fora de ordem com a partição existente e a regrava inteira.
+
+    Caso raro (amostras atrasadas, downloads concluídos fora de ordem); uma
+    partição tem no máximo um dia de leituras, então regravar é barato.
+    """
+    old = {f: np.array(v) for f, v in _read_partition(path, n).items()}
+    new = _rows_to_columns(rows)
+    merged = {f: np.concatenate([old[f], new[f]]) for f in COLUMNS}
+    # Ordenação estável: em timestamps repetidos prevalece a leitura já gravada
+    order = np.argsort(merged["time"], kind="stable")
+    ts = merged["time"][order]
+    keep = np.ones(len(ts), dtype=bool)
+    keep[1:] = ts[1:] != ts[:-1]
+    idx = order[keep]
+
+    tmp = path + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+    _write_columns(tmp, {f: v[idx] for f, v in merged.items()}, "wb")
+    # .tmp completo antes de a partição atual sair do lugar: ver _recover()
+    os.replace(path, path + ".old")
+    os.replace(tmp, path)
+    shutil.rmtree(path + ".old")
+    return int(len(idx) - n)
+
+
+def _recover(path):
+    """Conclui ou desfaz uma regravação interrompida de _rewrite_partition.
+
+    Sem a partição e com .old, a troca parou entre os dois os.replace: o
+    .tmp já está completo e assume o lugar. Em qualquer outro caso o .tmp é
+    uma gravação incompleta e o .old, uma sobra da limpeza; os dois saem.
+    """
+    tmp, old = path + ".tmp", path + ".old"
+    if not os.path.isdir(path) and os.path.isdir(old) and os.path.isdir(tmp):
+        os.replace(tmp, path)
+    for leftover in (tmp, old):
+        if os.path.isdir(leftover):
+            shutil.rmtree(leftover)
+
+
+@contextlib.contextmanager
+def _partition_lock(path, shared=False):
+    """Trava entre processos numa partição (flock em <dia>.lock): exclusiva para
+    gravar, compartilhada (shared=True) para abrir as colunas."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "a") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_partition(path, n, fields=None):
+    cols = {}
+    for field in ["time"] + [f for f in (fields or SENSOR_FIELDS) if f != "time"]:
+        fname = os.path.join(path, f"{field}.bin")
+        if os.path.exists(fname):
+            cols[field] = np.memmap(fname, dtype=COLUMNS[field], mode="r", shape=(n,))
+        else:
+            cols[field] = np.full(n, np.nan, dtype=COLUMNS[field])
+    return cols
+
+
+def _append_partition(path, rows):
+    """Acrescenta linhas (ts, rec) ordenadas a uma partição, ignorando as já gravadas."""
+    with _partition_lock(path):
+        _recover(path)
+        return _append_locked(path, rows)
+
+
+def _append_locked(path, rows):
+    os.makedirs(path, exist_ok=True)
+    n = _rows(path)
+    last = _last_time(path, n)
+    if last is not None and rows[0][0] <= last:
+        return _rewrite_partition(path, n, rows)
+
+    for field in SENSOR_FIELDS:
+        fname = os.path.join(path, f"{field}.bin")
+        size = n * np.dtype(COLUMNS[field]).itemsize
+        # Reparo: descarta linhas órfãs de um append interrompido antes da coluna time
+        if os.path.exists(fname) and os.path.getsize(fname) != size:
+            with open(fname, "r+b") as f:
+                f.truncate(size)
+        elif not os.path.exists(fname) and n:
+            with open(fname, "wb") as f:
+                f.write(np.full(n, np.nan, dtype=COLUMNS[field]).tobytes())
+    _write_columns(path, _rows_to_columns(rows), "ab")
+    return len(rows)
+
+
+def append_records(records, root=STORE_DIR):
+    """Grava registros brutos (dicts da API) nas partições estação/dia. Retorna linhas novas."""
+    parts = {}
+    for rec in records:
+        device_id = rec.get("device_id")
+        ts = record_ts(rec)
+        if not device_id or ts is None:
+            continue
+        parts.setdefault((device_id, _day(ts)), []).append((ts, rec))
+
+    written = 0
+    for (device_id, day), rows in parts.items():
+        rows.sort(key=lambda r: r[0])
+        # Dedup dentro do lote (mesmo device_id+time)
+        rows = [r for i, r in enumerate(rows) if i == 0 or r[0] != rows[i - 1][0]]
+        written += _append_partition(os.path.join(station_dir(device_id, root), day), rows)
+    return written
+
+
+def open_partition(device_id, day, fields=None, root=STORE_DIR):
+    """Abre uma partição como dict campo -> np.memmap somente leitura (None se vazia)."""
+    path = os.path.join(station_dir(device_id, root), day)
+    if not os.path.exists(path + ".lock") and _rows(path) == 0:
+        return None  # partição que nunca foi gravada: nada a travar
+    with _partition_lock(path, shared=True):
+        n = _rows(path)
+        if n == 0:
+            return None
+        return _read_partition(path, n, fields)
+
+
+def list_stations(root=STORE_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(d.replace("-", ":") for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+
+
+def iter_range(start_ts, end_ts, device_ids=None, fields=None, root=STORE_DIR):
+    """Itera (device_id, colunas) de cada partição no intervalo [start_ts, end_ts).
+
+    As colunas são fatias de np.memmap (views, sem cópia) recortadas por busca
+    binária na coluna time, que é crescente dentro da partição.
+    """
+    days = []
+    t = _day_start(_day(start_ts))
+    while t < end_ts:
+        days.append(_day(t))
+        t += 86400
+
+    for device_id in device_ids or list_stations(root):
+        for day in days:
+            cols = open_partition(device_id, day, fields, root)
+            if cols is None:
+                continue
+            ts = cols["time"]
+            lo, hi = np.searchsorted(ts, [start_ts, end_ts], side="left")
+            if hi > lo:
+                yield device_id, {k: v[lo:hi] for k, v in cols.items()}
+
+
+def read_range(start_ts, end_ts, device_ids=None, fields=None, root=STORE_DIR):
+    """Lê um intervalo concatenando as partições: dict com device_id e as colunas pedidas."""
+    ids, chunks = [], {}
+    for device_id, cols in iter_range(start_ts, end_ts, device_ids, fields, root):
+        ids.append(np.full(len(cols["time"]), device_id, dtype=object))
+        for k, v in cols.items():
+            chunks.setdefault(k, []).append(v)
+    out = {"device_id": np.concatenate(ids) if ids else np.array([], dtype=object)}
+    for field in ["time"] + [f for f in (fields or SENSOR_FIELDS) if f != "time"]:
+        parts = chunks.get(field)
+        out[field] = np.concatenate(parts) if parts else np.array([], dtype=COLUMNS[field])
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumo do armazenamento local de leituras")
+    parser.add_argument("--hours", type=int, default=24, help="Janela a resumir (horas)")
+    args = parser.parse_args()
+
+    end_ts = int(time.time())
+    data = read_range(end_ts - args.hours * 3600, end_ts, fields=["rain"])
+    print(f"Armazenamento: {os.path.abspath(STORE_DIR)}")
+    print(f"Estações: {len(list_stations())} | Leituras nas últimas {args.hours}h: {len(data['time'])}")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Compara o coletor de threads (requests) com o coletor asyncio (aiohttp) no mock local.
+
+Cada modo roda num subprocesso próprio para medir tempo, pico de RSS e pico de
+threads sem interferência do outro. Exemplo:
+    python bench/bench_collectors.py --stations 300 --days 1 --latency-ms 80
+"""
+
+import argparse, json, os, resource, subprocess, sys, threading, time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "api"))
+sys.path.insert(0, BASE_DIR)
+
+
+def _jobs(n_stations, days, end_ts):
+    from mock_api import make_stations
+    return [(s["session"], end_ts - (d + 1) * 86400, end_ts - d * 86400)
+            for s in make_stations(n_stations) for d in range(days)]
+
+
+def _watch_threads(peak):
+    while True:
+        peak[0] = max(peak[0], threading.active_count())
+        time.sleep(0.01)
+
+
+def run_mode(mode, url, n_stations, days, workers):
+    """Executa um modo neste processo e imprime as medições em JSON."""
+    import client
+    import scheduler
+
+    # O mock não tem cota; o agendador não deve limitar o benchmark nem gastar o contador da conta
+    scheduler._default.usage_file = None
+    scheduler.set_quota(10 ** 6, 10 ** 9)
+    jobs = _jobs(n_stations, days, int(time.time()))
+    peak = [threading.active_count()]
+    threading.Thread(target=_watch_threads, args=(peak,), daemon=True).start()
+
+    t0 = time.time()
+    records = 0
+    if mode == "threads":
+        import concurrent.futures
+        import query
+        query.API_URL = url
+        client.configure(pool_size=workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(query.fetch_range, s, e, {}, None, session) for session, s, e in jobs]
+            for f in concurrent.futures.as_completed(futures):
+                records += len(f.result()["data"])
+    else:
+        import asyncio
+        import async_client
+
+        async def run():
+            nonlocal records
+            async with async_client.AsyncCollector(concurrency=workers, url=url) as col:
+                for coro in asyncio.as_completed([col.fetch_range(s, e, {}, None, session) for session, s, e in jobs]):
+                    records += len((await coro)["data"])
+
+        asyncio.run(run())
+
+    wall = time.time() - t0
+    print(json.dumps({
+        "mode": mode,
+        "requests": len(jobs),
+        "records": records,
+        "wall_s": round(wall, 3),
+        "req_per_s": round(len(jobs) / wall, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_threads": peak[0],
+        "http": client.stats(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark threads x asyncio no mock da API")
+    parser.add_argument("--stations", type=int, default=31)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--workers", type=int, default=30, help="Concorrência (threads ou semáforo)")
+    parser.add_argument("--modes", default="threads,async")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_mode(args.run, args.url, args.stations, args.days, args.workers)
+        return
+
+    mock = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "mock_api.py"), "--port", str(args.port),
+                             "--stations", str(args.stations), "--latency-ms", str(args.latency_ms)],
+                            stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}/v1/query"
+    try:
+        time.sleep(1.0)
+        results = []
+        for mode in args.modes.split(","):
+            out = subprocess.run([sys.executable, __file__, "--run", mode, "--url", url,
+                                  "--stations", str(args.stations), "--days", str(args.days),
+                                  "--workers", str(args.workers)], capture_output=True, text=True)
+            if out.returncode != 0:
+                print(f"{mode}: falhou\n{out.stderr}")
+                continue
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            results.append(res)
+            print(f"{mode:8s} {res['requests']:5d} req  {res['records']:8d} registros  {res['wall_s']:7.2f}s  "
+                  f"{res['req_per_s']:7.1f} req/s  RSS {res['max_rss_mb']:6.1f} MB  threads {res['peak_threads']}")
+    finally:
+        mock.terminate()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Benchmark de tamanho e tempo de carga: JSON / NDJSON.gz x Parquet particionado.
+
+Gera registros como os do /query (os do bench/mock_api.py, mais os sensores
+de store.SENSOR_FIELDS) para N estações x D dias, grava nos formatos de
+saída do api/query.py (json com indent, ndjson.gz e o dataset Parquet de
+api/columnar.py) e mede o tamanho em disco e o tempo até o DataFrame
+(device_id, time, rain) que o mapa_chuva_24h usa:
+    json / ndjson.gz    load_records_frame(iter_records(...)), arquivo inteiro
+    parquet             load_parquet_frame(...), tudo
+    parquet 1d x 5 est. load_parquet_frame(...) com intervalo e sessões
+                        (poda de partições)
+Requer pyarrow:
+    python bench/bench_columnar.py --stations 31 --days 7
+"""
+
+import argparse, gzip, json, os, shutil, sys, tempfile, time
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "api"))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "analysis"))
+import mock_api
+import columnar
+import store
+import mapa_chuva_24h as m
+
+
+def make_records(n_stations, days, end_ts):
+    """Registros de um minuto para as n primeiras estações do cadastro (sem as excluídas)."""
+    api = mock_api.MockAPI(stations=n_stations, rain="showers", page_limit=10 ** 9)
+    start_ts = end_ts - days * 86400
+    records = api.query({"start_ts": start_ts, "end_ts": end_ts})["data"]
+    rnd = np.random.default_rng(0)
+    extra = {f: rnd.normal(20, 5, len(records)).round(1) for f in store.SENSOR_FIELDS if f != "rain"}
+    for i, rec in enumerate(records):
+        for f, values in extra.items():
+            rec[f] = float(values[i])
+    return records, start_ts
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def _timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def run(n_stations, days, workdir):
+    end_ts = int(time.time()) // 86400 * 86400
+    records, start_ts = make_records(n_stations, days, end_ts)
+    json_file = os.path.join(workdir, "dados.json")
+    ndjson_file = os.path.join(workdir, "dados.ndjson.gz")
+    parquet_dir = os.path.join(workdir, "dados.parquet")
+    with open(json_file, "w") as f:
+        json.dump(records, f, indent=2, ensure_ascii=False)
+    with gzip.open(ndjson_file, "wt", encoding="utf-8") as f:
+        for rec in records:
+            f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+    (_, files), t_write = _timed(columnar.write_records, records, parquet_dir)
+    sessions = sorted({r["session"] for r in records})[:5]
+    del records
+
+    rows = []
+    for name, path in (("json", json_file), ("ndjson.gz", ndjson_file)):
+        df, t = _timed(m.load_records_frame, m.iter_records(path))
+        rows.append((name, _size(path), t, len(df)))
+        del df
+    df, t = _timed(m.load_parquet_frame, parquet_dir)
+    rows.append(("parquet", _size(parquet_dir), t, len(df)))
+    del df
+    day_start = end_ts - 86400
+    df, t = _timed(m.load_parquet_frame, parquet_dir, day_start, end_ts, sessions)
+    rows.append((f"parquet 1d x {len(sessions)} est.", None, t, len(df)))
+    return rows, files, t_write
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamanho e tempo de carga: JSON x Parquet particionado")
+    parser.add_argument("--stations", type=int, default=31, help="Número de estações")
+    parser.add_argument("--days", type=int, default=7, help="Dias de leituras de 1 min")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hexa_columnar_")
+    try:
+        rows, files, t_write = run(args.stations, args.days, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    base = rows[0]
+    print(f"{args.stations} estações x {args.days} dias ({base[3]:,} leituras); "
+          f"parquet gravado em {t_write:.2f}s ({files} arquivos)")
+    print(f"{'formato':>22s} {'tamanho (MB)':>13s} {'carga (s)':>10s} {'vs json':>8s} {'leituras':>11s}")
+    for name, size, t, n in rows:
+        size_txt = f"{size / 2**20:13.1f}" if size is not None else f"{'-':>13s}"
+        print(f"{name:>22s} {size_txt} {t:10.3f} {base[2] / t:7.1f}x {n:11,d}")
+
+
+if __name__ == "__main__":
+    main()
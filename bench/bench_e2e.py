@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Benchmark ponta a ponta no mock da API: tempo de cada etapa do servidor.
+
+Para cada combinação de --stations x --days sobe o mock (bench/mock_api.py)
+e roda, num subprocesso próprio (registro de estações, RSS e estado do
+servidor isolados), as etapas:
+    auth        token pelo /oauth2/token (auth.TokenManager)
+    devices     cadastro pelo /devices (stations.refresh)
+    collect     server.collect_24h_data a frio (só com --days 1)
+    fetch       query.fetch_range por (estação, dia), em paralelo
+    frame       mapa_chuva_24h.load_records_frame
+    treat       mapa_chuva_24h.treat_outlier_readings
+    accumulate  mapa_chuva_24h.compute_accumulated_rain
+    render      mapa_chuva_24h.build_heatmap (HTML Folium)
+    serve       web.Asset + results.ResultCache.update e requisições em
+                memória a server.handle_request (/ e /api/stations)
+
+Combinações acima de --max-readings leituras ficam registradas como puladas.
+O resultado vai para data/bench/e2e_<commit>.json (ou --output), com o
+commit, a máquina e os parâmetros; --compare mostra a razão de cada etapa em
+relação a um resultado anterior:
+    python bench/bench_e2e.py --stations 31,300,3000 --days 1,7,90
+    python bench/bench_e2e.py --stations 31 --days 1 --compare data/bench/e2e_abc1234.json
+"""
+
+import argparse, contextlib, gc, io, json, os, platform, resource, shutil, subprocess, sys, tempfile, time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BASE_DIR, "..")
+RESULTS_DIR = os.path.join(ROOT_DIR, "data", "bench")
+STAGES = ["auth", "devices", "collect", "fetch", "frame", "treat", "accumulate", "render", "serve"]
+SERVE_REQUESTS = 2000
+
+
+@contextlib.contextmanager
+def _quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_case(base_url, n_stations, days, workers):
+    """Executa as etapas neste processo e imprime as medições em JSON (última linha)."""
+    sys.path.insert(0, os.path.join(ROOT_DIR, "api"))
+    sys.path.insert(0, os.path.join(ROOT_DIR, "analysis"))
+    sys.path.insert(0, ROOT_DIR)
+    import asyncio, concurrent.futures
+    import auth, client, query, scheduler, stations
+
+    timings, info = {}, {}
+    workdir = os.environ["HEXA_BENCH_DIR"]
+    api_base = base_url + "/v1/"
+
+    def timed(stage, fn, *args, **kwargs):
+        gc.collect()
+        t0 = time.perf_counter()
+        with _quiet():
+            out = fn(*args, **kwargs)
+        timings[stage] = round(time.perf_counter() - t0, 4)
+        return out
+
+    client.configure(pool_size=workers)
+    tokens = auth.TokenManager(os.path.join(workdir, "token_cache.json"), refresh_token="mock-refresh",
+                               token_url=base_url + "/oauth2/token")
+    token = timed("auth", tokens.get)
+    headers = {"Authorization": f"Bearer {token}"}
+    with _quiet():
+        scheduler.load_quota(api_base, headers)
+    registry = timed("devices", stations.refresh, api_base, headers, ttl=0)
+    info["stations"] = len(registry)
+
+    # O servidor (e o mapa_chuva_24h) leem o cadastro já carregado do mock
+    import server
+    import mapa_chuva_24h as m
+    import web
+    server._tokens = tokens
+    server.API_BASE, server.QUERY_URL = api_base, api_base + "query"
+    server.COLLECT_DEADLINE = 3600
+    query.API_URL = api_base + "query"
+
+    if days == 1:
+        collected = timed("collect", server.collect_24h_data, token)
+        info["collect_records"] = len(collected)
+        del collected
+        server._windows.clear()
+
+    end_ts = int(time.time())
+    jobs = [(s["session"], end_ts - (d + 1) * 86400, end_ts - d * 86400)
+            for s in registry.active() for d in range(days)]
+
+    def fetch():
+        records, failed = [], 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(query.fetch_range, s, e, headers, None, session) for session, s, e in jobs]
+            for f in concurrent.futures.as_completed(futures):
+                res = f.result()
+                failed += bool(res.get("failed"))
+                records.extend(res["data"])
+        return records, failed
+
+    records, failed = timed("fetch", fetch)
+    info.update(requests=len(jobs), failed=failed, records=len(records), http=client.stats())
+
+    df = timed("frame", m.load_records_frame, records)
+    treated, ref_count, _ = timed("treat", m.treat_outlier_readings, df)
+    acc = timed("accumulate", m.compute_accumulated_rain, treated, ref_count)
+    info["mapped_stations"] = len(acc)
+    html_file = os.path.join(workdir, "mapa.html")
+    timed("render", m.build_heatmap, acc, html_file)
+    info["html_bytes"] = os.path.getsize(html_file)
+    del df, treated
+
+    def serve():
+        with open(html_file, "rb") as f:
+            server._current_map = web.Asset(f.read(), "text/html; charset=utf-8")
+        server._current_version = end_ts
+        server._results.update(end_ts, acc, None, records, registry, markers=m.marker_props(acc))
+
+    timed("serve", serve)
+    latencies = {}
+    for path in ("/", "/api/stations"):
+        request = web.Request("GET", path, "HTTP/1.1", {"accept-encoding": "gzip"})
+
+        async def hammer():
+            t0 = time.perf_counter()
+            for _ in range(SERVE_REQUESTS):
+                await server.handle_request(request)
+            return time.perf_counter() - t0
+
+        latencies[path] = round(asyncio.run(hammer()) / SERVE_REQUESTS * 1e6, 2)
+    info["serve_us_per_request"] = latencies
+    info["max_rss_mb"] = _rss_mb()
+    print(json.dumps({"timings": timings, **info}))
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_file):
+    """Imprime a razão (atual / anterior) de cada etapa nas combinações em comum."""
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    old = {(r["stations"], r["days"]): r for r in baseline["results"] if "timings" in r}
+    print(f"\nComparação com {baseline_file} (commit {baseline['meta'].get('commit')}); >1 = mais lento agora")
+    for r in results:
+        prev = old.get((r["stations"], r["days"]))
+        if prev is None or "timings" not in r:
+            continue
+        ratios = [f"{s} {r['timings'][s] / prev['timings'][s]:.2f}x" for s in STAGES
+                  if r["timings"].get(s) and prev["timings"].get(s)]
+        print(f"  {r['stations']:5d} est. x {r['days']:3d} d: " + "  ".join(ratios))
+
+
+def main():
+    sys.path.insert(0, BASE_DIR)
+    import mock_api
+
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta (mock da API -> mapa -> HTTP)")
+    mock_api.add_arguments(parser)
+    parser.set_defaults(latency_ms=20.0, spike_rate=0.0005)
+    parser.add_argument("--stations", default="31,300,3000", help="Número de estações, separados por vírgula")
+    parser.add_argument("--days", default="1,7,90", help="Dias coletados, separados por vírgula")
+    parser.add_argument("--workers", type=int, default=30, help="Requisições em paralelo")
+    parser.add_argument("--max-readings", type=float, default=5e6,
+                        help="Pula combinações com mais leituras que isso (memória)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="Arquivo JSON de saída (default: data/bench/e2e_<commit>.json)")
+    parser.add_argument("--compare", help="Resultado anterior para comparar")
+    parser.add_argument("--run", nargs=2, type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_case(args.url, args.run[0], args.run[1], args.workers)
+        return
+
+    counts = [int(x) for x in args.stations.split(",")]
+    days_list = [int(x) for x in args.days.split(",")]
+    mock_args = ["--sample-s", str(args.sample_s), "--latency-ms", str(args.latency_ms), "--rain", args.rain,
+                 "--spike-rate", str(args.spike_rate), "--p429", str(args.p429),
+                 "--page-limit", str(args.page_limit)] + (["--max-rps", str(args.max_rps)] if args.max_rps else [])
+    url = f"http://127.0.0.1:{args.port}"
+    results = []
+    print(f"{'estações':>8s} {'dias':>5s} {'leituras':>10s} " + " ".join(f"{s:>10s}" for s in STAGES) + "   RSS (MB)")
+    for n in counts:
+        mock = subprocess.Popen([sys.executable, os.path.join(BASE_DIR, "mock_api.py"), "--port", str(args.port),
+                                 "--stations", str(n)] + mock_args, stdout=subprocess.DEVNULL)
+        try:
+            time.sleep(1.0)
+            for days in days_list:
+                expected = n * days * 86400 // args.sample_s
+                case = {"stations": n, "days": days, "expected_readings": expected}
+                if expected > args.max_readings:
+                    case["skipped"] = f"{expected} leituras > --max-readings {args.max_readings:g}"
+                    results.append(case)
+                    print(f"{n:8d} {days:5d} {expected:10d}  pulada (--max-readings)")
+                    continue
+                workdir = tempfile.mkdtemp(prefix="hexa_bench_")
+                env = dict(os.environ, HEXA_BENCH_DIR=workdir, HEXA_STORE="0", HEXA_STORE_DIR=workdir,
+                           HEXA_STATIONS_CACHE=os.path.join(workdir, "stations_cache.json"),
+                           HEXA_QUOTA_FILE=os.path.join(workdir, "quota_usage.json"))
+                try:
+                    out = subprocess.run([sys.executable, __file__, "--run", str(n), str(days), "--url", url,
+                                          "--workers", str(args.workers)], capture_output=True, text=True, env=env)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                if out.returncode != 0:
+                    case["error"] = out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "falhou"
+                    results.append(case)
+                    print(f"{n:8d} {days:5d} falhou\n{out.stderr}")
+                    continue
+                case.update(json.loads(out.stdout.strip().splitlines()[-1]))
+                results.append(case)
+                t = case["timings"]
+                print(f"{n:8d} {days:5d} {case['records']:10d} "
+                      + " ".join(f"{t[s]:10.3f}" if s in t else f"{'-':>10s}" for s in STAGES)
+                      + f"   {case['max_rss_mb']:8.1f}")
+        finally:
+            mock.terminate()
+            mock.wait()
+
+    commit = _git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("run", "url", "output", "compare")},
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"e2e_{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"\nResultados em {output}")
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
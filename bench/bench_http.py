@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Teste de carga do servidor HTTP do server.py: modo legacy (HTTPServer) x async (web.py).
+
+Cada modo sobe num subprocesso servindo output/ (sem o atualizador) e recebe
+--connections conexões simultâneas por --duration segundos, cada uma fazendo
+GETs em sequência (keep-alive quando o servidor permite). Com --slow-clients,
+algumas conexões enviam só parte do cabeçalho e ficam paradas, como um
+celular em rede ruim. Exemplo:
+    python bench/bench_http.py --connections 200 --duration 10 --slow-clients 1
+"""
+
+import argparse, asyncio, json, os, statistics, subprocess, sys, time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BASE_DIR, "..")
+
+
+async def _open(host, port):
+    return await asyncio.open_connection(host, port)
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    length = headers.get("content-length")
+    if length is not None:
+        body = await reader.readexactly(int(length))
+    else:
+        body = await reader.read()
+    close = headers.get("connection", "").lower() == "close" or lines[0].startswith("HTTP/1.0") \
+        and headers.get("connection", "").lower() != "keep-alive"
+    return status, len(body), close
+
+
+async def _worker(host, port, paths, deadline, latencies, errors, timeout, headers):
+    conn = None
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await asyncio.wait_for(_open(host, port), timeout)
+            reader, writer = conn
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n{headers}\r\n".encode())
+            await writer.drain()
+            status, _, close = await asyncio.wait_for(_read_response(reader), timeout)
+            if status >= 400:
+                errors["status"] += 1
+            latencies.append(time.perf_counter() - t0)
+            if close:
+                writer.close()
+                conn = None
+        except (asyncio.TimeoutError, ConnectionError, asyncio.IncompleteReadError, OSError):
+            errors["timeout"] += 1
+            if conn:
+                conn[1].close()
+            conn = None
+    if conn:
+        conn[1].close()
+
+
+async def _slow_client(host, port, deadline):
+    """Conexão que manda meia linha de requisição e para."""
+    try:
+        reader, writer = await _open(host, port)
+        writer.write(b"GET / HT")
+        await writer.drain()
+        await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+        writer.close()
+    except OSError:
+        pass
+
+
+async def load(host, port, paths, connections, duration, slow_clients=0, timeout=5.0, gzip=True):
+    latencies, errors = [], {"timeout": 0, "status": 0}
+    headers = "Accept-Encoding: gzip\r\n" if gzip else ""
+    deadline = time.perf_counter() + duration
+    slow = [asyncio.ensure_future(_slow_client(host, port, deadline)) for _ in range(slow_clients)]
+    await asyncio.sleep(0.2 if slow_clients else 0)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_worker(host, port, paths, deadline, latencies, errors, timeout, headers)
+                           for _ in range(connections)))
+    wall = time.perf_counter() - t0
+    await asyncio.gather(*slow)
+    lat = sorted(latencies)
+    q = (lambda p: lat[min(len(lat) - 1, int(p * len(lat)))] * 1000) if lat else (lambda p: float("nan"))
+    return {
+        "requests": len(lat),
+        "req_per_s": round(len(lat) / wall, 1),
+        "p50_ms": round(q(0.50), 2),
+        "p99_ms": round(q(0.99), 2),
+        "max_ms": round(lat[-1] * 1000, 2) if lat else None,
+        "mean_ms": round(statistics.mean(lat) * 1000, 2) if lat else None,
+        "timeouts": errors["timeout"],
+        "http_errors": errors["status"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga no servidor HTTP (legacy x async)")
+    parser.add_argument("--modes", default="legacy,async")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--slow-clients", type=int, default=0, help="Conexões que travam no meio do cabeçalho")
+    parser.add_argument("--paths", default="/,/chuva_24h_tratada.json", help="Caminhos requisitados em rodízio")
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args()
+
+    paths = args.paths.split(",")
+    results = []
+    for mode in args.modes.split(","):
+        proc = subprocess.Popen([sys.executable, "-c", f"import server; server.serve_http({args.port}, {mode!r})"],
+                                cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+        try:
+            time.sleep(1.5)
+            res = asyncio.run(load("127.0.0.1", args.port, paths, args.connections, args.duration,
+                                   args.slow_clients))
+        finally:
+            proc.terminate()
+            proc.wait()
+        res["mode"] = mode
+        results.append(res)
+        print(f"{mode:7s} {res['requests']:7d} req  {res['req_per_s']:8.1f} req/s  p50 {res['p50_ms']:7.2f} ms  "
+              f"p99 {res['p99_ms']:8.2f} ms  max {res['max_ms']} ms  timeouts {res['timeouts']}  "
+              f"erros HTTP {res['http_errors']}")
+    print(json.dumps(results))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Regressão e benchmark do tratamento de outliers + acumulado (analysis/mapa_chuva_24h.py).
+
+--check reconstrói leituras brutas coerentes com output/chuva_24h_tratada.json
+(mesmo acumulado e número de leituras por estação, mais sessões excluídas,
+devices desconhecidos e leituras outliers que devem ser zeradas) e confere que
+o pipeline devolve exatamente aquele arquivo. Também compara o resultado com a
+implementação pandas anterior em entradas sintéticas. Essas duas conferências
+e as medições usam qc_method="reference", o tratamento daquele arquivo e da
+implementação anterior.
+
+O tratamento padrão (qc.DEFAULT_METHOD, o QC espacial) é conferido nas redes
+sintéticas do bench/bench_qc.py, com a chamada sem qc_method, como a de um
+notebook: nenhuma leitura normal é zerada, os acumulados só diferem do campo
+limpo pelos picos não detectados e a estação entupida fica marcada como DRY.
+
+Sem --check, mede o tempo das duas implementações em 10^5..10^7 leituras
+(--sizes aceita até 10^8, se couber na memória):
+    python bench/bench_pipeline.py --check
+    python bench/bench_pipeline.py --sizes 1e5,1e6,1e7
+"""
+
+import argparse, contextlib, io, json, os, sys, time
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "api"))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "analysis"))
+sys.path.insert(0, BASE_DIR)
+import mapa_chuva_24h as m
+import bench_qc
+import qc
+import stations
+
+REGISTRY = stations.get()
+
+TREATED_FILE = os.path.join(BASE_DIR, "..", "output", "chuva_24h_tratada.json")
+COLUMNS = ["device_id", "rain_acc", "n_readings", "lat", "lon", "session", "suspect"]
+
+
+# Implementação anterior (groupby/merge/map), mantida só como referência
+def legacy_treat(df):
+    session_map_inv = {s["device_id"]: s["session"] for s in REGISTRY.stations}
+    df["session"] = df["device_id"].map(session_map_inv)
+    df = df[~df["session"].isin(REGISTRY.excluded_sessions)].copy()
+    ref = df[df["device_id"] == REGISTRY.reference_device]
+    ref_rain = ref["rain"]
+    ref_count = len(ref)
+    if len(ref_rain[ref_rain > 0]) > 0:
+        threshold = ref_rain.max() * 2
+    else:
+        all_nonzero = df["rain"][df["rain"] > 0]
+        threshold = all_nonzero.quantile(0.99) * 2 if len(all_nonzero) > 0 else 10
+    df.loc[df["rain"] > threshold, "rain"] = 0.0
+    return df, ref_count, threshold
+
+
+def legacy_accumulate(df, ref_count):
+    station_map = {s["device_id"]: s for s in REGISTRY.stations}
+    r = df.groupby("device_id")["rain"].sum().reset_index()
+    r.columns = ["device_id", "rain_acc"]
+    counts = df.groupby("device_id")["rain"].count().reset_index()
+    counts.columns = ["device_id", "n_readings"]
+    r = r.merge(counts, on="device_id")
+    r["lat"] = r["device_id"].map(lambda d: station_map.get(d, {}).get("lat"))
+    r["lon"] = r["device_id"].map(lambda d: station_map.get(d, {}).get("lon"))
+    r["session"] = r["device_id"].map(lambda d: station_map.get(d, {}).get("session", "desconhecida"))
+    r = r.dropna(subset=["lat", "lon"])
+    r = r[r["n_readings"] >= max(int(ref_count * 0.10), 1)].copy()
+    r = r[r["rain_acc"] >= 0].copy()
+    r["suspect"] = False
+    ref_row = r[r["session"] == REGISTRY.reference_session]
+    if not ref_row.empty and ref_row["rain_acc"].values[0] > 0:
+        ref_acc = ref_row["rain_acc"].values[0]
+        r.loc[(r["rain_acc"] > ref_acc * 4) & (r["session"] != REGISTRY.reference_session), "suspect"] = True
+    return r.reset_index(drop=True)
+
+
+def run_new(df, qc_method="reference"):
+    with contextlib.redirect_stdout(io.StringIO()):
+        treated, ref_count, _ = m.treat_outlier_readings(df, qc_method)
+        return m.compute_accumulated_rain(treated, ref_count, qc_method)
+
+
+def run_legacy(df):
+    treated, ref_count, _ = legacy_treat(df)
+    return legacy_accumulate(treated, ref_count)
+
+
+def rebuild_raw(expected, seed=0):
+    """Leituras brutas (múltiplos de 0.25 mm) que reproduzem o arquivo tratado."""
+    rnd = np.random.default_rng(seed)
+    rows = []
+    for st in expected:
+        n, acc = st["n_readings"], st["rain_acc"]
+        step = 0.25 if acc / 0.25 <= n else 0.5
+        k, rest = int(acc // step), round(acc - (acc // step) * step, 2)
+        rain = np.zeros(n)
+        rain[:k] = step
+        if rest:
+            rain[k] = rest
+        rows += [(st["device_id"], r) for r in rnd.permutation(rain)]
+    df = pd.DataFrame(rows, columns=["device_id", "rain"])
+
+    # A referência ganha uma leitura de 0.5 mm (threshold = 1.0 mm) sem mudar o acumulado
+    pair = df.index[(df["device_id"] == REGISTRY.reference_device) & (df["rain"] == 0.25)][:2]
+    df.loc[pair[0], "rain"], df.loc[pair[1], "rain"] = 0.5, 0.0
+
+    # Ruído que o pipeline deve descartar: leituras outliers (zeradas, mas contadas),
+    # sessões excluídas e um device fora da lista de estações
+    # (a referência fica sem outliers: o máximo dela define o threshold)
+    zeros = df.index[(df["rain"] == 0) & (df["device_id"] != REGISTRY.reference_device)]
+    df.loc[zeros[::500], "rain"] = 75.0
+    excluded = [s["device_id"] for s in REGISTRY.stations if s["session"] in REGISTRY.excluded_sessions]
+    noise = pd.DataFrame({"device_id": excluded * 50 + ["00:00:00:00:00:00"] * 50, "rain": 3.0})
+    df = pd.concat([df, noise], ignore_index=True)
+    df["time"] = pd.Timestamp("2024-01-01", tz="UTC")
+    return df
+
+
+def check():
+    with open(TREATED_FILE) as f:
+        expected = json.load(f)
+    got = run_new(rebuild_raw(expected))
+    exp = pd.DataFrame(expected)[COLUMNS]
+    assert list(got.columns) == COLUMNS, got.columns
+    pd.testing.assert_frame_equal(got.reset_index(drop=True), exp, check_dtype=False)
+    print(f"OK: {TREATED_FILE} reproduzido ({len(exp)} estações)")
+
+    for seed in range(5):
+        df = synthetic(200_000, seed)
+        a, b = run_new(df.copy()), run_legacy(df.copy())
+        pd.testing.assert_frame_equal(a.reset_index(drop=True), b, check_dtype=False)
+    print("OK: mesma saída que a implementação pandas anterior em 5 entradas sintéticas")
+    check_default()
+
+
+def check_default(n_stations=31, days=1, spike_rate=1e-3, min_recall=0.9):
+    """Tratamento padrão (sem qc_method) nas redes sintéticas com picos e uma estação entupida."""
+    for seed in range(3):
+        registry, codes, times, rain, spikes, wet_dead = bench_qc.synthetic(n_stations, days, spike_rate, seed)
+        df = pd.DataFrame({"device_id": np.asarray(registry.devices, dtype=object)[codes],
+                           "time": pd.to_datetime(times, unit="s", utc=True), "rain": rain})
+        with contextlib.redirect_stdout(io.StringIO()):
+            treated, ref_count, _ = m.treat_outlier_readings(df, registry=registry)
+            got = m.compute_accumulated_rain(treated, ref_count, registry=registry)
+        assert treated.attrs["qc"] == qc.DEFAULT_METHOD, treated.attrs["qc"]
+        flags = treated["qc"].to_numpy()
+        zeroed = (flags == qc.SPIKE) | (flags == qc.THRESHOLD)
+        assert not (zeroed & ~spikes).any(), f"seed {seed}: {int((zeroed & ~spikes).sum())} leituras normais zeradas"
+        assert zeroed[spikes].mean() >= min_recall, f"seed {seed}: {zeroed[spikes].mean():.1%} dos picos detectados"
+        assert (flags[wet_dead] == qc.DRY).all(), f"seed {seed}: estação entupida sem DRY"
+        # Acumulado = campo limpo + picos que passaram
+        expected = np.bincount(codes, weights=np.where(spikes & zeroed, 0.0, rain), minlength=len(registry))
+        acc = got.set_index("device_id")["rain_acc"].reindex(registry.devices).to_numpy()
+        np.testing.assert_allclose(acc, expected, atol=1e-9)
+    print(f"OK: tratamento padrão ({qc.DEFAULT_METHOD}) em 3 redes sintéticas de {n_stations} estações: "
+          f"nenhuma leitura normal zerada, >= {min_recall:.0%} dos picos e a estação entupida marcada")
+
+
+def synthetic(n, seed=0):
+    rnd = np.random.default_rng(seed)
+    devices = np.array(REGISTRY.devices + ["00:00:00:00:00:00"], dtype=object)
+    p = np.full(len(devices), 1.0)
+    p[REGISTRY.devices.index("23:3E:C5:BD:A5:FA")] = 0.01  # estação com poucas leituras
+    p /= p.sum()
+    rain = rnd.choice([0.0, 0.25, 0.5], size=n, p=[0.9, 0.08, 0.02])
+    rain[rnd.random(n) < 1e-4] = 80.0
+    return pd.DataFrame({"device_id": devices[rnd.choice(len(devices), size=n, p=p)], "rain": rain})
+
+
+def bench(sizes, legacy_max):
+    # "categ." = device_id já categórico, como sai de load_records_frame/load_store_frame
+    print(f"{'leituras':>12s} {'novo (s)':>10s} {'categ. (s)':>11s} {'anterior (s)':>13s} {'ganho':>7s}")
+    results = []
+    for n in sizes:
+        df = synthetic(n)
+        t0 = time.perf_counter()
+        run_new(df)
+        t_new = time.perf_counter() - t0
+        cat = df.assign(device_id=df["device_id"].astype("category"))
+        t0 = time.perf_counter()
+        run_new(cat)
+        t_cat = time.perf_counter() - t0
+        del cat
+        t_old = None
+        if n <= legacy_max:
+            t0 = time.perf_counter()
+            run_legacy(df.copy())
+            t_old = time.perf_counter() - t0
+        old = f"{t_old:13.3f}" if t_old is not None else f"{'-':>13s}"
+        gain = f"{t_old / t_new:6.1f}x" if t_old else f"{'-':>7s}"
+        print(f"{n:12,d} {t_new:10.3f} {t_cat:11.3f} {old} {gain}")
+        results.append({"n": n, "new_s": t_new, "categorical_s": t_cat, "legacy_s": t_old})
+        del df
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regressão/benchmark do pipeline de outliers e acumulado")
+    parser.add_argument("--check", action="store_true", help="Só conferir a regressão")
+    parser.add_argument("--sizes", default="1e5,1e6,1e7", help="Tamanhos (leituras), separados por vírgula")
+    parser.add_argument("--legacy-max", type=float, default=1e7, help="Maior tamanho medido na versão anterior")
+    args = parser.parse_args()
+
+    check()
+    if not args.check:
+        bench([int(float(x)) for x in args.sizes.split(",")], float(args.legacy_max))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Simulação da agenda adaptativa (api/polling.py) com a coleta incremental do server.py.
+
+Roda a agenda em tempo simulado para N estações secas que respondem vazio
+(intervalos dobrando até EMPTY_MAX) com a cota do dia folgada, curta ou
+esgotada, e conta quantas coletas caíram em lacuna (server._fetch_window
+pedindo as 24h completas) depois da primeira de cada estação. Também mostra
+quantas seriam lacuna com o limite fixo server.GAP_LIMIT:
+    python bench/bench_polling.py --stations 31 --hours 48
+
+--check confere que nenhuma coleta no horário planejado vira lacuna,
+inclusive com os intervalos esticados acima de GAP_LIMIT pela cota:
+    python bench/bench_polling.py --check
+"""
+
+import argparse, contextlib, io, os, sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "api"))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "analysis"))
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+import polling
+import scheduler
+with contextlib.redirect_stdout(io.StringIO()):
+    import server
+
+# (nome, cota diária, já usadas no dia)
+SCENARIOS = [("folgada", 100_000, 0), ("curta", 1000, 950), ("esgotada", 1000, 1000)]
+T0 = 1_700_000_000
+
+
+def simulate(n_stations, hours, per_day, used):
+    """Coletas, lacunas (24h refeitas), lacunas com o limite fixo e o maior intervalo efetivo."""
+    scheduler._default.usage_file = None
+    scheduler.set_quota(scheduler.DEFAULT_PER_MINUTE, per_day)
+    scheduler._default._read_usage()
+    scheduler._default.used_today = used
+    server._planner = polling.PollPlanner()
+    server._windows.clear()
+    sessions = [f"sim{i:03d}" for i in range(n_stations)]
+
+    now, end = float(T0), T0 + hours * 3600
+    out = {"polls": 0, "gaps": 0, "fixed_gaps": 0, "max_interval": 0.0}
+    while now < end:
+        due = server._planner.due(sessions, now)
+        for s in due:
+            state = server._windows.get(s)
+            _, full = server._fetch_window(s, int(now))
+            if state is not None:
+                out["gaps"] += full
+                out["fixed_gaps"] += int(now) - state["synced_until"] > server.GAP_LIMIT
+            server._merge_window(s, [], full, int(now))
+            server._planner.observe(s, [], now)
+        out["polls"] += len(due)
+        server._planner.plan(due, sessions, now)
+        out["max_interval"] = max([out["max_interval"]] + [server._planner.interval(s) for s in sessions])
+        now = max(server._planner.next_at(sessions), now + 1)
+    return out
+
+
+def check():
+    for name, per_day, used in SCENARIOS:
+        r = simulate(31, 48, per_day, used)
+        assert r["gaps"] == 0, (name, r)
+        if name == "esgotada":
+            assert r["max_interval"] > server.GAP_LIMIT, r
+    print(f"OK: nenhuma coleta no horário planejado refez as 24h ({', '.join(n for n, _, _ in SCENARIOS)}; "
+          f"intervalos esticados até {r['max_interval'] / 3600:.1f}h > GAP_LIMIT de {server.GAP_LIMIT / 3600:.2f}h)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agenda adaptativa x lacunas da coleta incremental")
+    parser.add_argument("--stations", type=int, default=31, help="Número de estações")
+    parser.add_argument("--hours", type=int, default=48, help="Horas simuladas")
+    parser.add_argument("--check", action="store_true", help="Confere que não há lacunas na agenda esticada")
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        return
+    print(f"{'cota':>9s} {'coletas':>8s} {'lacunas':>8s} {'limite fixo':>12s} {'maior interv. (h)':>18s}")
+    for name, per_day, used in SCENARIOS:
+        r = simulate(args.stations, args.hours, per_day, used)
+        print(f"{name:>9s} {r['polls']:8d} {r['gaps']:8d} {r['fixed_gaps']:12d} {r['max_interval'] / 3600:18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Benchmark e conferência do QC espacial (analysis/qc.py).
+
+Gera séries de um minuto para N estações (as do bench/mock_api.py) em D dias
+com células de chuva que se deslocam sobre a rede, e injeta:
+    - picos isolados de 80 mm (sensor bugado), que devem virar SPIKE;
+    - uma estação "entupida" que só reporta zero, cujas leituras em
+      intervalos molhados devem virar DRY.
+Mede o tempo de qc.flag_readings e informa a taxa de detecção dos picos e
+os falsos positivos (leituras normais marcadas como SPIKE):
+    python bench/bench_qc.py --stations 300 --days 30
+    python bench/bench_qc.py --stations 31,300 --days 1,30,90
+"""
+
+import argparse, os, sys, time
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "api"))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "analysis"))
+import mock_api
+import qc
+import stations
+
+SPIKE_MM = 80.0
+CELLS_PER_DAY = 6
+KM_PER_DEG = 111.0
+
+
+def rain_field(lat, lon, n_bins, seed):
+    """Chuva (mm por intervalo de qc.BIN_S) de cada estação: células gaussianas em movimento."""
+    rnd = np.random.default_rng(seed)
+    field = np.zeros((len(lat), n_bins))
+    n_cells = max(1, CELLS_PER_DAY * n_bins * qc.BIN_S // 86400)
+    for _ in range(n_cells):
+        start = int(rnd.integers(n_bins))
+        life = int(rnd.integers(6, 24))
+        y0, x0 = rnd.uniform(lat.min(), lat.max()), rnd.uniform(lon.min(), lon.max())
+        vy, vx = rnd.normal(0, 0.004, 2)              # graus por intervalo
+        sigma_km, peak = rnd.uniform(3, 8), rnd.uniform(1, 8)
+        for i, b in enumerate(range(start, min(start + life, n_bins))):
+            d2 = ((lat - (y0 + vy * i)) ** 2 + (lon - (x0 + vx * i)) ** 2) * KM_PER_DEG ** 2
+            field[:, b] += peak * np.exp(-d2 / (2 * sigma_km ** 2))
+    return field
+
+
+def synthetic(n_stations, days, spike_rate, seed=0):
+    """Leituras de um minuto (códigos, epoch, chuva) e as máscaras dos defeitos injetados."""
+    station_list = mock_api.make_stations(n_stations)
+    registry = stations.StationRegistry(station_list)
+    rnd = np.random.default_rng(seed)
+    per_bin = qc.BIN_S // 60
+    n_bins = days * 86400 // qc.BIN_S
+    field = rain_field(registry.lat, registry.lon, n_bins, seed)
+    # Cada minuto recebe a fração do intervalo com ruído multiplicativo
+    minutes = np.repeat(field, per_bin, axis=1) / per_bin
+    minutes *= rnd.gamma(4.0, 0.25, size=minutes.shape)
+    minutes[minutes < 0.01] = 0.0
+
+    dead = n_stations // 2
+    minutes[dead] = 0.0
+    spikes = rnd.random(minutes.shape) < spike_rate
+    spikes[dead] = False
+    minutes[spikes] = SPIKE_MM
+
+    t0 = 1_700_000_000 - 1_700_000_000 % 86400
+    codes = np.repeat(np.arange(n_stations, dtype=np.int64), minutes.shape[1])
+    times = np.tile(t0 + 60 * np.arange(minutes.shape[1], dtype=np.int64), n_stations)
+    wet = np.zeros(minutes.shape, dtype=bool)
+    wet[dead] = np.repeat(field[dead] >= 2 * qc.WET_MM, per_bin)
+    return registry, codes, times, minutes.ravel(), spikes.ravel(), wet.ravel()
+
+
+def run(n_stations, days, spike_rate):
+    registry, codes, times, rain, spikes, wet_dead = synthetic(n_stations, days, spike_rate)
+    neighbors = registry.neighbors(qc.K)
+    t0 = time.perf_counter()
+    flags = qc.flag_readings(codes, times, rain, neighbors, len(registry))
+    elapsed = time.perf_counter() - t0
+    flagged = flags == qc.SPIKE
+    return {
+        "readings": len(rain),
+        "seconds": elapsed,
+        "recall": flagged[spikes].mean() if spikes.any() else float("nan"),
+        "false_spikes": int((flagged & ~spikes).sum()),
+        "dry": (flags[wet_dead] == qc.DRY).mean() if wet_dead.any() else float("nan"),
+        "unchecked": (flags == qc.UNCHECKED).mean(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark/conferência do QC espacial por vizinhos")
+    parser.add_argument("--stations", default="300", help="Número de estações, separados por vírgula")
+    parser.add_argument("--days", default="30", help="Dias de leituras de 1 min, separados por vírgula")
+    parser.add_argument("--spike-rate", type=float, default=1e-4, help="Fração de leituras com pico injetado")
+    args = parser.parse_args()
+
+    print(f"{'estações':>8s} {'dias':>5s} {'leituras':>12s} {'tempo (s)':>10s} {'leit./s':>12s} "
+          f"{'picos det.':>10s} {'falsos':>7s} {'secas det.':>10s} {'sem viz.':>9s}")
+    for n in [int(x) for x in args.stations.split(",")]:
+        for days in [int(x) for x in args.days.split(",")]:
+            r = run(n, days, args.spike_rate)
+            print(f"{n:8d} {days:5d} {r['readings']:12,d} {r['seconds']:10.2f} {r['readings'] / r['seconds']:12,.0f} "
+                  f"{r['recall']:10.1%} {r['false_spikes']:7d} {r['dry']:10.1%} {r['unchecked']:9.1%}")
+
+
+if __name__ == "__main__":
+    main()
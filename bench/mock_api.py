@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""Mock local da API HexaCloud com dados sintéticos de estações.
+
+Endpoints:
+    POST /oauth2/token          tokens no formato do Cognito (authorization_code / refresh_token)
+    GET  /v1/query              leituras por sessão, device_id, raio ou da rede toda
+    GET  /v1/devices            cadastro de estações (filtro lat/lon/radius_km)
+    GET  /v1/users/<id>         cota da conta (quota_requests_minute/day)
+    GET  /_stats                contadores do mock (requisições, 429, 401, bytes)
+
+As primeiras estações são as do api/stations.json (mesmas sessões, device_id,
+referência e excluídas); as demais são sintéticas em torno de São Carlos. A
+chuva é determinística por estação e instante, em múltiplos de 0.25 mm
+(báscula), no padrão escolhido em --rain; --spike-rate injeta leituras
+absurdas para o tratamento de outliers. Latência, 429 aleatórios
+(--p429) ou por excesso de vazão (--max-rps) e o limite de registros por
+resposta (--page-limit) imitam a API Gateway.
+
+Uso:
+    python bench/mock_api.py --port 8765 --stations 300 --latency-ms 80 --rain front --p429 0.02
+"""
+
+import argparse, base64, json, math, os, random, threading, time, zlib
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+STATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api", "stations.json")
+RAIN_PATTERNS = ("showers", "front", "storm", "drizzle", "dry")
+TIP_MM = 0.25
+SPIKE_MM = 80.0
+
+
+def make_stations(n, base_file=STATIONS_FILE):
+    """As estações do stations.json e, depois delas, estações sintéticas em torno de São Carlos."""
+    base = []
+    if base_file and os.path.exists(base_file):
+        with open(base_file, encoding="utf-8") as f:
+            base = [dict(s) for s in json.load(f)["stations"]][:n]
+    rnd = random.Random(42)
+    stations = base
+    for i in range(n - len(base)):
+        mac = ":".join(f"{rnd.randrange(256):02X}" for _ in range(6))
+        stations.append({
+            "session": f"mock{i:04d}",
+            "device_id": mac,
+            "lat": -22.01 + rnd.uniform(-0.06, 0.06),
+            "lon": -47.89 + rnd.uniform(-0.08, 0.08),
+        })
+    return stations
+
+
+def _b64(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).rstrip(b"=").decode()
+
+
+class MockAPI:
+    def __init__(self, stations=31, sample_s=60, latency_ms=0.0, rain="showers", spike_rate=0.0,
+                 p429=0.0, max_rps=None, page_limit=10000, token_ttl=3600, require_auth=False,
+                 quota_minute=10 ** 6, quota_day=10 ** 9, user_id="mock-user"):
+        if rain not in RAIN_PATTERNS:
+            raise ValueError(f"padrão de chuva desconhecido: {rain}")
+        self.stations = make_stations(stations)
+        self.by_session = {s["session"]: s for s in self.stations}
+        self.by_device = {s["device_id"]: s for s in self.stations}
+        self.sample_s = sample_s
+        self.latency = latency_ms / 1000.0
+        self.pattern = rain
+        self.spike_rate = spike_rate
+        self.p429 = p429
+        self.max_rps = max_rps
+        self.page_limit = page_limit
+        self.token_ttl = token_ttl
+        self.require_auth = require_auth
+        self.quota = {"quota_requests_minute": quota_minute, "quota_requests_day": quota_day}
+        self.user_id = user_id
+        lons = [s["lon"] for s in self.stations] or [0.0]
+        self.lon_range = (min(lons) - 0.02, max(lons) + 0.02)
+
+        self._lock = threading.Lock()
+        self._rnd = random.Random(7)
+        self._bucket = (float(max_rps or 0), time.monotonic())
+        self.tokens = {}  # access_token -> expira em (epoch)
+        self.counters = {"requests": 0, "query": 0, "devices": 0, "token": 0, "users": 0,
+                         "records": 0, "bytes": 0, "status_429": 0, "status_401": 0}
+
+    # --- Chuva sintética ---------------------------------------------------
+
+    def _phase(self, station):
+        return (zlib.crc32(station["session"].encode()) % 1000) / 1000.0
+
+    def _tips(self, station, ts):
+        """Quantas basculadas (TIP_MM) a estação registra na amostra de ts."""
+        step = ts // self.sample_s
+        phase = self._phase(station)
+        if self.pattern == "showers":
+            # Pancadas de algumas horas, defasadas por estação
+            wave = math.sin(ts / 21600.0 + phase * 6.28)
+            return int(step % 7 == 0) if wave > 0.6 else 0
+        if self.pattern == "front":
+            # Faixa de chuva que atravessa a rede de oeste para leste a cada 12h
+            lo, hi = self.lon_range
+            pos = lo + (ts % 43200) / 43200.0 * (hi - lo) * 3 - (hi - lo)
+            dist = abs(station["lon"] - pos) / max(hi - lo, 1e-6)
+            if dist > 0.15:
+                return 0
+            return 1 + int((0.15 - dist) * 20) if step % 2 == 0 else 0
+        if self.pattern == "storm":
+            # Temporal convectivo de 2h por dia, forte no centro da célula
+            hour = (ts % 86400) / 3600.0
+            if not 17 <= hour < 19:
+                return 0
+            core = math.exp(-((station["lat"] + 22.01) ** 2 + (station["lon"] + 47.89) ** 2) / 0.002)
+            return int(1 + 6 * core * math.sin((hour - 17) * math.pi / 2) + phase)
+        if self.pattern == "drizzle":
+            return int((step + int(phase * 97)) % 15 == 0)
+        return 0
+
+    def rain(self, station, ts):
+        """Chuva determinística (mm) da estação na amostra de ts."""
+        if self.spike_rate and zlib.crc32(f"{station['session']}{ts}".encode()) % 1000000 < self.spike_rate * 1e6:
+            return SPIKE_MM
+        return TIP_MM * self._tips(station, ts)
+
+    # --- Endpoints ---------------------------------------------------------
+
+    def _select(self, params):
+        if "session" in params:
+            return [self.by_session[params["session"]]] if params["session"] in self.by_session else []
+        if "device_id" in params:
+            return [self.by_device[params["device_id"]]] if params["device_id"] in self.by_device else []
+        if {"lat", "lon", "radius_km"} <= set(params):
+            lat, lon, radius = float(params["lat"]), float(params["lon"]), float(params["radius_km"])
+            return [s for s in self.stations if _distance_km(lat, lon, s["lat"], s["lon"]) <= radius]
+        return self.stations
+
+    def query(self, params):
+        start = int(params.get("start_ts", 0))
+        end = int(params.get("end_ts", time.time()))
+        stations = self._select(params)
+
+        first = start + (-start % self.sample_s)
+        samples = range(first, end, self.sample_s)
+        count = len(samples) * len(stations)
+        data = []
+        for st in stations:
+            for ts in samples:
+                if len(data) >= self.page_limit:
+                    break
+                data.append({
+                    "device_id": st["device_id"],
+                    "session": st["session"],
+                    "time": datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "rain": self.rain(st, ts),
+                })
+        with self._lock:
+            self.counters["records"] += len(data)
+        # Como a API: count é o total no intervalo, data vem truncado em page_limit
+        return {"count": count, "data": data}
+
+    def devices(self, params):
+        return {"data": [dict(s) for s in self._select(params)]}
+
+    def token(self, form):
+        grant = form.get("grant_type")
+        if grant not in ("authorization_code", "refresh_token"):
+            return 400, {"error": "unsupported_grant_type"}
+        now = int(time.time())
+        access = ".".join([_b64({"alg": "none"}), _b64({"sub": self.user_id, "exp": now + self.token_ttl,
+                                                        "jti": self._rnd.getrandbits(64)}), "mock"])
+        with self._lock:
+            self.tokens[access] = now + self.token_ttl
+        tokens = {"access_token": access, "id_token": access, "token_type": "Bearer", "expires_in": self.token_ttl}
+        if grant == "authorization_code":
+            tokens["refresh_token"] = f"mock-refresh-{self._rnd.getrandbits(32):08x}"
+        return 200, tokens
+
+    def authorized(self, header):
+        if not self.require_auth:
+            return True
+        token = (header or "").replace("Bearer ", "")
+        with self._lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def throttled(self):
+        """429 aleatório (p429) ou por excesso de vazão (token bucket de max_rps)."""
+        with self._lock:
+            if self.p429 and self._rnd.random() < self.p429:
+                return True
+            if self.max_rps:
+                tokens, last = self._bucket
+                now = time.monotonic()
+                tokens = min(self.max_rps, tokens + (now - last) * self.max_rps)
+                if tokens < 1:
+                    self._bucket = (tokens, now)
+                    return True
+                self._bucket = (tokens - 1, now)
+        return False
+
+    def count(self, key, nbytes=0):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            self.counters["bytes"] += nbytes
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+def _distance_km(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def make_handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+            if urlparse(self.path).path.rstrip("/").endswith("/oauth2/token"):
+                api.count("token")
+                self.reply(*api.token(form))
+            else:
+                self.reply(404, {"message": "Not Found"})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            path = url.path.rstrip("/")
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if path == "/_stats":
+                return self.reply(200, api.stats(), count=False)
+            api.count("requests")
+            if api.latency:
+                time.sleep(api.latency)
+            if api.throttled():
+                api.count("status_429")
+                return self.reply(429, {"message": "Too Many Requests"}, {"Retry-After": "1"})
+            if not api.authorized(self.headers.get("Authorization")):
+                api.count("status_401")
+                return self.reply(401, {"message": "Unauthorized"})
+            if path.endswith("/query"):
+                api.count("query")
+                self.reply(200, api.query(params))
+            elif path.endswith("/devices"):
+                api.count("devices")
+                self.reply(200, api.devices(params))
+            elif "/users/" in path:
+                api.count("users")
+                self.reply(200, {"data": dict(api.quota, user_id=path.rsplit("/", 1)[-1])})
+            else:
+                self.reply(404, {"message": "Not Found"})
+
+        def reply(self, status, payload, headers=None, count=True):
+            body = json.dumps(payload, separators=(",", ":")).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+            if count:
+                with api._lock:
+                    api.counters["bytes"] += len(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=8765, **kwargs):
+    api = MockAPI(**kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(api))
+    server.daemon_threads = True
+    return server, api
+
+
+def add_arguments(parser):
+    """Opções do mock (também repassadas pelos benchmarks), exceto --stations."""
+    parser.add_argument("--sample-s", type=int, default=60, help="Intervalo entre amostras (s)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latência artificial por requisição")
+    parser.add_argument("--rain", choices=RAIN_PATTERNS, default="showers", help="Padrão de chuva sintética")
+    parser.add_argument("--spike-rate", type=float, default=0.0, help="Fração de leituras absurdas (80 mm)")
+    parser.add_argument("--p429", type=float, default=0.0, help="Probabilidade de responder 429")
+    parser.add_argument("--max-rps", type=float, help="Vazão máxima antes de responder 429")
+    parser.add_argument("--page-limit", type=int, default=10000, help="Registros por resposta (count traz o total)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock local da API HexaCloud")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stations", type=int, default=31)
+    add_arguments(parser)
+    parser.add_argument("--token-ttl", type=int, default=3600, help="Validade do access token (s)")
+    parser.add_argument("--require-auth", action="store_true", help="Responder 401 sem token emitido pelo mock")
+    parser.add_argument("--quota-minute", type=int, default=10 ** 6, help="quota_requests_minute do /users")
+    parser.add_argument("--quota-day", type=int, default=10 ** 9, help="quota_requests_day do /users")
+    args = parser.parse_args()
+
+    server, _ = serve(args.port, stations=args.stations, sample_s=args.sample_s, latency_ms=args.latency_ms,
+                      rain=args.rain, spike_rate=args.spike_rate, p429=args.p429, max_rps=args.max_rps,
+                      page_limit=args.page_limit, token_ttl=args.token_ttl, require_auth=args.require_auth,
+                      quota_minute=args.quota_minute, quota_day=args.quota_day)
+    print(f"Mock HexaCloud em http://127.0.0.1:{args.port}/v1/query ({args.stations} estacoes, chuva {args.rain})")
+    server.serve_forever()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Metricas do ciclo de atualizacao no formato texto do Prometheus (/metrics).
+
+Metrics guarda contadores, gauges e histogramas com rotulos; span() mede a
+duracao de uma etapa (coleta, DataFrame, outliers, acumulado, mapa,
+publicacao...) em hexa_stage_seconds. Os numeros que ja existem em outros
+modulos (cliente HTTP, cota, token, SSE, agenda) entram por coletores,
+funcoes chamadas a cada render() que devolvem amostras prontas; assim o
+/metrics le o estado atual sem duplicar contadores.
+
+CycleProfiler captura um unico ciclo sob demanda com cProfile (cpu) ou
+tracemalloc (memory): arm() marca o proximo ciclo e capture() envolve o
+ciclo; o relatorio fica em memoria e o .prof em data/profiles/.
+"""
+
+import contextlib
+import io
+import math
+import os
+import resource
+import threading
+import time
+
+# Limites dos histogramas (s)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+FETCH_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROFILE_TOP = 40
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _value(v):
+    if v is None:
+        return "NaN"
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        return repr(v)
+    return str(v)
+
+
+class Metrics:
+    """Registro de metricas thread-safe com saida no formato do Prometheus."""
+
+    def __init__(self, prefix="hexa_"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._meta = {}        # nome -> (tipo, ajuda, buckets)
+        self._values = {}      # nome -> {rotulos: valor}
+        self._hist = {}        # nome -> {rotulos: [contagens por bucket, soma, total]}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text, buckets=None):
+        self._meta[self.prefix + name] = (kind, help_text, buckets)
+
+    def _key(self, name, labels):
+        return self.prefix + name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        name, key = self._key(name, labels)
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        name, key = self._key(name, labels)
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+
+    def observe(self, name, value, **labels):
+        name, key = self._key(name, labels)
+        buckets = self._meta.get(name, (None, None, STAGE_BUCKETS))[2] or STAGE_BUCKETS
+        with self._lock:
+            item = self._hist.setdefault(name, {}).get(key)
+            if item is None:
+                item = self._hist[name][key] = [[0] * len(buckets), 0.0, 0]
+            for i, le in enumerate(buckets):
+                if value <= le:
+                    item[0][i] += 1
+            item[1] += value
+            item[2] += 1
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """Mede a etapa em hexa_stage_seconds{stage} (e a ultima em hexa_stage_last_seconds)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, time.perf_counter() - t0)
+
+    def record_stage(self, stage, seconds):
+        self.observe("stage_seconds", seconds, stage=stage)
+        self.set("stage_last_seconds", round(seconds, 6), stage=stage)
+
+    def collector(self, func):
+        """func() -> [(nome, tipo, ajuda, {rotulos}, valor), ...], chamada a cada render()."""
+        self._collectors.append(func)
+        return func
+
+    def render(self):
+        lines = []
+        with self._lock:
+            values = {n: dict(s) for n, s in self._values.items()}
+            hist = {n: {k: [list(v[0]), v[1], v[2]] for k, v in s.items()} for n, s in self._hist.items()}
+        extra = {}
+        for func in self._collectors:
+            try:
+                samples = func()
+            except Exception as ex:
+                print(f"[METRICS] coletor {getattr(func, '__name__', func)} falhou: {ex!r}")
+                continue
+            for name, kind, help_text, labels, value in samples:
+                name = self.prefix + name
+                self._meta.setdefault(name, (kind, help_text, None))
+                extra.setdefault(name, {})[tuple(sorted(labels.items()))] = value
+
+        for name in sorted(set(values) | set(hist) | set(extra)):
+            kind, help_text, buckets = self._meta.get(name, ("untyped", "", None))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in hist:
+                buckets = buckets or STAGE_BUCKETS
+                for key, (counts, total, count) in sorted(hist[name].items()):
+                    for le, c in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{_labels(key, ('le', _value(float(le))))} {c}")
+                    lines.append(f"{name}_bucket{_labels(key, ('le', '+Inf'))} {count}")
+                    lines.append(f"{name}_sum{_labels(key)} {_value(float(total))}")
+                    lines.append(f"{name}_count{_labels(key)} {count}")
+            for key, value in sorted({**values.get(name, {}), **extra.get(name, {})}.items()):
+                lines.append(f"{name}{_labels(key)} {_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def memory_samples():
+    """RSS atual e pico do processo (e o heap Python, se o tracemalloc estiver ligado)."""
+    samples = []
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        samples.append(("process_resident_memory_bytes", "gauge", "Memoria residente atual (RSS)", {}, rss))
+    except (OSError, ValueError, IndexError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KB no Linux
+    samples.append(("process_max_resident_memory_bytes", "gauge", "Pico de memoria residente", {}, peak))
+    import tracemalloc
+    if tracemalloc.is_tracing():
+        current, traced_peak = tracemalloc.get_traced_memory()
+        samples.append(("python_traced_memory_bytes", "gauge", "Memoria alocada pelo Python (tracemalloc)",
+                        {}, current))
+        samples.append(("python_traced_memory_peak_bytes", "gauge", "Pico do tracemalloc", {}, traced_peak))
+    return samples
+
+
+class CycleProfiler:
+    """Perfil de um unico ciclo sob demanda: "cpu" (cProfile) ou "memory" (tracemalloc)."""
+
+    MODES = ("cpu", "memory")
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.armed = None
+        self.running = False
+        self.last = None
+        self._lock = threading.Lock()
+
+    def arm(self, mode):
+        if mode not in self.MODES:
+            raise ValueError(mode)
+        with self._lock:
+            self.armed = mode
+
+    @contextlib.contextmanager
+    def capture(self, label):
+        with self._lock:
+            mode, self.armed = self.armed, None
+            if mode is not None and self.running:
+                self.armed, mode = mode, None  # outro ciclo ja esta sendo perfilado
+            self.running = self.running or mode is not None
+        if mode is None:
+            yield
+            return
+        t0 = time.time()
+        try:
+            if mode == "cpu":
+                with self._cpu(label, t0):
+                    yield
+            else:
+                with self._memory(label, t0):
+                    yield
+        finally:
+            with self._lock:
+                self.running = False
+
+    @contextlib.contextmanager
+    def _cpu(self, label, t0):
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            yield
+        finally:
+            prof.disable()
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, f"cycle_{int(t0)}.prof")
+            prof.dump_stats(path)
+            out = io.StringIO()
+            pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            self._done("cpu", label, t0, path, out.getvalue())
+
+    @contextlib.contextmanager
+    def _memory(self, label, t0):
+        import tracemalloc
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(25)
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            out = io.StringIO()
+            out.write(f"atual {current / 2**20:.1f} MB, pico {peak / 2**20:.1f} MB durante o ciclo\n\n")
+            for stat in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                out.write(f"{stat}\n")
+            self._done("memory", label, t0, None, out.getvalue())
+
+    def _done(self, mode, label, t0, path, report):
+        self.last = {"mode": mode, "cycle": label, "at": int(t0), "duration_s": round(time.time() - t0, 3),
+                     "file": path, "report": report}
+        print(f"[PROFILE] ciclo {label} perfilado ({mode}, {self.last['duration_s']}s)"
+              + (f": {path}" if path else ""))
+
+    def status(self):
+        return {"armed": self.armed, "running": self.running,
+                "last": {k: v for k, v in self.last.items() if k != "report"} if self.last else None}
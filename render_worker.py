@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Geracao do mapa num processo separado do servidor HTTP.
+
+O ciclo pesado (DataFrame, QC, acumulados, Folium, grade e tiles) roda num
+processo filho (multiprocessing "spawn"): o GIL do servidor fica livre para
+servir as paginas e a memoria que o pandas/Folium nao devolvem ao sistema
+fica no filho, que e descartado de tempos em tempos. O pai manda um pacote
+compacto (device_id categorico, epoch e chuva em arrays NumPy) e recebe so
+o que precisa para publicar: a tabela por estacao, as janelas, os
+marcadores e as metricas do ciclo; o HTML (e a grade/tiles) o filho grava
+direto em disco.
+
+O filho e reciclado depois de max_cycles ciclos, quando o RSS dele passa de
+max_rss_mb ou quando o cadastro de estacoes muda. Um ciclo que passa de
+timeout segundos ou derruba o filho vira RenderError no pai: o filho e
+encerrado e o proximo ciclo sobe outro, sem afetar o servidor.
+"""
+
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from store import record_ts
+
+TIMEOUT = 300
+MAX_CYCLES = 50
+MAX_RSS_MB = 800
+STOP_GRACE = 5
+
+
+class RenderError(Exception):
+    """Ciclo de mapa que falhou, estourou o prazo ou derrubou o processo filho."""
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def pack_records(records):
+    """Registros (dicts) -> colunas compactas para o filho: device_id categorico, epoch e chuva."""
+    n = len(records)
+    index, devices = {}, []
+    codes = np.empty(n, dtype=np.int32)
+    times = np.empty(n, dtype=np.float64)
+    rain = np.empty(n, dtype=np.float64)
+    for i, rec in enumerate(records):
+        device = rec.get("device_id")
+        code = index.get(device)
+        if code is None and device is not None:
+            code = index[device] = len(devices)
+            devices.append(device)
+        codes[i] = -1 if code is None else code
+        ts = record_ts(rec)
+        times[i] = math.nan if ts is None else ts
+        rain[i] = _number(rec.get("rain"))
+    return {"devices": devices, "codes": codes, "time": times, "rain": rain}
+
+
+def render(pack, output_file, options):
+    """Gera o mapa de um pacote de pack_records() neste processo.
+
+    options vai para mapa_chuva_24h.generate_map. Retorna {"df", "tables",
+    "markers", "cycle"}: tabela da janela principal, {janela: tabela},
+    props dos marcadores e o metrics_out do ciclo.
+    """
+    import pandas as pd
+    from mapa_chuva_24h import generate_map, marker_props
+
+    frame = pd.DataFrame({
+        "device_id": pd.Categorical.from_codes(pack["codes"], categories=pd.Index(pack["devices"], dtype=object)),
+        "time": pd.to_datetime(pack["time"], unit="s", utc=True),
+        "rain": pack["rain"],
+    })
+    tables, cycle = {}, {}
+    df = generate_map(frame, output_file, windows_out=tables, metrics_out=cycle, **options)
+    return {"df": df, "tables": tables, "markers": marker_props(df), "cycle": cycle}
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _serve(conn, registry, paths):
+    """Laco do processo filho: recebe (pacote, arquivo, opcoes), responde com render() ou o erro."""
+    sys.path[:0] = [p for p in paths if p not in sys.path]
+    sys.stdout.reconfigure(line_buffering=True)
+    import stations
+    # Mesmo cadastro do servidor (sem reler cache nem consultar /devices)
+    stations._default = stations.StationRegistry(registry["stations"], registry["excluded_sessions"],
+                                                 registry["reference_session"], registry["center"])
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            reply = render(*job)
+        except Exception as ex:
+            traceback.print_exc()
+            reply = {"error": f"{type(ex).__name__}: {ex}"}
+        reply["rss_mb"] = round(_rss_mb(), 1)
+        conn.send(reply)
+
+
+class RenderWorker:
+    """Processo filho que gera o mapa, um ciclo por vez, reciclado por ciclos/memoria."""
+
+    def __init__(self, paths=(), timeout=TIMEOUT, max_cycles=MAX_CYCLES, max_rss_mb=MAX_RSS_MB):
+        self.paths = list(paths)
+        self.timeout = timeout
+        self.max_cycles = max_cycles
+        self.max_rss_mb = max_rss_mb
+        self._ctx = multiprocessing.get_context("spawn")
+        self._proc = None
+        self._conn = None
+        self._registry = None
+        self._cycles = 0
+        self._lock = threading.Lock()
+        self._stats = {"started": 0, "recycled": 0, "cycles": 0, "errors": 0, "timeouts": 0, "crashes": 0,
+                       "rss_mb": None, "last_s": None}
+
+    def _start(self, registry):
+        conn, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_serve, args=(child, registry, self.paths), name="hexa-render", daemon=True)
+        proc.start()
+        child.close()
+        self._proc, self._conn, self._registry, self._cycles = proc, conn, registry, 0
+        self._stats["started"] += 1
+        print(f"[RENDER] processo de geracao do mapa iniciado (pid {proc.pid})")
+
+    def _stop(self, kill=False):
+        proc, conn = self._proc, self._conn
+        self._proc = self._conn = None
+        self._cycles = 0
+        if proc is None:
+            return
+        if not kill:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            proc.join(STOP_GRACE)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+        conn.close()
+
+    def _recycle(self, reason):
+        print(f"[RENDER] reciclando o processo de geracao ({reason})")
+        self._stats["recycled"] += 1
+        self._stop()
+
+    def render(self, pack, output_file, options, registry):
+        """Gera o mapa no filho (ver render()). registry: cadastro atual do servidor."""
+        registry = registry.to_dict()
+        with self._lock:
+            if self._proc is not None and not self._proc.is_alive():
+                self._stop(kill=True)
+            if self._proc is not None and registry != self._registry:
+                self._recycle("cadastro de estacoes mudou")
+            if self._proc is None:
+                self._start(registry)
+            t0 = time.time()
+            try:
+                self._conn.send((pack, output_file, options))
+                if not self._conn.poll(self.timeout):
+                    self._stats["timeouts"] += 1
+                    self._stop(kill=True)
+                    raise RenderError(f"ciclo passou de {self.timeout:g}s; processo de geracao encerrado")
+                reply = self._conn.recv()
+            except (EOFError, OSError):
+                proc = self._proc
+                self._stats["crashes"] += 1
+                self._stop(kill=True)
+                raise RenderError(f"processo de geracao terminou no meio do ciclo (exitcode {proc.exitcode})")
+            self._cycles += 1
+            self._stats.update(cycles=self._stats["cycles"] + 1, rss_mb=reply["rss_mb"],
+                               last_s=round(time.time() - t0, 3))
+            if reply["rss_mb"] > self.max_rss_mb:
+                self._recycle(f"RSS {reply['rss_mb']:.0f} MB > {self.max_rss_mb} MB")
+            elif self._cycles >= self.max_cycles:
+                self._recycle(f"{self._cycles} ciclos")
+        if "error" in reply:
+            self._stats["errors"] += 1
+            raise RenderError(reply["error"])
+        return reply
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+    def stats(self):
+        proc = self._proc
+        return dict(self._stats, pid=proc.pid if proc is not None else None, worker_cycles=self._cycles)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Cache em memoria dos resultados de cada ciclo para a API JSON do server.py.
+
+A cada atualizacao, ResultCache.update() recebe o DataFrame tratado, as
+tabelas de acumulado por janela e os registros brutos da janela de 24h, e
+monta de uma vez os JSON de /api/stations e /api/accumulated (ja
+serializados, com gzip/brotli e ETag, como web.Asset). As series por estacao
+ficam em arrays NumPy ordenados por tempo; a serie completa e pre-serializada
+e recortes ?from=&to= sao serializados na primeira vez e guardados num LRU.
+Trocar de ciclo e so trocar a referencia do snapshot, entao uma requisicao
+nunca ve metade de um ciclo e a outra metade de outro.
+
+live_message() monta a mensagem SSE de uma nova versao: so os marcadores
+que mudaram em relacao ao snapshot anterior (ou todos, para quem reconecta
+atrasado).
+"""
+
+import collections
+import json
+import math
+import threading
+
+import numpy as np
+
+import web
+from store import record_ts, SENSOR_FIELDS
+
+JSON_TYPE = "application/json"
+# Recortes de serie guardados entre requisicoes (por snapshot)
+SERIES_CACHE_SIZE = 512
+
+
+def _dumps(payload):
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _clean(values, ndigits=None):
+    """Lista JSON de um array: NaN vira null, floats arredondados."""
+    out = values.tolist()
+    if values.dtype.kind == "f":
+        out = [None if math.isnan(v) else (round(v, ndigits) if ndigits is not None else v) for v in out]
+    return out
+
+
+def _records(df):
+    """Linhas do DataFrame como dicts com tipos nativos (NaN -> None)."""
+    return json.loads(df.to_json(orient="records", force_ascii=False)) if df is not None else []
+
+
+def _json_error(status, message):
+    return web.Response(status, _dumps({"error": message}), {"Cache-Control": "no-store"}, JSON_TYPE)
+
+
+class Snapshot:
+    """Resultados de um ciclo, imutaveis depois de montados."""
+
+    def __init__(self, version, assets, windows, series, markers=None):
+        self.version = version
+        self.markers = markers or {}  # session -> props do marcador (mapa_chuva_24h.marker_props)
+        self.assets = assets      # caminho -> Asset
+        self.windows = windows    # nome da janela -> Asset
+        self.series = series      # session -> {"device_id", "time", campos...}
+        self.series_cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+
+def _build_series(records, registry):
+    """Agrupa os registros brutos por estacao em arrays ordenados por tempo."""
+    by_device = collections.defaultdict(list)
+    for rec in records:
+        ts = record_ts(rec)
+        if ts is not None and rec.get("device_id") in registry.by_device:
+            by_device[rec["device_id"]].append((ts, rec))
+
+    series = {}
+    for device_id, rows in by_device.items():
+        rows.sort(key=lambda r: r[0])
+        item = {"device_id": device_id, "time": np.array([r[0] for r in rows], dtype=np.int64)}
+        for field in SENSOR_FIELDS:
+            values = [r[1].get(field) for r in rows]
+            if all(v is None for v in values):
+                continue
+            item[field] = np.array([np.nan if v is None else v for v in values], dtype=float)
+        series[registry.session[registry.code[device_id]]] = item
+    return series
+
+
+class ResultCache:
+    """Snapshot atual da API; update() troca o snapshot inteiro por referencia."""
+
+    def __init__(self):
+        self.snapshot = None
+
+    def update(self, version, df, windows, records, registry, primary="24h", markers=None, freshness=None):
+        """Monta o snapshot do ciclo `version` (timestamp da versao do mapa).
+
+        df: DataFrame tratado da janela principal; windows: {janela: DataFrame}
+        (ou None, so a principal); records: registros brutos da janela;
+        markers: props dos marcadores do mapa, para as mensagens SSE;
+        freshness: {session: {"age_s", "stale"}} do ultimo dado bom de cada estacao.
+        """
+        windows = dict(windows or {})
+        windows.setdefault(primary, df)
+        freshness = freshness or {}
+        series = _build_series(records, registry)
+
+        acc = {row["session"]: row for row in _records(df)}
+        station_list = []
+        for s in registry.stations:
+            code = registry.code[s["device_id"]]
+            row = acc.get(s["session"], {})
+            item = series.get(s["session"])
+            station_list.append({
+                "session": s["session"],
+                "device_id": s["device_id"],
+                "lat": s["lat"],
+                "lon": s["lon"],
+                "excluded": bool(registry.excluded[code]),
+                "reference": s["device_id"] == registry.reference_device,
+                f"rain_{primary}": row.get("rain_acc"),
+                "n_readings": row.get("n_readings", 0),
+                "suspect": row.get("suspect"),
+                "last_time": int(item["time"][-1]) if item is not None else None,
+                "age_s": freshness.get(s["session"], {}).get("age_s"),
+                "stale": freshness.get(s["session"], {}).get("stale", False),
+            })
+
+        def asset(payload):
+            return web.Asset(_dumps(payload), JSON_TYPE, version, "no-cache")
+
+        assets = {"/api/stations": asset({"version": version, "window": primary, "stations": station_list})}
+        window_assets = {
+            name: asset({"version": version, "window": name, "stations": _records(table)})
+            for name, table in windows.items()
+        }
+        assets["/api/accumulated"] = window_assets[primary]
+        self.snapshot = Snapshot(version, assets, window_assets, series, markers)
+        return self.snapshot
+
+    def _series_asset(self, snap, session, query):
+        item = snap.series.get(session)
+        if item is None:
+            return None
+        ts = item["time"]
+        lo, hi = 0, len(ts)
+        if query.get("from"):
+            lo = int(np.searchsorted(ts, _parse_ts(query["from"]), side="left"))
+        if query.get("to"):
+            hi = int(np.searchsorted(ts, _parse_ts(query["to"]), side="right"))
+        key = (session, lo, max(lo, hi))
+        with snap.lock:
+            cached = snap.series_cache.get(key)
+            if cached is not None:
+                snap.series_cache.move_to_end(key)
+                return cached
+        lo, hi = key[1], key[2]
+        payload = {
+            "version": snap.version,
+            "session": session,
+            "device_id": item["device_id"],
+            "count": hi - lo,
+            "time": _clean(ts[lo:hi]),
+        }
+        for field in SENSOR_FIELDS:
+            if field in item:
+                payload[field] = _clean(item[field][lo:hi], 3)
+        asset = web.Asset(_dumps(payload), JSON_TYPE, snap.version, "no-cache")
+        with snap.lock:
+            snap.series_cache[key] = asset
+            while len(snap.series_cache) > SERIES_CACHE_SIZE:
+                snap.series_cache.popitem(last=False)
+        return asset
+
+    def response(self, request):
+        """Response para um caminho /api/...; tudo em memoria, sem E/S."""
+        snap = self.snapshot
+        if snap is None:
+            return _json_error(503, "sem dados: aguardando o primeiro ciclo de atualizacao")
+        path = request.path.rstrip("/")
+        extra = {"X-Map-Version": str(snap.version)}
+
+        if path == "/api/accumulated" and "window" in request.query:
+            asset = snap.windows.get(request.query["window"])
+            if asset is None:
+                return _json_error(404, f"janela desconhecida; disponiveis: {', '.join(snap.windows)}")
+            return web.asset_response(request, asset, extra)
+
+        asset = snap.assets.get(path)
+        if asset is not None:
+            return web.asset_response(request, asset, extra)
+
+        parts = path.split("/")
+        if len(parts) == 5 and parts[2] == "station" and parts[4] == "series":
+            try:
+                asset = self._series_asset(snap, parts[3], request.query)
+            except ValueError:
+                return _json_error(400, "from/to invalidos: use epoch (s) ou ISO 8601")
+            if asset is None:
+                return _json_error(404, f"estacao sem leituras: {parts[3]}")
+            return web.asset_response(request, asset, extra)
+        return _json_error(404, "endpoint desconhecido")
+
+
+def live_message(snap, prev=None):
+    """JSON do evento SSE da versao de snap: marcadores alterados desde prev.
+
+    Sem prev (cliente que reconectou atrasado), manda todos com full=true e a
+    pagina remove os marcadores que nao vieram.
+    """
+    payload = {"version": snap.version, "url": f"/v/{snap.version}"}
+    if prev is None:
+        payload["full"] = True
+        payload["stations"] = snap.markers
+    else:
+        payload["stations"] = {s: p for s, p in snap.markers.items() if prev.markers.get(s) != p}
+        payload["removed"] = sorted(set(prev.markers) - set(snap.markers))
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+
+
+def _parse_ts(value):
+    ts = record_ts({"time": value})
+    if ts is None:
+        raise ValueError(value)
+    return ts
@@ -9,7 +9,6 @@ import sys
 import json
 import time
 import threading
-import requests
 import concurrent.futures
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from datetime import datetime, timezone, timedelta
@@ -18,162 +17,428 @@ from datetime import datetime, timezone, timedelta
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.join(BASE_DIR, "output")
 MAP_FILE = os.path.join(OUTPUT_DIR, "mapa_chuva_24h.html")
+# Versoes publicadas do mapa (output/versions/<timestamp>.html), servidas em /v/<timestamp>
+VERSIONS_DIR = os.path.join(OUTPUT_DIR, "versions")
+GRID_FILE = os.path.join(OUTPUT_DIR, "mapa_chuva_24h_grade.png")
 
 # Adicionar paths para imports
 sys.path.insert(0, os.path.join(BASE_DIR, "api"))
 sys.path.insert(0, os.path.join(BASE_DIR, "analysis"))
 
+import auth
+import client
+import polling
+import qc
+import scheduler
+import stations
+import store
+import metrics
+import render_worker
+import results
+import web
+from acumulados import parse_windows
+from store import record_ts
+
 # Configuracao
 PORT = int(os.environ.get("PORT", 8080))
+# Servidor HTTP: "async" (web.py, concorrente, arquivos em memoria) ou "legacy" (HTTPServer)
+HTTP_MODE = os.environ.get("HEXA_HTTP", "async")
+HTTP_WORKERS = int(os.environ.get("HEXA_HTTP_WORKERS", 8))
 UPDATE_INTERVAL = 20 * 60  # 20 minutos em segundos
+# Agenda da coleta: "adaptive" (intervalo por estacao conforme chuva/cota, api/polling.py)
+# ou "fixed" (todas as estacoes a cada UPDATE_INTERVAL)
+SCHEDULE = os.environ.get("HEXA_SCHEDULE", "adaptive")
+COLLECT_WORKERS = 10
+# Prazo do ciclo de coleta (s): o mapa sai com o que chegou; estacoes atrasadas
+# entram com o ultimo dado bom e, se responderem depois, o mapa e republicado
+COLLECT_DEADLINE = float(os.environ.get("HEXA_COLLECT_DEADLINE", 20))
+# Coletor: "threads" (ThreadPoolExecutor + requests) ou "async" (asyncio + aiohttp)
+COLLECTOR = os.environ.get("HEXA_COLLECTOR", "threads")
+# Grava as leituras novas no armazenamento local colunar (api/store.py)
+STORE_ENABLED = os.environ.get("HEXA_STORE", "1") != "0"
+# Superficie interpolada no mapa: "idw", "kriging" ou vazio (HeatMap)
+INTERP = os.environ.get("HEXA_INTERP", "") or None
+# Outliers por leitura: "spatial" (k vizinhos, analysis/qc.py) ou "reference" (threshold da referencia)
+QC_METHOD = os.environ.get("HEXA_QC", qc.DEFAULT_METHOD)
+# Tiles z/x/y da superficie + pagina estatica output/mapa_tiles.html
+TILES_ENABLED = os.environ.get("HEXA_TILES", "0") != "0"
+TILES_DIR = os.path.join(OUTPUT_DIR, "tiles")
+# Geracao do mapa num processo separado (render_worker.py), reciclado a cada N ciclos ou
+# acima do limite de memoria; HEXA_RENDER_WORKER=0 gera no proprio processo do servidor
+RENDER_WORKER = os.environ.get("HEXA_RENDER_WORKER", "1") != "0"
+RENDER_TIMEOUT = float(os.environ.get("HEXA_RENDER_TIMEOUT", render_worker.TIMEOUT))
+RENDER_MAX_CYCLES = int(os.environ.get("HEXA_RENDER_MAX_CYCLES", render_worker.MAX_CYCLES))
+RENDER_MAX_RSS_MB = float(os.environ.get("HEXA_RENDER_MAX_RSS_MB", render_worker.MAX_RSS_MB))
+# /debug/profile: perfil (cProfile/tracemalloc) de um ciclo sob demanda; desligado por padrao
+PROFILE_ENABLED = os.environ.get("HEXA_PROFILE", "0") != "0"
+PROFILE_DIR = os.path.join(BASE_DIR, "data", "profiles")
+# Janelas de acumulado servidas em /api/accumulated?window= (limitadas a janela de coleta de 24h)
+API_WINDOWS = os.environ.get("HEXA_API_WINDOWS", "1h,3h,6h,12h,24h")
+# Quantas versoes antigas do mapa manter (72 = 24h de ciclos de 20 min)
+VERSIONS_KEEP = int(os.environ.get("HEXA_VERSIONS_KEEP", 72))
 USER_ID = "91ab0570-50b1-7099-1d86-2ad3631e780e"
 
 # Auth via env vars (Railway) ou token_cache.json (local)
 REFRESH_TOKEN = os.environ.get("HEXA_REFRESH_TOKEN", "")
-TOKEN_URL = "https://us-east-2dq7vvrkkx.auth.us-east-2.amazoncognito.com/oauth2/token"
-CLIENT_ID = "bmqgtcosbo6i3irv3ojkfjjoj"
 API_BASE = "https://m73akbtcad.execute-api.us-east-2.amazonaws.com/v1/"
 QUERY_URL = API_BASE.rstrip("/") + "/query"
 
-# Cache de token em memoria
-_token_cache = {"access_token": None, "expires_at": 0, "refresh_token": REFRESH_TOKEN}
+# Token compartilhado com os scripts (api/auth.py): cache em token_cache.json,
+# renovado em segundo plano antes de expirar (start() em main)
+_tokens = auth.TokenManager(os.path.join(BASE_DIR, "token_cache.json"), refresh_token=REFRESH_TOKEN or None)
 
 
 def get_token():
-    """Obtem access token, renovando se necessario."""
-    global _token_cache
-
-    # Se temos env var de refresh token, usar ela
-    if not _token_cache["refresh_token"] and REFRESH_TOKEN:
-        _token_cache["refresh_token"] = REFRESH_TOKEN
-
-    # Se nao temos refresh token do env, tentar token_cache.json local
-    if not _token_cache["refresh_token"]:
-        cache_file = os.path.join(BASE_DIR, "token_cache.json")
-        if os.path.exists(cache_file):
-            with open(cache_file) as f:
-                local_cache = json.load(f)
-            _token_cache["refresh_token"] = local_cache.get("refresh_token", "")
-            _token_cache["access_token"] = local_cache.get("access_token")
-            _token_cache["expires_at"] = local_cache.get("expires_at", 0)
-
-    # Token ainda valido?
-    if _token_cache["access_token"] and time.time() < _token_cache["expires_at"] - 60:
-        return _token_cache["access_token"]
-
-    # Renovar via refresh token
-    if _token_cache["refresh_token"]:
-        print("Renovando access token...")
-        data = {
-            "grant_type": "refresh_token",
-            "client_id": CLIENT_ID,
-            "refresh_token": _token_cache["refresh_token"],
-        }
-        r = requests.post(TOKEN_URL, data=data,
-                          headers={"Content-Type": "application/x-www-form-urlencoded"}, timeout=15)
-        if r.status_code == 200:
-            tokens = r.json()
-            _token_cache["access_token"] = tokens["access_token"]
-            _token_cache["expires_at"] = int(time.time()) + tokens.get("expires_in", 3600)
-            print("Token renovado com sucesso")
-            return _token_cache["access_token"]
-        else:
-            print(f"Erro ao renovar token: {r.status_code} {r.text}")
-
-    print("AVISO: Sem token valido. Mapa nao sera atualizado.")
-    return None
-
-
-# Estacoes (mesma lista do mapa_chuva_24h.py)
-STATIONS = [
-    {"session": "cdcc", "device_id": "E8:07:BD:2A:DA:03"},
-    {"session": "defesacivilsc01", "device_id": "83:CC:2C:26:60:4A"},
-    {"session": "julianoneto", "device_id": "24:1C:9F:19:91:5E"},
-    {"session": "padariagenebra", "device_id": "D5:40:CB:B0:8A:92"},
-    {"session": "id1-i2c-400", "device_id": "6C:7B:A8:1D:81:23"},
-    {"session": "central", "device_id": "23:3E:C5:BD:A5:FA"},
-    {"session": "aracedesantoantonio", "device_id": "33:D5:90:5A:AD:F3"},
-    {"session": "soufadoalexandre", "device_id": "08:EF:22:B0:8A:86"},
-    {"session": "cruzeirodosul", "device_id": "C3:E9:2E:0C:66:55"},
-    {"session": "estadio-luisao", "device_id": "C3:14:CB:C1:7C:56"},
-    {"session": "id1-emeja-sc", "device_id": "4A:F0:A3:25:E8:FC"},
-    {"session": "alvaroguiao", "device_id": "89:6D:FF:4A:A9:51"},
-    {"session": "douradinho", "device_id": "C6:EE:F7:C8:ED:FC"},
-    {"session": "id1-eldorado", "device_id": "C3:2C:CF:87:16:83"},
-    {"session": "jardim-beatriz", "device_id": "7D:0F:9A:31:49:C9"},
-    {"session": "espraiado", "device_id": "D1:17:71:61:03:83"},
-    {"session": "stevenson02", "device_id": "82:CF:9A:99:05:7F"},
-    {"session": "recreiosaojudas", "device_id": "EC:7B:BC:56:4A:CA"},
-    {"session": "atheneu", "device_id": "15:7F:22:57:B7:35"},
-    {"session": "kartodromo", "device_id": "EE:11:CF:60:B6:24"},
-    {"session": "synnus", "device_id": "4F:74:C3:78:83:C5"},
-    {"session": "interpav01", "device_id": "58:73:5A:ED:65:F5"},
-    {"session": "babilonia", "device_id": "9E:6F:67:58:DA:8F"},
-    {"session": "centenario", "device_id": "21:A0:1D:A9:EE:00"},
-    {"session": "parqtec", "device_id": "19:04:7D:89:A9:D7"},
-    {"session": "tendtudo02", "device_id": "7D:FC:BB:4F:EF:FE"},
-    {"session": "trabalhocomfraternidade", "device_id": "1D:CC:75:85:9A:BB"},
-    {"session": "aracy01", "device_id": "9D:D7:75:9E:F4:71"},
-    {"session": "stevenson01", "device_id": "3B:4A:C0:A5:6F:B4"},
-    {"session": "ct-nicolas-santos", "device_id": "AB:17:FC:E0:0C:A1"},
-    {"session": "janete-lia", "device_id": "29:B0:58:38:9E:FC"},
-]
-
-EXCLUDED_SESSIONS = {"interpav-backup", "conegomanoeltobias"}
+    """Access token atual (da memoria; a renovacao roda em segundo plano)."""
+    token = _tokens.get()
+    if not token:
+        print("AVISO: Sem token valido. Mapa nao sera atualizado.")
+    return token
+
+
+# Coleta incremental: janela movel de 24h por sessao
+WINDOW_SECONDS = 24 * 3600
+# Margem para amostras que chegam atrasadas na API
+LATE_MARGIN = 5 * 60
+# Sem sincronizar ha mais que isso -> lacuna, refaz a coleta completa da sessao
+# (acima do maior intervalo da agenda adaptativa, para estacoes secas seguirem no delta;
+# com a cota curta vale o intervalo esticado da sessao, ver _gap_limit)
+GAP_LIMIT = polling.EMPTY_MAX + LATE_MARGIN
+
+# session -> {"records": {(device_id, time): rec}, "last_ts", "synced_until",
+#             "last_ok" (fim da ultima coleta bem-sucedida), "failed" (falhas seguidas)}
+_windows = {}
+_windows_lock = threading.Lock()
+# Sessoes com requisicao ainda em andamento (passaram do prazo do ciclo)
+_inflight = set()
+# Acordado quando uma estacao atrasada responde: o atualizador republica o mapa
+_late_event = threading.Event()
+_collect_pool = None
+
+# Agenda adaptativa da coleta (api/polling.py)
+_planner = polling.PollPlanner()
+
+# Economia da coleta incremental em relacao a refazer as 24h completas
+_collect_stats = {
+    "cycles": 0,
+    "bytes_per_record": 0.0,
+    "last_cycle": {},
+    "total_saved_records": 0,
+    "total_saved_bytes": 0,
+}
+
+# Metricas do ciclo (/metrics) e perfil sob demanda (/debug/profile)
+_metrics = metrics.Metrics()
+_metrics.describe("stage_seconds", "histogram", "Duracao de cada etapa do ciclo de atualizacao",
+                  metrics.STAGE_BUCKETS)
+_metrics.describe("stage_last_seconds", "gauge", "Duracao da etapa no ultimo ciclo")
+_metrics.describe("fetch_seconds", "histogram", "Latencia da coleta por estacao", metrics.FETCH_BUCKETS)
+_metrics.describe("fetch_failures_total", "counter", "Coletas que falharam, por estacao")
+_metrics.describe("cycles_total", "counter", "Ciclos de atualizacao por resultado")
+_metrics.describe("records_fetched_total", "counter", "Registros recebidos da API")
+_metrics.describe("records_new_total", "counter", "Registros novos (fora da janela ja coletada)")
+_metrics.describe("window_records", "gauge", "Registros na janela de 24h usada no mapa")
+_metrics.describe("outliers_zeroed_total", "counter", "Leituras outliers zeradas no tratamento")
+_metrics.describe("outlier_threshold_mm", "gauge", "Limite por leitura usado no ultimo tratamento")
+_metrics.describe("qc_readings_total", "counter", "Leituras por resultado do QC espacial")
+_metrics.describe("mapped_stations", "gauge", "Estacoes no ultimo mapa")
+_metrics.describe("suspect_stations", "gauge", "Estacoes marcadas como suspeitas no ultimo mapa")
+_metrics.describe("stale_stations", "gauge", "Estacoes com o ultimo dado bom em cache no ultimo mapa")
+_profiler = metrics.CycleProfiler(PROFILE_DIR)
 
 
 def fetch_session_day(session, start_ts, end_ts, headers):
-    """Busca dados de uma sessao para um bloco de 24h."""
+    """Busca dados de uma sessao num intervalo de ate 24h.
+
+    Retorna (registros, bytes recebidos); registros e None se a requisicao falhou.
+    """
     params = {
         "session": session,
         "user_id": USER_ID,
         "start_ts": start_ts,
         "end_ts": end_ts,
     }
+    t0 = time.perf_counter()
     try:
-        resp = requests.get(QUERY_URL, params=params, headers=headers, timeout=30)
+        resp = client.get(QUERY_URL, params=params, headers=headers, priority=scheduler.LIVE)
         if resp.status_code == 200:
-            return resp.json().get("data", [])
-        elif resp.status_code == 429 or "Limite" in resp.text:
-            time.sleep(2)
-            resp = requests.get(QUERY_URL, params=params, headers=headers, timeout=30)
-            if resp.status_code == 200:
-                return resp.json().get("data", [])
-        else:
-            print(f"  [ERRO] {session}: {resp.status_code}")
+            data = resp.json().get("data", [])
+            _metrics.observe("fetch_seconds", time.perf_counter() - t0, session=session)
+            return data, len(resp.content)
+        print(f"  [ERRO] {session}: {resp.status_code}")
+    except scheduler.QuotaExceeded as ex:
+        print(f"  [COTA] {session}: {ex}")
     except Exception as ex:
         print(f"  [EXCEPT] {session}: {ex}")
-    return []
+    _metrics.inc("fetch_failures_total", session=session)
+    return None, 0
+
+
+def _gap_limit(session):
+    """Tempo sem sincronizar que conta como lacuna para a sessao.
+
+    A agenda estica os intervalos quando a cota aperta (ate EMPTY_MAX/DRY_MIN
+    vezes com ela esgotada); a coleta no horario planejado continua delta, em
+    vez de refazer as 24h justo quando falta cota.
+    """
+    return max(GAP_LIMIT, _planner.interval(session) + LATE_MARGIN)
+
+
+def _fetch_window(session, end_ts):
+    """Define o intervalo a buscar para a sessao: delta desde a ultima amostra ou 24h completas."""
+    state = _windows.get(session)
+    window_start = end_ts - WINDOW_SECONDS
+    if not state or end_ts - state["synced_until"] > _gap_limit(session):
+        return window_start, True
+    start = state["synced_until"] - LATE_MARGIN
+    if state["last_ts"] is not None:
+        start = max(state["last_ts"], start)
+    return max(start, window_start), False
+
+
+def _merge_window(session, data, full, end_ts):
+    """Incorpora os registros na janela da sessao (dedup por device_id+time) e descarta os antigos.
+
+    Retorna a lista dos registros que ainda nao estavam na janela.
+    """
+    state = _windows.get(session)
+    if full or state is None:
+        state = {"records": {}, "last_ts": None, "synced_until": 0}
+        _windows[session] = state
+
+    records = state["records"]
+    new = []
+    for rec in data:
+        ts = record_ts(rec)
+        if ts is None:
+            continue
+        key = (rec.get("device_id"), ts)
+        if key not in records:
+            new.append(rec)
+        records[key] = rec
+        if state["last_ts"] is None or ts > state["last_ts"]:
+            state["last_ts"] = ts
+
+    cutoff = end_ts - WINDOW_SECONDS
+    for key in [k for k in records if k[1] < cutoff]:
+        del records[key]
+    state["synced_until"] = end_ts
+    state["last_ok"] = end_ts
+    state["failed"] = 0
+    return new
+
+
+def _fetch_sessions(jobs, headers, deadline=None):
+    """Busca os jobs (session, start_ts, end_ts, full); gera (session, full, registros, bytes).
+
+    Com deadline (s), so gera o que chegou no prazo. No coletor de threads as
+    requisicoes atrasadas continuam e caem em _late_arrival; no async sao
+    canceladas. Em ambos a estacao fica com o ultimo dado bom.
+    """
+    global _collect_pool
+    if COLLECTOR == "async":
+        import async_client
+        timings = {}
+        results = async_client.fetch_sessions(
+            [job[:3] for job in jobs], headers, concurrency=COLLECT_WORKERS, user_id=USER_ID, url=QUERY_URL,
+            deadline=deadline, timings=timings)
+        full_by_session = {job[0]: job[3] for job in jobs}
+        for (session, _, _), (data, nbytes) in results:
+            if data is None:
+                _metrics.inc("fetch_failures_total", session=session)
+            else:
+                _metrics.observe("fetch_seconds", timings[session], session=session)
+            yield session, full_by_session[session], data, nbytes
+        return
+
+    if _collect_pool is None:
+        _collect_pool = concurrent.futures.ThreadPoolExecutor(max_workers=COLLECT_WORKERS,
+                                                              thread_name_prefix="coleta")
+    futures = {_collect_pool.submit(fetch_session_day, *job[:3], headers): job for job in jobs}
+    try:
+        for f in concurrent.futures.as_completed(futures, timeout=deadline):
+            job = futures[f]
+            data, nbytes = f.result()
+            yield job[0], job[3], data, nbytes
+    except concurrent.futures.TimeoutError:
+        pass
+    for f, job in futures.items():
+        if not f.done():
+            with _windows_lock:
+                _inflight.add(job[0])
+            f.add_done_callback(lambda f, job=job: _late_arrival(job, f))
 
 
-def collect_24h_data(token):
-    """Coleta dados das ultimas 24h de todas as estacoes."""
-    headers = {"Authorization": f"Bearer {token}"}
-    end_ts = int(time.time())
-    start_ts = end_ts - (24 * 3600)
+def _late_arrival(job, future):
+    """Resposta de uma estacao que passou do prazo do ciclo: entra na janela e acorda o atualizador."""
+    session, _, end_ts, full = job
+    try:
+        data, _ = future.result()
+    except Exception:
+        data = None
+    _planner.observe(session, _rain_readings(data) if data else data)
+    with _windows_lock:
+        _inflight.discard(session)
+        state = _windows.get(session)
+        if data is None or (state and state["synced_until"] >= end_ts):
+            return  # falhou, ou ja existe coleta mais nova da sessao
+        new = _merge_window(session, data, full, end_ts)
+    print(f"  {session}: resposta atrasada, {len(data)} registros ({len(new)} novos)")
+    if new:
+        if STORE_ENABLED:
+            try:
+                store.append_records(new)
+            except OSError as ex:
+                print(f"Erro ao gravar armazenamento local: {ex}")
+        _late_event.set()
+
+
+def station_freshness(now=None):
+    """{session: {"age_s", "stale"}}: idade do ultimo dado bom e se a ultima coleta falhou ou atrasou."""
+    now = time.time() if now is None else now
+    with _windows_lock:
+        return {
+            session: {
+                "age_s": int(now - state["last_ok"]) if state.get("last_ok") else None,
+                "stale": bool(state.get("failed")) or session in _inflight,
+            }
+            for session, state in _windows.items()
+        }
 
-    stations = [s for s in STATIONS if s["session"] not in EXCLUDED_SESSIONS]
-    all_records = []
 
-    print(f"Coletando dados de {len(stations)} estacoes...")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {
-            executor.submit(fetch_session_day, s["session"], start_ts, end_ts, headers): s["session"]
-            for s in stations
-        }
-        for f in concurrent.futures.as_completed(futures):
-            session = futures[f]
-            data = f.result()
-            all_records.extend(data)
-            if data:
-                print(f"  {session}: {len(data)} registros")
+def _rain_readings(data):
+    """(ts, chuva) de cada registro, para o planejador saber se esta chovendo."""
+    out = []
+    for rec in data:
+        try:
+            out.append((record_ts(rec), float(rec.get("rain") or 0)))
+        except (TypeError, ValueError):
+            continue
+    return out
 
+
+def collect_24h_data(token, sessions=None):
+    """Coleta dados das ultimas 24h de todas as estacoes (ou so das `sessions`).
+
+    Mantem uma janela movel por sessao e busca apenas o delta desde a ultima
+    amostra vista. A coleta completa de 24h so acontece na partida a frio ou
+    quando a sessao ficou sem sincronizar por mais de GAP_LIMIT. As estacoes
+    nao coletadas entram com o que ja esta na janela.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    if not scheduler.quota_loaded():
+        scheduler.load_quota(API_BASE, headers, USER_ID)
+    end_ts = int(time.time())
+
+    # Cadastro de estacoes: /devices com cache em disco (api/stations.py)
+    all_active = stations.refresh(API_BASE, headers, USER_ID).active()
+    active = [s for s in all_active if sessions is None or s["session"] in sessions]
+    fetched_records, fetched_bytes, full_fetches = 0, 0, 0
+    new_records = []
+
+    jobs = []
+    with _windows_lock:
+        busy = set(_inflight)
+    for s in active:
+        if s["session"] in busy:
+            continue  # requisicao do ciclo anterior ainda em andamento
+        start_ts, full = _fetch_window(s["session"], end_ts)
+        jobs.append((s["session"], start_ts, end_ts, full))
+
+    print(f"Coletando dados de {len(jobs)} estacoes ({COLLECTOR}, prazo {COLLECT_DEADLINE:.0f}s)...")
+    answered = set()
+    for session, full, data, nbytes in _fetch_sessions(jobs, headers, COLLECT_DEADLINE):
+        answered.add(session)
+        _planner.observe(session, _rain_readings(data) if data else data)
+        if data is None:
+            # Falha: mantem a janela atual (ultimo dado bom) e forca refetch completo no proximo ciclo
+            with _windows_lock:
+                if session in _windows:
+                    _windows[session]["synced_until"] = 0
+                    _windows[session]["failed"] = _windows[session].get("failed", 0) + 1
+            continue
+        with _windows_lock:
+            new = _merge_window(session, data, full, end_ts)
+        new_records.extend(new)
+        fetched_records += len(data)
+        fetched_bytes += nbytes
+        full_fetches += int(full)
+        if data:
+            tipo = "completo" if full else "delta"
+            print(f"  {session}: {len(data)} registros ({tipo}, {len(new)} novos)")
+
+    late = [job[0] for job in jobs if job[0] not in answered]
+    if late:
+        print(f"  Sem resposta no prazo (usando ultimo dado bom): {', '.join(late)}")
+    all_records = window_records(end_ts)
+
+    _planner.plan([j[0] for j in jobs], [s["session"] for s in all_active])
+    _update_collect_stats(len(all_records), fetched_records, fetched_bytes, full_fetches)
+    _metrics.inc("records_fetched_total", fetched_records)
+    _metrics.inc("records_new_total", len(new_records))
+    _metrics.set("window_records", len(all_records))
+    new_ts = [ts for ts in (record_ts(r) for r in new_records) if ts is not None]
+    _collect_stats["last_cycle"].update(new_records=len(new_records), newest_ts=max(new_ts, default=None),
+                                        late=len(late))
+    if STORE_ENABLED and new_records:
+        try:
+            with _metrics.span("store"):
+                written = store.append_records(new_records)
+            print(f"Armazenamento local: {written} leituras gravadas")
+        except OSError as ex:
+            print(f"Erro ao gravar armazenamento local: {ex}")
     print(f"Total coletado: {len(all_records)} registros")
+    print(f"HTTP: {client.format_stats()}")
+    quota = scheduler.stats()
+    print(f"Cota: {quota['used_today']}/{quota['per_day']} req hoje, {quota['remaining_today']} restantes")
     return all_records
 
 
-def update_map():
-    """Coleta dados e regenera o mapa."""
+def window_records(end_ts=None):
+    """Registros de todas as sessoes dentro da janela de 24h (coletados agora ou em cache)."""
+    cutoff = (time.time() if end_ts is None else end_ts) - WINDOW_SECONDS
+    with _windows_lock:
+        return [rec for state in _windows.values()
+                for (_, ts), rec in state["records"].items() if ts >= cutoff]
+
+
+def _update_collect_stats(window_records, fetched_records, fetched_bytes, full_fetches):
+    """Estima registros/bytes economizados no ciclo frente a refazer as 24h completas."""
+    stats = _collect_stats
+    if fetched_records:
+        bpr = fetched_bytes / fetched_records
+        # Media movel: o tamanho por registro varia pouco entre ciclos
+        stats["bytes_per_record"] = bpr if not stats["bytes_per_record"] else (
+            0.8 * stats["bytes_per_record"] + 0.2 * bpr)
+
+    saved_records = max(window_records - fetched_records, 0)
+    saved_bytes = int(saved_records * stats["bytes_per_record"])
+    stats["cycles"] += 1
+    stats["total_saved_records"] += saved_records
+    stats["total_saved_bytes"] += saved_bytes
+    stats["last_cycle"] = {
+        "window_records": window_records,
+        "fetched_records": fetched_records,
+        "fetched_bytes": fetched_bytes,
+        "full_fetches": full_fetches,
+        "saved_records": saved_records,
+        "saved_bytes": saved_bytes,
+    }
+    print(f"Incremental: {fetched_records} registros/{fetched_bytes/1024:.0f} KB baixados, "
+          f"economia de {saved_records} registros (~{saved_bytes/1024:.0f} KB) vs coleta completa "
+          f"[{full_fetches} sessoes com coleta completa]")
+
+
+def update_map(sessions=None):
+    """Coleta dados (de todas as estacoes ou so das `sessions`) e regenera o mapa."""
+    with _profiler.capture("update"), _metrics.span("cycle"):
+        result = _update_map(sessions)
+    _metrics.inc("cycles_total", result=result)
+    return result == "ok"
+
+
+def _update_map(sessions):
+    """Corpo de update_map; retorna o resultado do ciclo para /metrics."""
     br_tz = timezone(timedelta(hours=-3))
     now_br = datetime.now(br_tz).strftime("%d/%m/%Y %H:%M")
     print(f"\n{'='*50}")
@@ -182,38 +447,198 @@ def update_map():
     token = get_token()
     if not token:
         print("Sem token - pulando atualizacao")
-        return False
+        return "no_token"
 
     try:
-        records = collect_24h_data(token)
-        if len(records) < 100:
-            print(f"Poucos dados coletados ({len(records)}). Mantendo mapa anterior.")
-            return False
-
-        # Importar e gerar mapa
-        from mapa_chuva_24h import generate_map
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        generate_map(records, MAP_FILE)
-
+        with _metrics.span("collect"):
+            records = collect_24h_data(token, sessions)
+        if not records:
+            print("Nenhuma estacao com dados (nem em cache). Mantendo mapa anterior.")
+            return "no_data"
+        last_cycle = _collect_stats["last_cycle"]
+        if sessions is not None and not last_cycle["new_records"]:
+            print("Nenhuma leitura nova. Mantendo mapa anterior.")
+            return "unchanged"
+        render_map(records, last_cycle["newest_ts"])
         print(f"Mapa atualizado com sucesso ({len(records)} registros)")
-        return True
+        return "ok"
 
     except Exception as ex:
         print(f"Erro ao atualizar mapa: {ex}")
         import traceback
         traceback.print_exc()
+        return "error"
+
+
+def republish():
+    """Regera o mapa so com o que esta nas janelas (respostas atrasadas), sem coletar."""
+    _late_event.clear()
+    records = window_records()
+    if not records:
         return False
+    print(f"\n[late] Republicando o mapa com respostas atrasadas ({len(records)} registros)")
+    try:
+        with _profiler.capture("republish"):
+            render_map(records, max((record_ts(r) or 0 for r in records), default=None))
+        _metrics.inc("cycles_total", result="republish")
+        return True
+    except Exception as ex:
+        print(f"Erro ao republicar mapa: {ex}")
+        _metrics.inc("cycles_total", result="error")
+        return False
+
+
+def render_map(records, newest_ts=None):
+    """Gera o mapa dos registros, publica a versao e atualiza a API e o SSE.
+
+    Estacoes cuja ultima coleta falhou ou atrasou entram com o ultimo dado bom,
+    marcadas no mapa e na API com a idade do dado. A geracao roda no processo
+    de _renderer; um ciclo sob /debug/profile roda aqui, para o perfil cobri-la.
+    """
+    freshness = station_freshness()
+    stale = {s: f["age_s"] for s, f in freshness.items() if f["stale"] and f["age_s"] is not None}
+    if stale:
+        print(f"Estacoes em cache: {', '.join(f'{s} ({a // 60} min)' for s, a in sorted(stale.items()))}")
+
+    # Gerar o mapa num arquivo temporario; so vira a versao atual quando completo
+    with _render_lock:
+        os.makedirs(VERSIONS_DIR, exist_ok=True)
+        version = _next_version()
+        rendered = os.path.join(VERSIONS_DIR, f".{version}.tmp.html")
+        try:
+            windows = {k: v for k, v in parse_windows(API_WINDOWS).items() if v <= WINDOW_SECONDS}
+            options = {"interp": INTERP, "tiles_dir": TILES_DIR if TILES_ENABLED else None,
+                       "raster_file": GRID_FILE, "windows": windows, "live_url": f"/events?since={version}",
+                       "stale": stale, "qc_method": QC_METHOD}
+            pack = render_worker.pack_records(records)
+            if RENDER_WORKER and not _profiler.running:
+                out = _renderer.render(pack, rendered, options, stations.get())
+            else:
+                out = render_worker.render(pack, rendered, options)
+            df, tables, cycle = out["df"], out["tables"], out["cycle"]
+            for stage, seconds in cycle["stages"].items():
+                _metrics.record_stage(stage, seconds)
+            _metrics.inc("outliers_zeroed_total", cycle["outliers_zeroed"])
+            _metrics.set("outlier_threshold_mm", cycle["threshold_mm"])
+            for flag, count in (cycle["qc"] or {}).items():
+                _metrics.inc("qc_readings_total", count, flag=flag)
+            _metrics.set("mapped_stations", cycle["stations"])
+            _metrics.set("suspect_stations", cycle["suspect"])
+            _metrics.set("stale_stations", len(stale))
+            with _metrics.span("publish"):
+                publish_map(rendered, version)
+                if newest_ts:
+                    _planner.published(newest_ts)
+                prev = _results.snapshot
+                snap = _results.update(version, df, tables, records, stations.get(), markers=out["markers"],
+                                       freshness=freshness)
+                message = results.live_message(snap, prev)
+                _events.publish(message, event_id=version, event="version")
+            print(f"SSE: versao {version} enviada a {len(_events.clients)} clientes ({len(message)} bytes)")
+        finally:
+            if os.path.exists(rendered):
+                os.remove(rendered)
+
+
+# Mapa publicado: versao atual em memoria (corpo + gzip), trocada por referencia
+_current_map = None
+_current_version = None
+_versions = []  # timestamps publicados, do mais antigo ao mais novo
+_publish_lock = threading.Lock()
+# Um mapa por vez (ciclo normal e republicacao de respostas atrasadas)
+_render_lock = threading.Lock()
+# Resultados do ultimo ciclo para a API JSON (/api/...)
+_results = results.ResultCache()
+# Canal SSE (/events): avisa as paginas abertas de cada nova versao
+_events = web.EventChannel()
+# Processo que gera o mapa (iniciado no primeiro ciclo)
+_renderer = render_worker.RenderWorker([BASE_DIR, os.path.join(BASE_DIR, "api"), os.path.join(BASE_DIR, "analysis")],
+                                       RENDER_TIMEOUT, RENDER_MAX_CYCLES, RENDER_MAX_RSS_MB)
+
+
+def _next_version():
+    version = int(time.time())
+    with _publish_lock:
+        if _versions and version <= _versions[-1]:
+            version = _versions[-1] + 1
+    return version
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def publish_map(rendered_file, version):
+    """Publica o HTML renderizado como versao `version`.
+
+    O arquivo vira output/versions/<version>.html (imutavel) e a copia em
+    output/mapa_chuva_24h.html e trocada com os.replace, entao ninguem le um
+    arquivo pela metade. O servidor async passa a servir a nova versao da
+    memoria. Versoes alem de VERSIONS_KEEP sao apagadas.
+    """
+    global _current_map, _current_version
+    with open(rendered_file, "rb") as f:
+        body = f.read()
+    asset = web.Asset(body, "text/html; charset=utf-8", version, "no-cache")
+    os.replace(rendered_file, os.path.join(VERSIONS_DIR, f"{version}.html"))
+    _write_atomic(MAP_FILE, body)
+
+    with _publish_lock:
+        _current_map, _current_version = asset, version
+        _versions.append(version)
+        expired, _versions[:] = _versions[:-VERSIONS_KEEP], _versions[-VERSIONS_KEEP:]
+    for old in expired:
+        try:
+            os.remove(os.path.join(VERSIONS_DIR, f"{old}.html"))
+        except OSError:
+            pass
+    print(f"Versao {version} publicada ({len(body)/1024:.0f} KB, {len(_versions)} versoes mantidas)")
+
+
+def load_published():
+    """Na partida: versoes ja publicadas em disco e o mapa atual (ou o placeholder)."""
+    global _current_map, _current_version
+    found = []
+    if os.path.isdir(VERSIONS_DIR):
+        found = sorted(int(n[:-5]) for n in os.listdir(VERSIONS_DIR) if n.endswith(".html") and n[:-5].isdigit())
+    _versions[:] = found[-VERSIONS_KEEP:]
+    if os.path.exists(MAP_FILE):
+        with open(MAP_FILE, "rb") as f:
+            body = f.read()
+        mtime = os.path.getmtime(MAP_FILE)
+        _current_map = web.Asset(body, "text/html; charset=utf-8", mtime, "no-cache")
+        _current_version = _versions[-1] if _versions else None
 
 
 def updater_loop():
-    """Thread que atualiza o mapa a cada 20 minutos."""
+    """Thread que atualiza o mapa: a cada 20 minutos (fixed) ou quando alguma
+    estacao vence na agenda adaptativa (adaptive)."""
     # Primeira atualizacao ao iniciar
     time.sleep(5)  # Esperar servidor subir
     update_map()
 
     while True:
-        time.sleep(UPDATE_INTERVAL)
-        update_map()
+        if SCHEDULE == "fixed":
+            deadline = time.time() + UPDATE_INTERVAL
+            while _late_event.wait(max(deadline - time.time(), 0)):
+                republish()
+            update_map()
+            continue
+        sessions = [s["session"] for s in stations.get().active()]
+        due = _planner.due(sessions)
+        if not due:
+            wait = _planner.next_at(sessions) - polling.BATCH_SLACK - time.time()
+            if _late_event.wait(min(max(wait, 1), UPDATE_INTERVAL)):
+                republish()
+            continue
+        cycles = _planner.cycles
+        update_map(due)
+        if _planner.cycles == cycles:
+            # Ciclo nem chegou a coletar (sem token, erro): nao insistir em loop
+            time.sleep(60)
 
 
 class MapHandler(SimpleHTTPRequestHandler):
@@ -230,8 +655,176 @@ class MapHandler(SimpleHTTPRequestHandler):
         pass
 
 
+def _cache_control(rel):
+    # Versoes publicadas nunca mudam; tiles mudam no maximo a cada ciclo;
+    # o resto sempre revalida (304 barato)
+    if rel.startswith("versions" + os.sep):
+        return "public, max-age=31536000, immutable"
+    if rel.startswith("tiles" + os.sep):
+        return "public, max-age=60"
+    return "no-cache"
+
+
+_static = web.StaticFiles(OUTPUT_DIR, cache_control=_cache_control)
+
+
+def status():
+    """Estado do coletor: agenda por estacao, cota, economia incremental e SSE."""
+    return {
+        "schedule": SCHEDULE,
+        "polling": _planner.stats(),
+        "quota": scheduler.stats(),
+        "collect": _collect_stats,
+        "map_version": _current_version,
+        "sse_clients": len(_events.clients),
+        "token": _tokens.stats(),
+        "render": _renderer.stats() if RENDER_WORKER else None,
+    }
+
+
+@_metrics.collector
+def _metric_samples():
+    """Contadores mantidos pelos outros modulos (cliente HTTP, cota, token, SSE, agenda) e memoria."""
+    http = client.stats()
+    quota = scheduler.stats()
+    token = _tokens.stats()
+    polls = _planner.stats()
+    samples = [
+        ("api_requests_total", "counter", "Requisicoes a API HexaCloud (inclui retries)", {}, http["requests"]),
+        ("api_retries_total", "counter", "Retries em 429/5xx e erros de conexao", {}, http["retries"]),
+        ("api_errors_total", "counter", "Requisicoes a API que falharam de vez", {}, http["errors"]),
+        ("api_received_bytes_total", "counter", "Bytes recebidos da API", {}, http["bytes"]),
+        ("quota_used_today", "gauge", "Requisicoes usadas hoje na cota da conta", {}, quota["used_today"]),
+        ("quota_remaining_today", "gauge", "Requisicoes restantes hoje", {}, quota["remaining_today"]),
+        ("quota_rejected_total", "counter", "Requisicoes recusadas pelo agendador de cota", {}, quota["rejected"]),
+        ("quota_wait_seconds_total", "counter", "Tempo de espera por token do agendador", {}, quota["waited_s"]),
+        ("token_refreshes_total", "counter", "Renovacoes do access token", {}, token["refreshes"]),
+        ("token_refresh_failures_total", "counter", "Renovacoes do access token que falharam", {},
+         token["failures"]),
+        ("token_adopted_total", "counter", "Tokens renovados por outro processo e adotados", {}, token["adopted"]),
+        ("token_expires_in_seconds", "gauge", "Segundos ate o access token expirar", {}, token["expires_in_s"]),
+        ("polls_total", "counter", "Coletas de estacao feitas pela agenda", {}, polls["polls"]),
+        ("poll_wet_stations", "gauge", "Estacoes com chuva recente na agenda", {}, polls["wet_stations"]),
+        ("poll_requests_per_hour", "gauge", "Coletas por hora previstas pela agenda", {}, polls["polls_per_hour"]),
+        ("fresh_lag_seconds", "gauge", "Atraso entre a leitura mais nova e o mapa publicado", {},
+         polls["fresh_lag_s"]),
+        ("map_version", "gauge", "Timestamp da versao atual do mapa", {}, _current_version),
+        ("sse_clients", "gauge", "Paginas conectadas em /events", {}, len(_events.clients)),
+        ("sse_published_total", "counter", "Versoes enviadas por SSE", {}, _events.stats["published"]),
+        ("sse_dropped_total", "counter", "Clientes SSE descartados por fila cheia", {}, _events.stats["dropped"]),
+    ]
+    if RENDER_WORKER:
+        render = _renderer.stats()
+        samples += [
+            ("render_worker_starts_total", "counter", "Processos de geracao do mapa iniciados", {}, render["started"]),
+            ("render_worker_recycled_total", "counter", "Processos de geracao reciclados (ciclos/memoria/cadastro)",
+             {}, render["recycled"]),
+            ("render_worker_timeouts_total", "counter", "Ciclos de geracao que passaram do prazo", {},
+             render["timeouts"]),
+            ("render_worker_crashes_total", "counter", "Processos de geracao que morreram no meio do ciclo", {},
+             render["crashes"]),
+            ("render_worker_resident_memory_bytes", "gauge", "RSS do processo de geracao apos o ultimo ciclo", {},
+             render["rss_mb"] * 2**20 if render["rss_mb"] is not None else None),
+        ]
+    if _http is not None:
+        samples += [
+            ("http_requests_total", "counter", "Requisicoes recebidas pelo servidor", {}, _http.stats["requests"]),
+            ("http_rejected_total", "counter", "Conexoes recusadas (limite de conexoes)", {},
+             _http.stats["rejected"]),
+            ("http_errors_total", "counter", "Erros no handler HTTP", {}, _http.stats["errors"]),
+        ]
+    return samples + metrics.memory_samples()
+
+
+def _profile_response(request):
+    """/debug/profile: ?mode=cpu|memory arma o perfil do proximo ciclo (?now=1 republica ja); sem
+    mode, devolve o relatorio do ultimo ciclo perfilado."""
+    mode = request.query.get("mode")
+    if mode:
+        try:
+            _profiler.arm(mode)
+        except ValueError:
+            return web.text_response(400, "mode deve ser cpu ou memory")
+        if request.query.get("now"):
+            _late_event.set()
+        return web.Response(202, json.dumps(_profiler.status()).encode(), {"Cache-Control": "no-store"},
+                            "application/json")
+    last = _profiler.last
+    if last is None:
+        return web.Response(200, json.dumps(_profiler.status()).encode(), {"Cache-Control": "no-store"},
+                            "application/json")
+    head = f"# ciclo {last['cycle']} ({last['mode']}) em {last['at']}, {last['duration_s']}s\n"
+    if last["file"]:
+        head += f"# {last['file']}\n"
+    return web.Response(200, (head + "\n" + last["report"]).encode(), {"Cache-Control": "no-store"},
+                        "text/plain; charset=utf-8")
+
+
+def _events_response(request):
+    """Abre o stream SSE; quem chega com versao antiga (Last-Event-ID ou
+    ?since=) recebe logo o estado completo da versao atual."""
+    snap = _results.snapshot
+    since = request.headers.get("last-event-id") or request.query.get("since")
+    initial = None
+    if snap is not None and since and since != str(snap.version):
+        initial = web.sse_message(results.live_message(snap), snap.version, "version")
+    return _events.response(initial)
+
+
+async def handle_request(request):
+    """Handler do servidor async: arquivos de output/ servidos da memoria."""
+    if request.method not in ("GET", "HEAD"):
+        return web.Response(405, b"", {"Allow": "GET, HEAD"})
+    path = request.path
+    if path == "/api/status":
+        return web.Response(200, json.dumps(status()).encode(), {"Cache-Control": "no-store"}, "application/json")
+    if path.startswith("/api/"):
+        return _results.response(request)
+    if path == "/metrics":
+        return web.Response(200, _metrics.render().encode(), {"Cache-Control": "no-store"}, metrics.CONTENT_TYPE)
+    if path == "/debug/profile" and PROFILE_ENABLED:
+        return _profile_response(request)
+    if path == "/events":
+        return _events_response(request)
+    if path in ("/", "/mapa_chuva_24h.html") and _current_map is not None:
+        headers = {"X-Map-Version": str(_current_version)} if _current_version else None
+        return web.asset_response(request, _current_map, headers)
+    if path.rstrip("/") == "/v":
+        with _publish_lock:
+            payload = {"current": _current_version, "versions": list(_versions)}
+        return web.Response(200, json.dumps(payload).encode(), {"Cache-Control": "no-cache"}, "application/json")
+    if path.startswith("/v/"):
+        name = path[3:]
+        if not name.isdigit():
+            return web.text_response(404)
+        path = f"/versions/{name}.html"
+    elif path.startswith("/versions/"):
+        return web.text_response(404)
+    asset = _static.peek(path) or await _http.run_blocking(_static.get, path)
+    if asset is None:
+        return web.text_response(404)
+    return web.asset_response(request, asset)
+
+
+_http = None
+
+
+def serve_http(port=PORT, mode=HTTP_MODE):
+    """Serve output/ na porta dada (bloqueia)."""
+    global _http
+    if mode == "legacy":
+        server = HTTPServer(("0.0.0.0", port), MapHandler)
+        print(f"Servidor (legacy) rodando em http://0.0.0.0:{port}")
+        server.serve_forever()
+        return
+    _http = web.HTTPServer(handle_request, "0.0.0.0", port, workers=HTTP_WORKERS)
+    print(f"Servidor (async, {HTTP_WORKERS} workers) rodando em http://0.0.0.0:{port}")
+    _http.run()
+
+
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    client.configure(pool_size=COLLECT_WORKERS)
 
     # Se nao existe mapa ainda, criar um placeholder
     if not os.path.exists(MAP_FILE):
@@ -240,15 +833,16 @@ def main():
                     "<p>O mapa sera gerado em alguns instantes. Recarregue a pagina.</p>"
                     "</body></html>")
 
-    # Iniciar thread de atualizacao
+    load_published()
+
+    # Renovacao do token em segundo plano e thread de atualizacao
+    _tokens.start()
     updater = threading.Thread(target=updater_loop, daemon=True)
     updater.start()
-    print(f"Thread de atualizacao iniciada (intervalo: {UPDATE_INTERVAL//60} min)")
+    print(f"Thread de atualizacao iniciada (agenda: {SCHEDULE})")
 
     # Iniciar servidor HTTP
-    server = HTTPServer(("0.0.0.0", PORT), MapHandler)
-    print(f"Servidor rodando em http://0.0.0.0:{PORT}")
-    server.serve_forever()
+    serve_http(PORT, HTTP_MODE)
 
 
 if __name__ == "__main__":
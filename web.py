@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Servidor HTTP/1.1 asyncio para o server.py.
+
+Um unico event loop atende todas as conexoes (keep-alive, timeouts por
+conexao), entao um cliente lento nao bloqueia os outros. Trabalho bloqueante
+(ler arquivo do disco, comprimir) vai para um pool limitado de threads.
+
+Arquivos estaticos ficam em memoria (StaticFiles) com as variantes gzip e
+brotli (se o modulo brotli estiver instalado) pre-calculadas, e sao servidos
+com ETag, Last-Modified e Cache-Control, respondendo 304 a requisicoes
+condicionais.
+
+EventChannel implementa Server-Sent Events: cada cliente conectado e so uma
+corrotina parada numa fila, entao milhares de conexoes ociosas custam poucos
+KB cada.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import email.utils
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependencia opcional
+    brotli = None
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+HEADER_TIMEOUT = 10
+KEEPALIVE_TIMEOUT = 15
+# Tempo maximo para um cliente lento aceitar um pedaco de resposta em streaming
+SEND_TIMEOUT = 30
+# SSE: comentario a cada HEARTBEAT s mantem proxies abertos e detecta quem caiu
+SSE_HEARTBEAT = 25
+SSE_RETRY_MS = 5000
+# Mensagens pendentes por cliente SSE; cheia = cliente lento, conexao fechada
+SSE_QUEUE_SIZE = 16
+# Conexoes simultaneas acima disso recebem 503 e sao fechadas
+MAX_CONNECTIONS = 10000
+COMPRESS_MIN_BYTES = 512
+COMPRESSIBLE = ("text/", "application/json", "application/javascript", "image/svg+xml", "application/geo+json")
+# Memoria maxima dos arquivos estaticos em cache (corpo + variantes)
+STATIC_CACHE_BYTES = 64 * 1024 * 1024
+
+REASONS = {
+    200: "OK", 202: "Accepted", 204: "No Content", 301: "Moved Permanently", 304: "Not Modified",
+    400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+    500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+class BadRequest(Exception):
+    """Requisicao mal formada ou grande demais: o servidor responde status e fecha a conexao."""
+
+    def __init__(self, status=400):
+        super().__init__(status)
+        self.status = status
+
+
+def content_length(headers):
+    """Content-Length como inteiro >= 0 (0 se ausente); BadRequest(400) se nao for so digitos."""
+    value = headers.get("content-length", "")
+    if not value:
+        return 0
+    if not (value.isascii() and value.isdigit()):
+        raise BadRequest(400)
+    return int(value)
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body=b""):
+        self.method = method
+        self.target = target
+        self.version = version
+        self.headers = headers  # nomes em minusculas
+        self.body = body
+        url = urlsplit(target)
+        self.path = unquote(url.path) or "/"
+        self.query = dict(parse_qsl(url.query))
+
+    @property
+    def keep_alive(self):
+        conn = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return conn == "keep-alive"
+        return conn != "close"
+
+
+class Response:
+    def __init__(self, status=200, body=b"", headers=None, content_type=None):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+        if content_type:
+            self.headers["Content-Type"] = content_type
+
+
+class StreamResponse(Response):
+    """Resposta sem Content-Length: o corpo vem de um async iterator e a
+    conexao fecha no fim (usado pelo SSE)."""
+
+    def __init__(self, chunks, headers=None, content_type=None):
+        super().__init__(200, b"", headers, content_type)
+        self.chunks = chunks
+
+
+def text_response(status, message=None):
+    return Response(status, (message or REASONS.get(status, "")).encode(), content_type="text/plain; charset=utf-8")
+
+
+def http_date(ts):
+    return email.utils.formatdate(ts, usegmt=True)
+
+
+def compress_variants(body, content_type):
+    """{'gzip': bytes, 'br': bytes} para conteudo textual com tamanho que compense."""
+    variants = {}
+    if len(body) < COMPRESS_MIN_BYTES or not content_type.startswith(COMPRESSIBLE):
+        return variants
+    gz = gzip.compress(body, 6, mtime=0)
+    if len(gz) < len(body):
+        variants["gzip"] = gz
+    if brotli is not None:
+        br = brotli.compress(body, quality=9)
+        if len(br) < len(body):
+            variants["br"] = br
+    return variants
+
+
+class Asset:
+    """Conteudo pronto para servir: corpo, variantes comprimidas e validadores."""
+
+    def __init__(self, body, content_type, mtime=None, cache_control="no-cache", etag=None):
+        self.body = body
+        self.content_type = content_type
+        self.mtime = int(mtime if mtime is not None else time.time())
+        self.last_modified = http_date(self.mtime)
+        self.cache_control = cache_control
+        self.etag = etag or '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.variants = compress_variants(body, content_type)
+        self.size = len(body) + sum(len(v) for v in self.variants.values())
+
+    def select(self, accept_encoding):
+        """(codificacao ou None, corpo) preferindo br, depois gzip, se o cliente aceitar."""
+        accepted = {e.split(";")[0].strip() for e in accept_encoding.lower().split(",")
+                    if not e.strip().endswith(";q=0")}
+        for enc in ("br", "gzip"):
+            if enc in self.variants and enc in accepted:
+                return enc, self.variants[enc]
+        return None, self.body
+
+
+def not_modified(request, asset):
+    """True se a requisicao condicional ainda vale (If-None-Match tem prioridade)."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or asset.etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return asset.mtime <= email.utils.parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def asset_response(request, asset, extra_headers=None):
+    """200 com a melhor variante comprimida, ou 304."""
+    headers = {
+        "ETag": asset.etag,
+        "Last-Modified": asset.last_modified,
+        "Cache-Control": asset.cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    headers.update(extra_headers or {})
+    if not_modified(request, asset):
+        return Response(304, b"", headers)
+    encoding, body = asset.select(request.headers.get("accept-encoding", ""))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(200, body, headers, asset.content_type)
+
+
+class StaticFiles:
+    """Arquivos de um diretorio mantidos em memoria.
+
+    Cada acesso confere (mtime, tamanho) com os.stat; o arquivo so e relido e
+    recomprimido quando muda. O cache e LRU limitado a max_bytes.
+    cache_control(caminho_relativo) define o Cache-Control de cada arquivo.
+    """
+
+    def __init__(self, root, cache_control=None, max_bytes=STATIC_CACHE_BYTES):
+        self.root = os.path.abspath(root)
+        self.cache_control = cache_control or (lambda rel: "no-cache")
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # rel -> (stat_key, Asset)
+        self.total = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0}
+
+    def resolve(self, path):
+        """Caminho relativo seguro (sem sair de root) ou None."""
+        rel = os.path.normpath(path.lstrip("/"))
+        if rel.startswith("..") or os.path.isabs(rel):
+            return None
+        return rel
+
+    def _stat(self, path):
+        rel = self.resolve(path)
+        if rel is None:
+            return None, None, None
+        full = os.path.join(self.root, rel)
+        try:
+            st = os.stat(full)
+        except OSError:
+            return rel, full, None
+        return rel, full, st
+
+    def _cached(self, rel, st):
+        with self.lock:
+            entry = self.entries.get(rel)
+            if entry and entry[0] == (st.st_mtime_ns, st.st_size):
+                self.entries.move_to_end(rel)
+                self.stats["hits"] += 1
+                return entry[1]
+        return None
+
+    def peek(self, path):
+        """Asset ja em memoria e ainda valido, sem ler o arquivo (so um stat)."""
+        rel, _, st = self._stat(path)
+        return self._cached(rel, st) if st is not None else None
+
+    def get(self, path):
+        """Asset do arquivo (lendo do disco se mudou) ou None se nao existe. Bloqueante."""
+        rel, full, st = self._stat(path)
+        if st is None or not os.path.isfile(full):
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        asset = self._cached(rel, st)
+        if asset is not None:
+            return asset
+        with open(full, "rb") as f:
+            body = f.read()
+        ctype = mimetypes.guess_type(full)[0] or "application/octet-stream"
+        if ctype.startswith("text/") or ctype == "application/json":
+            ctype += "; charset=utf-8"
+        asset = Asset(body, ctype, st.st_mtime, self.cache_control(rel))
+        with self.lock:
+            old = self.entries.pop(rel, None)
+            if old:
+                self.total -= old[1].size
+            self.entries[rel] = (key, asset)
+            self.total += asset.size
+            self.stats["loads"] += 1
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.total -= evicted.size
+        return asset
+
+
+def sse_message(data, event_id=None, event=None):
+    """Bytes de um evento SSE (data pode ter varias linhas)."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+class EventChannel:
+    """Canal Server-Sent Events com broadcast.
+
+    publish() pode ser chamado de qualquer thread (o atualizador roda numa
+    thread propria); a mensagem e codificada uma vez e colocada na fila de
+    cada cliente pelo event loop. Um unico timer manda o heartbeat para todos.
+    Cliente cuja fila enche (nao esta lendo) e desconectado.
+    """
+
+    def __init__(self, heartbeat=SSE_HEARTBEAT, queue_size=SSE_QUEUE_SIZE, retry_ms=SSE_RETRY_MS):
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.retry_ms = retry_ms
+        self.clients = set()
+        self.loop = None
+        self.stats = {"published": 0, "connected": 0, "dropped": 0}
+
+    def _attach(self):
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop.call_later(self.heartbeat, self._beat)
+
+    def _beat(self):
+        self._broadcast(b": ping\n\n")
+        self.loop.call_later(self.heartbeat, self._beat)
+
+    def _broadcast(self, message):
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.clients.discard(queue)
+                self.stats["dropped"] += 1
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    def publish(self, data, event_id=None, event=None):
+        """Envia para todos os clientes conectados; seguro fora do event loop."""
+        message = sse_message(data, event_id, event)
+        self.stats["published"] += 1
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._broadcast, message)
+
+    async def _stream(self, initial):
+        queue = asyncio.Queue(self.queue_size)
+        self.clients.add(queue)
+        self.stats["connected"] += 1
+        try:
+            yield f"retry: {self.retry_ms}\n\n".encode() + (initial or b"")
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.clients.discard(queue)
+
+    def response(self, initial=None):
+        """StreamResponse de um novo cliente; initial (bytes SSE) e enviado logo na conexao."""
+        self._attach()
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        return StreamResponse(self._stream(initial), headers, "text/event-stream; charset=utf-8")
+
+
+class HTTPServer:
+    """Servidor asyncio: handler(request) e uma corrotina que devolve Response.
+
+    O pool de `workers` threads (server.run_blocking) fica para o trabalho
+    bloqueante dos handlers; o loop so faz E/S de rede.
+    """
+
+    def __init__(self, handler, host="0.0.0.0", port=8080, workers=8, max_connections=MAX_CONNECTIONS):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self.max_connections = max_connections
+        self.connections = 0
+        self.stats = {"requests": 0, "rejected": 0, "errors": 0}
+        self.loop = None
+
+    async def run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+
+    async def _read_request(self, reader, timeout):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        except asyncio.LimitOverrunError:
+            raise BadRequest(413)
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise BadRequest(400)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        body = b""
+        length = content_length(headers)
+        if length > MAX_BODY_BYTES:
+            raise BadRequest(413)
+        if length:
+            body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT)
+        return Request(method, target, version, headers, body)
+
+    def _encode(self, request, response, keep_alive):
+        body = response.body if request is None or request.method != "HEAD" else b""
+        headers = response.headers
+        if not isinstance(response, StreamResponse):
+            headers.setdefault("Content-Length", str(len(response.body)))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        headers.setdefault("Date", http_date(time.time()))
+        status = f"HTTP/1.1 {response.status} {REASONS.get(response.status, '')}\r\n"
+        head = status + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+        return head.encode("latin-1") + body
+
+    async def _stream(self, writer, request, response):
+        """Cabecalho e depois cada pedaco do iterator, ate ele acabar ou o cliente cair."""
+        chunks = response.chunks
+        try:
+            writer.write(self._encode(request, response, False))
+            if request.method == "HEAD":
+                return
+            async for chunk in chunks:
+                writer.write(chunk)
+                await asyncio.wait_for(writer.drain(), SEND_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            await chunks.aclose()
+
+    async def _client(self, reader, writer):
+        self.connections += 1
+        try:
+            if self.connections > self.max_connections:
+                self.stats["rejected"] += 1
+                writer.write(self._encode(None, text_response(503), False))
+                await writer.drain()
+                return
+            timeout = HEADER_TIMEOUT
+            while True:
+                try:
+                    request = await self._read_request(reader, timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except BadRequest as ex:
+                    writer.write(self._encode(None, text_response(ex.status), False))
+                    await writer.drain()
+                    return
+                self.stats["requests"] += 1
+                try:
+                    response = await self.handler(request)
+                except Exception as ex:
+                    self.stats["errors"] += 1
+                    print(f"[HTTP] erro em {request.method} {request.target}: {ex!r}")
+                    response = text_response(500)
+                if isinstance(response, StreamResponse):
+                    await self._stream(writer, request, response)
+                    return
+                keep_alive = request.keep_alive
+                writer.write(self._encode(request, response, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    return
+                timeout = KEEPALIVE_TIMEOUT
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve_forever(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._client, self.host, self.port,
+                                            limit=MAX_HEADER_BYTES, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        """Bloqueia servindo ate o processo terminar."""
+        asyncio.run(self.serve_forever())